@@ -9,10 +9,11 @@ __date__ = 'May 17 2010'
 
 import threading
 from ctypes import *
-from Phidgets22.PhidgetLibrary import PhidgetLibrary
-from Phidgets22.Phidget import Phidget
-from Phidgets22.PhidgetException import PhidgetErrorCodes, PhidgetException
-from Phidgets22.Events.Events import AccelerationChangeEventArgs
+# the Phidget21 Python library this file comes from: pip install Phidgets==2.1.8, plus libphidget21
+from Phidgets.PhidgetLibrary import PhidgetLibrary
+from Phidgets.Phidget import Phidget
+from Phidgets.PhidgetException import PhidgetErrorCodes, PhidgetException
+from Phidgets.Events.Events import AccelerationChangeEventArgs
 import sys
 
 class Accelerometer(Phidget):
@@ -31,9 +32,13 @@ class Accelerometer(Phidget):
         Exceptions:
             RuntimeError - If current platform is not supported/phidget c dll cannot be found
         """
+        if sys.platform.startswith('linux') and PhidgetLibrary._PhidgetLibrary__dll is None:
+            # PhidgetLibrary only knows Python 2's 'linux2'
+            PhidgetLibrary._PhidgetLibrary__dll = cdll.LoadLibrary("libphidget21.so.0")
         Phidget.__init__(self)
         
         self.__accelChange = None
+        self.__axisChange = None
         
         self.__onAccelChange = None
         
@@ -44,7 +49,7 @@ class Accelerometer(Phidget):
         
         if sys.platform == 'win32':
             self.__ACCELCHANGEHANDLER = WINFUNCTYPE(c_int, c_void_p, c_void_p, c_int, c_double)
-        elif sys.platform == 'darwin' or sys.platform == 'linux2':
+        elif sys.platform == 'darwin' or sys.platform.startswith('linux'):
             self.__ACCELCHANGEHANDLER = CFUNCTYPE(c_int, c_void_p, c_void_p, c_int, c_double)
 
     def __del__(self):
@@ -207,7 +212,9 @@ class Accelerometer(Phidget):
             raise PhidgetException(result)
 
     def __nativeAccelerationChangeEvent(self, handle, usrptr, index, value):
-        if self.__accelChange != None:
+        if self.__axisChange != None:
+            self.__axisChange(self, index, value)
+        elif self.__accelChange != None:
             self.__accelChange(AccelerationChangeEventArgs(self, index, value))
         return 0
 
@@ -239,3 +246,35 @@ class Accelerometer(Phidget):
         
         if result > 0:
             raise PhidgetException(result)
+
+    def setOnAxisChangeHandler(self, axisChangeHandler):
+        """Sets an acceleration change handler that is called without building event arguments.
+        
+        The handler is called as axisChangeHandler(accelerometer, index, value) for every axis change,
+        which avoids allocating an AccelerationChangeEventArgs per event at high data rates.
+        It takes precedence over a handler set with setOnAccelerationChangeHandler.
+        
+        Parameters:
+            axisChangeHandler: hook to the axisChangeHandler callback function.
+        
+        Exceptions:
+            RuntimeError - If current platform is not supported/phidget c dll cannot be found
+            PhidgetException
+        """
+        if axisChangeHandler == None:
+            self.__axisChange = None
+            if self.__accelChange == None:
+                self.__onAccelChange = None
+        else:
+            self.__axisChange = axisChangeHandler
+            self.__onAccelChange = self.__ACCELCHANGEHANDLER(self.__nativeAccelerationChangeEvent)
+        
+        try:
+            result = PhidgetLibrary.getDll().CPhidgetAccelerometer_set_OnAccelerationChange_Handler(self.handle, self.__onAccelChange, None)
+        except RuntimeError:
+            self.__axisChange = None
+            self.__onAccelChange = None
+            raise
+        
+        if result > 0:
+            raise PhidgetException(result)
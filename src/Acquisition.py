@@ -0,0 +1,313 @@
+""" Sensor acquisition, either inside the web server's event loop or as its own process.
+
+In split mode (rtcbotserver.py --split) this file runs as a separate process that owns
+the Phidget devices, TiltData and SpinData, and writes samples, gesture frames,
+calibration and metrics into a SharedRing that the web process reads. aiortc's crypto,
+aiohttp and the garbage collector then no longer share a GIL with the sensor callbacks.
+"""
+import argparse
+import json as JSON
+import logging
+import os
+import os.path
+import signal
+import subprocess
+import sys
+import time
+from SharedRing import SharedRing
+from RunningStats import DecayingStats
+from GestureFusion import GestureFusion
+from AdaptiveSampler import AdaptiveSampler
+
+
+class GestureSource:
+    """ The sensor half of the server loop: gesture frames from TiltData and SpinData """
+
+    def __init__(self, tiltdata, spindata, sampler=None, fusion=None):
+        self.tiltdata = tiltdata
+        self.spindata = spindata
+        self.sampler = sampler
+        self.fusion = fusion
+
+    def start(self):
+        self.tiltdata.level_table()
+
+    def poll(self):
+        """ Returns the (message, source) pairs that are ready to send """
+        retval = []
+        if self.sampler:
+            self.sampler.update()
+        self.tiltdata.pollAxes()
+        if (self.tiltdata.gestureProcessor.run()):
+            outbound_message = self.tiltdata.gestureProcessor.nextAction()
+            if self.fusion:
+                self.fusion.offer(outbound_message, self.tiltdata.lastSampleTime)
+            else:
+                retval.append((outbound_message, 'tilt'))
+        # knocks and shakes are not tilt, fusion has nothing to pair them with
+        for outbound_message in self.tiltdata.vibrationGestures():
+            retval.append((outbound_message, 'vibration'))
+        if (self.spindata.gestureProcessor.run()):
+            outbound_message = self.spindata.gestureProcessor.nextAction()
+            if self.fusion:
+                self.fusion.offer(outbound_message, self.spindata.deviceTime)
+            else:
+                retval.append((outbound_message, 'spin'))
+        if self.fusion:
+            for outbound_message in self.fusion.collect():
+                retval.append((outbound_message, 'fused'))
+        return retval
+
+    def getCalibration(self):
+        return self.tiltdata.getCalibration()
+
+    def recalibrate(self):
+        self.tiltdata.recalibrate()
+
+    def getMetrics(self):
+        report = { 'tilt': self.tiltdata.getMetrics(),
+                   'spin': self.spindata.getMetrics() }
+        if self.sampler:
+            report['sampling'] = self.sampler.getMetrics()
+        return report
+
+
+class IdleGestureSource:
+    """ Stands in for the sensors when the server runs without devices """
+
+    def start(self):
+        pass
+
+    def poll(self):
+        return []
+
+    def getCalibration(self):
+        return {}
+
+    def recalibrate(self):
+        pass
+
+    def getMetrics(self):
+        return {}
+
+
+def makeGestureSource(config, tiltdata, spindata, devices=True):
+    sampler = None
+    if config['idleTimeout'] > 0:
+        # full data rate only while someone is using the table
+        if devices:
+            sampler = AdaptiveSampler(config, tiltdata.tiltChannel(), spindata.encoderChannel(), tiltdata.clock)
+        else:
+            sampler = AdaptiveSampler(config, clock=tiltdata.clock)
+        tiltdata.sampler = sampler
+        spindata.sampler = sampler
+    # tilt and spin that happen together go out as one combo frame
+    fusion = GestureFusion(config, tiltdata.clock) if config['fusionWindow'] > 0 else None
+    return GestureSource(tiltdata, spindata, sampler, fusion)
+
+
+class AcquisitionClient:
+    """ The web process's view of a separate acquisition process, polled like a GestureSource.
+
+    Starts Acquisition.py on a new SharedRing and starts it again if it dies, handing it
+    the latest calibration it published. One that dies within a minute of starting waits
+    twice as long as last time before the next start, up to maxBackoff seconds, so a
+    process that cannot run does not reopen the devices over and over.
+    """
+
+    def __init__(self, config, calibration=None, logfilename=None, slots=1024, slotSize=512, maxBackoff=60.0):
+        self.config = config
+        self.calibration = calibration or {}
+        self.logfilename = logfilename
+        self.ring = SharedRing(slots=slots, slotSize=slotSize, create=True)
+        self.metrics = {}
+        self.lastSample = None
+        self.samples = 0
+        self.gestures = 0
+        self.restarts = 0
+        self.publishFailures = 0
+        self.backoff = 0.5
+        self.maxBackoff = maxBackoff
+        self.relaunchAt = None
+        self.latency = DecayingStats(0.01)
+        self.maxLatency = 0.0
+        self.process = None
+        self._logger = logging.getLogger('acquisition')
+        self.launch()
+
+    def launch(self):
+        d = {'clientip': "acquisition", 'user': "launch"}
+        command = [ sys.executable, os.path.abspath(__file__),
+                    '--ring', self.ring.name,
+                    '--config', JSON.dumps(self.config),
+                    '--calibration', JSON.dumps(self.calibration) ]
+        if self.logfilename:
+            command += ['--logfilename', self.logfilename]
+        self.process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.launched = time.time()
+        self._logger.info('acquisition process started: %s', "pid %d ring %s" % (self.process.pid, self.ring.name), extra=d)
+
+    def start(self):
+        # whatever gestures were made before anyone was watching are stale
+        self.poll()
+
+    def poll(self):
+        retval = []
+        now = time.time()
+        for sequence, stamp, payload in self.ring.read():
+            record = JSON.loads(payload)
+            kind = record['type']
+            if kind == 'gesture':
+                retval.append((record['message'], record['source']))
+                self.gestures += 1
+                self.latency.add(now - stamp)
+                self.maxLatency = max(self.maxLatency, now - stamp)
+            elif kind == 'sample':
+                self.lastSample = record
+                self.samples += 1
+            elif kind == 'calibration':
+                self.calibration = record['calibration']
+            elif kind == 'metrics':
+                self.metrics = record['metrics']
+                self.publishFailures = record.get('publishFailures', 0)
+        if self.relaunchAt is None and self.process.poll() is not None:
+            if now - self.launched >= 60.0:
+                self.backoff = 1.0
+            else:
+                self.backoff = min(self.maxBackoff, self.backoff * 2)
+            self.relaunchAt = now + self.backoff
+            d = {'clientip': "acquisition", 'user': "poll"}
+            self._logger.critical('acquisition process exited: %s', "code %s, restarting in %.0fs"
+                                  % (self.process.returncode, self.backoff), extra=d)
+        if self.relaunchAt is not None and now >= self.relaunchAt:
+            self.relaunchAt = None
+            self.restarts += 1
+            self.launch()
+        return retval
+
+    def getCalibration(self):
+        return self.calibration
+
+    def recalibrate(self):
+        # the acquisition process levels again on SIGUSR1 and publishes the new zeros; a
+        # restart before then must not bring the old ones back
+        self.calibration = {}
+        if self.relaunchAt is None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGUSR1)
+
+    def getMetrics(self):
+        report = dict(self.metrics)
+        report['acquisition'] = { 'pid': self.process.pid,
+                                  'running': self.relaunchAt is None,
+                                  'restarts': self.restarts,
+                                  'backoff': self.backoff,
+                                  'publishFailures': self.publishFailures,
+                                  'gestures': self.gestures,
+                                  'samples': self.samples,
+                                  'lastSample': self.lastSample,
+                                  'overruns': self.ring.overruns,
+                                  'meanLatency': self.latency.mean,
+                                  'maxLatency': self.maxLatency }
+        return report
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.ring.close()
+
+
+def publish(ring, record):
+    """ False if the record could not be written, which must not stop the sensors """
+    try:
+        ring.write(JSON.dumps(record, separators=(',', ':')).encode())
+    except (ValueError, TypeError) as e:
+        d = {'clientip': "acquisition", 'user': "publish"}
+        logging.getLogger('acquisition').error('%s record not published: %s', record.get('type'), e, extra=d)
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tiltyacquisition', description='Read the Phidget sensors into a shared memory ring.')
+    parser.add_argument('--ring', required=True,
+                        help='name of the shared memory ring created by the web process')
+    parser.add_argument('--config', required=True,
+                        help='the web process\'s config dict as JSON')
+    parser.add_argument('--calibration', default='{}',
+                        help='calibration to start from as JSON')
+    parser.add_argument('--logfilename',
+                        help='where to log (default: stderr)')
+    parser.add_argument('--interval',
+                        type=float, dest='interval',
+                        default=0.008,
+                        help='seconds between gesture processing passes')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)-15s  %(message)s'
+    logging.basicConfig(format=FORMAT, level=logging.INFO, filename=args.logfilename)
+    logger = logging.getLogger('acquisition')
+    config = JSON.loads(args.config)
+    ring = SharedRing(args.ring)
+
+    # imported here so only the acquisition side opens the devices
+    from TiltData import TiltData
+    from SpinData import SpinData
+    tiltdata = TiltData(config=config)
+    spindata = SpinData(config=config)
+    tiltdata.restoreCalibration(JSON.loads(args.calibration))
+    source = makeGestureSource(config, tiltdata, spindata)
+    source.start()
+    relevel = []
+    signal.signal(signal.SIGUSR1, lambda signum, frame: relevel.append(signum))
+
+    d = {'clientip': "acquisition", 'user': "main"}
+    logger.info('acquisition running: %s', "ring %s pid %d" % (ring.name, os.getpid()), extra=d)
+    parent = os.getppid()
+    calibration = None
+    lastSample = None
+    lastMetrics = 0.0
+    failures = 0
+    deadline = time.monotonic()
+    try:
+        while os.getppid() == parent:
+            if relevel:
+                del relevel[:]
+                source.recalibrate()
+            for outbound_message, origin in source.poll():
+                if not publish(ring, { 'type': 'gesture', 'source': origin, 'message': outbound_message }):
+                    failures += 1
+            if tiltdata.lastSampleTime != lastSample:
+                lastSample = tiltdata.lastSampleTime
+                if not publish(ring, { 'type': 'sample', 'time': tiltdata.lastSampleTime,
+                                       'tilt': [ c.head() for c in tiltdata.components ] }):
+                    failures += 1
+            now = time.time()
+            if now - lastMetrics >= 1.0:
+                lastMetrics = now
+                if not publish(ring, { 'type': 'metrics', 'metrics': source.getMetrics(),
+                                       'publishFailures': failures }):
+                    failures += 1
+                current = source.getCalibration()
+                if current != calibration:
+                    if publish(ring, { 'type': 'calibration', 'calibration': current }):
+                        calibration = current
+                    else:
+                        failures += 1
+            deadline += args.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    logger.info('acquisition stopping: %s', "parent %d gone" % parent, extra=d)
+    ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import logging
+from Clock import systemClock
+
+
+class AdaptiveSampler:
+    """ Drops the accelerometer and encoder to a low data rate while nobody is using the table.
+
+    After idleTimeout seconds without motion the accelerometer is set to idleTiltSampleRate
+    with the coarse idleTiltThreshold change trigger, and the encoder to idleEncoderInterval.
+    The first deflection beyond idleTiltThreshold, or any encoder tick, switches both back to
+    full rate. While active, deflections beyond the ordinary tiltThreshold keep it awake, so
+    waking needs a bigger push than staying awake (hysteresis).
+    A Spatial (the tilt filter's channel) has no change trigger, so it only drops its data
+    rate and goes back to its fastest.
+
+    Sensor callbacks only note motion; device rates are changed from update(), which the
+    server loop calls, and the time between the two is kept as the wake latency.
+    """
+
+    def __init__(self, config, accelerometer=None, encoder=None, clock=None):
+        self.clock = clock or systemClock
+        self.accelerometer = accelerometer
+        self.encoder = encoder
+        self.idleTimeout = config['idleTimeout']
+        self.fullTiltRate = config['tiltSampleRate']
+        self.fullTiltTrigger = config['tiltThreshold']
+        self.idleTiltRate = config['idleTiltSampleRate']
+        self.idleTiltTrigger = config['idleTiltThreshold']
+        self.idleEncoderInterval = config['idleEncoderInterval']
+        self.state = 'active'
+        self.lastMotion = self.clock.time()
+        self.motionSince = None
+        self.transitions = {'idle': 0, 'active': 0}
+        self.lastTransition = self.lastMotion
+        self.lastWakeLatency = 0.0
+        self.maxWakeLatency = 0.0
+        self._logger = logging.getLogger('adaptivesampler')
+
+    def noteTilt(self, x, y):
+        deflection = max(abs(x), abs(y))
+        threshold = self.idleTiltTrigger if self.state == 'idle' else self.fullTiltTrigger
+        if deflection > threshold:
+            self.noteMotion()
+
+    def noteSpin(self, positionChange):
+        if positionChange:
+            self.noteMotion()
+
+    def noteMotion(self):
+        now = self.clock.time()
+        self.lastMotion = now
+        if self.state == 'idle' and self.motionSince is None:
+            self.motionSince = now
+
+    def update(self):
+        now = self.clock.time()
+        if self.state == 'idle' and self.motionSince is not None:
+            self.setRates(self.fullTiltRate, self.fullTiltTrigger, None)
+            self.lastWakeLatency = self.clock.time() - self.motionSince
+            self.maxWakeLatency = max(self.maxWakeLatency, self.lastWakeLatency)
+            self.motionSince = None
+            self.transition('active', now)
+        elif self.state == 'active' and now - self.lastMotion > self.idleTimeout:
+            self.setRates(self.idleTiltRate, self.idleTiltTrigger, self.idleEncoderInterval)
+            self.transition('idle', now)
+
+    def transition(self, state, now):
+        d = {'clientip': "sampler", 'user': "update"}
+        self._logger.info('sampling %s: %s', state, "after %.1fs wake latency %.4fs" % (now - self.lastTransition, self.lastWakeLatency), extra=d)
+        self.state = state
+        self.transitions[state] += 1
+        self.lastTransition = now
+
+    def setRates(self, tiltRate, tiltTrigger, encoderInterval):
+        d = {'clientip': "sampler", 'user': "setRates"}
+        try:
+            if self.accelerometer and not hasattr(self.accelerometer, 'setAccelerationChangeTrigger'):
+                # a Spatial has no change trigger, and the tilt filter wants every sample it can get
+                if tiltRate == self.fullTiltRate:
+                    self.accelerometer.setDataInterval(self.accelerometer.getMinDataInterval())
+                else:
+                    self.accelerometer.setDataRate(tiltRate)
+            elif self.accelerometer:
+                self.accelerometer.setDataRate(tiltRate)
+                self.accelerometer.setAccelerationChangeTrigger(tiltTrigger)
+            if self.encoder:
+                if encoderInterval is None:
+                    encoderInterval = self.encoder.getMinDataInterval()
+                self.encoder.setDataInterval(encoderInterval)
+        except Exception as e:
+            self._logger.error('could not change data rate: %s', e, extra=d)
+
+    def getMetrics(self):
+        return { 'state': self.state,
+                 'secondsInState': self.clock.time() - self.lastTransition,
+                 'transitions': dict(self.transitions),
+                 'lastWakeLatency': self.lastWakeLatency,
+                 'maxWakeLatency': self.maxWakeLatency,
+                 'idleTimeout': self.idleTimeout,
+                 'wakeThreshold': self.idleTiltTrigger,
+                 'stayAwakeThreshold': self.fullTiltTrigger,
+                 'fullTiltRate': self.fullTiltRate,
+                 'idleTiltRate': self.idleTiltRate,
+                 'idleEncoderInterval': self.idleEncoderInterval }
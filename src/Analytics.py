@@ -0,0 +1,235 @@
+""" How visitors use the table: gestures, hotspots, time spent at each zoom layer and where they pan.
+
+The server loop only increments counters in memory, keyed by a fixed size time bucket;
+a background thread swaps the counters out every flushInterval seconds and adds them to
+a SQLite database in one transaction. The same module reports on the database:
+
+    python Analytics.py --db /var/lib/tilty/analytics.db summary --since 7d
+    python Analytics.py --db analytics.db hotspots
+    python Analytics.py --db analytics.db heat --top 20
+"""
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS gestures (bucket INTEGER, gesture TEXT, count INTEGER, PRIMARY KEY (bucket, gesture));
+CREATE TABLE IF NOT EXISTS hotspots (bucket INTEGER, site TEXT, opens INTEGER, seconds REAL, PRIMARY KEY (bucket, site));
+CREATE TABLE IF NOT EXISTS dwell (bucket INTEGER, layer INTEGER, seconds REAL, PRIMARY KEY (bucket, layer));
+CREATE TABLE IF NOT EXISTS heat (bucket INTEGER, row INTEGER, col INTEGER, count INTEGER, PRIMARY KEY (bucket, row, col));
+"""
+
+
+class Analytics:
+    """ In memory counters for the current bucket(s), flushed to SQLite off the server loop.
+
+    Every note*() call is a dict increment or two. Pans are counted in a lat/lng grid of
+    gridSize degree cells at wherever the view ended up. Dwell is counted per whole zoom
+    layer from the gaps between tick() calls, but only while the last gesture is less than
+    idleTimeout seconds old, and hotspot time from enter to exit.
+    """
+
+    def __init__(self, path, bucketSeconds=60, flushInterval=30.0, gridSize=0.01, idleTimeout=120):
+        self.path = path
+        self.bucketSeconds = bucketSeconds
+        self.flushInterval = flushInterval
+        self.gridSize = gridSize
+        self.idleTimeout = idleTimeout
+        self.lastGesture = None
+        self.lock = threading.Lock()
+        self.counts = self.emptyCounts()
+        self.lastTick = None
+        self.opened = {}
+        self.flushes = 0
+        self.flushedRows = 0
+        self.lastFlushSeconds = 0.0
+        self.errors = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self._logger = logging.getLogger('analytics')
+
+    @staticmethod
+    def emptyCounts():
+        return { 'gestures': {}, 'hotspots': {}, 'dwell': {}, 'heat': {} }
+
+    def bucket(self, now):
+        return int(now // self.bucketSeconds) * self.bucketSeconds
+
+    def noteGesture(self, gesture, lat=None, lng=None, now=None):
+        if now is None:
+            now = time.time()
+        bucket = self.bucket(now)
+        self.lastGesture = now
+        with self.lock:
+            gestures = self.counts['gestures']
+            key = (bucket, gesture)
+            gestures[key] = gestures.get(key, 0) + 1
+            if lat is not None and gesture != 'zoom':
+                heat = self.counts['heat']
+                key = (bucket, int(math.floor(lat / self.gridSize)), int(math.floor(lng / self.gridSize)))
+                heat[key] = heat.get(key, 0) + 1
+
+    def noteHotspot(self, event, site, now=None):
+        if now is None:
+            now = time.time()
+        bucket = self.bucket(now)
+        with self.lock:
+            hotspots = self.counts['hotspots']
+            opens, seconds = hotspots.get((bucket, site), (0, 0.0))
+            if event == 'enter':
+                self.opened[site] = now
+                opens += 1
+            elif event == 'exit' and site in self.opened:
+                seconds += now - self.opened.pop(site)
+            hotspots[(bucket, site)] = (opens, seconds)
+
+    def tick(self, zoom, now=None):
+        """ Called every pass of the server loop with the current zoom """
+        if now is None:
+            now = time.time()
+        if self.lastTick is not None and self.lastGesture is not None and now - self.lastGesture < self.idleTimeout:
+            key = (self.bucket(now), int(zoom))
+            with self.lock:
+                dwell = self.counts['dwell']
+                dwell[key] = dwell.get(key, 0.0) + (now - self.lastTick)
+        self.lastTick = now
+
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.executescript(_schema)
+        return db
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='analytics', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        d = {'clientip': "analytics", 'user': "run"}
+        try:
+            db = self.connect()
+        except (OSError, sqlite3.Error) as e:
+            self._logger.error('analytics off, cannot open %s: %s', self.path, e, extra=d)
+            self.errors += 1
+            return
+        try:
+            while not self.stopping.wait(self.flushInterval):
+                self.flush(db)
+            self.flush(db)
+        finally:
+            db.close()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+
+    def flush(self, db):
+        with self.lock:
+            counts, self.counts = self.counts, self.emptyCounts()
+        rows = sum(len(table) for table in counts.values())
+        if rows == 0:
+            return 0
+        start = time.perf_counter()
+        try:
+            with db:
+                db.executemany("INSERT INTO gestures VALUES (?, ?, ?) ON CONFLICT (bucket, gesture) "
+                               "DO UPDATE SET count = count + excluded.count",
+                               [ key + (count,) for key, count in counts['gestures'].items() ])
+                db.executemany("INSERT INTO hotspots VALUES (?, ?, ?, ?) ON CONFLICT (bucket, site) "
+                               "DO UPDATE SET opens = opens + excluded.opens, seconds = seconds + excluded.seconds",
+                               [ key + value for key, value in counts['hotspots'].items() ])
+                db.executemany("INSERT INTO dwell VALUES (?, ?, ?) ON CONFLICT (bucket, layer) "
+                               "DO UPDATE SET seconds = seconds + excluded.seconds",
+                               [ key + (seconds,) for key, seconds in counts['dwell'].items() ])
+                db.executemany("INSERT INTO heat VALUES (?, ?, ?, ?) ON CONFLICT (bucket, row, col) "
+                               "DO UPDATE SET count = count + excluded.count",
+                               [ key + (count,) for key, count in counts['heat'].items() ])
+        except sqlite3.Error as e:
+            d = {'clientip': "analytics", 'user': "flush"}
+            self._logger.error('dropped %d analytics rows: %s', rows, e, extra=d)
+            self.errors += 1
+            return 0
+        self.flushes += 1
+        self.flushedRows += rows
+        self.lastFlushSeconds = time.perf_counter() - start
+        return rows
+
+    def getMetrics(self):
+        with self.lock:
+            pending = sum(len(table) for table in self.counts.values())
+        return { 'path': self.path,
+                 'pendingRows': pending,
+                 'flushes': self.flushes,
+                 'flushedRows': self.flushedRows,
+                 'lastFlushSeconds': self.lastFlushSeconds,
+                 'errors': self.errors }
+
+
+def parseSince(text):
+    """ '7d', '12h', '30m' or a number of seconds, back from now """
+    if not text:
+        return 0
+    units = { 'd': 86400, 'h': 3600, 'm': 60, 's': 1 }
+    if text[-1] in units:
+        return time.time() - float(text[:-1]) * units[text[-1]]
+    return time.time() - float(text)
+
+
+def summary(db, since):
+    rows = db.execute("SELECT gesture, SUM(count) FROM gestures WHERE bucket >= ? GROUP BY gesture ORDER BY 2 DESC", (since,))
+    print("%-12s %10s" % ('gesture', 'count'))
+    for gesture, count in rows:
+        print("%-12s %10d" % (gesture, count))
+    rows = db.execute("SELECT layer, SUM(seconds) FROM dwell WHERE bucket >= ? GROUP BY layer ORDER BY layer", (since,))
+    print("\n%-12s %10s" % ('zoom layer', 'minutes'))
+    for layer, seconds in rows:
+        print("%-12d %10.1f" % (layer, seconds / 60.0))
+
+
+def hotspots(db, since):
+    rows = db.execute("SELECT site, SUM(opens), SUM(seconds) FROM hotspots WHERE bucket >= ? GROUP BY site ORDER BY 2 DESC", (since,))
+    print("%-24s %8s %12s" % ('hotspot', 'opens', 'mean open s'))
+    for site, opens, seconds in rows:
+        print("%-24s %8d %12.1f" % (site, opens, seconds / opens if opens else 0.0))
+
+
+def heat(db, since, gridSize, top):
+    rows = db.execute("SELECT row, col, SUM(count) FROM heat WHERE bucket >= ? GROUP BY row, col ORDER BY 3 DESC LIMIT ?", (since, top))
+    print("%-24s %10s" % ('cell (lat, lng)', 'pans'))
+    for row, col, count in rows:
+        print("%-24s %10d" % ("%.4f, %.4f" % ((row + 0.5) * gridSize, (col + 0.5) * gridSize), count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report on the table\'s interaction analytics.')
+    parser.add_argument('--db', default='/var/lib/tilty/analytics.db',
+                        help='analytics database (default: /var/lib/tilty/analytics.db)')
+    parser.add_argument('--since', default='',
+                        help='only count the last so long, e.g. 7d, 12h, 30m (default: everything)')
+    parser.add_argument('--gridSize', type=float, default=0.01,
+                        help='heat grid cell size the server was run with, in degrees (default: 0.01)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='heat cells to list (default: 20)')
+    parser.add_argument('report', nargs='?', default='summary', choices=['summary', 'hotspots', 'heat'])
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.db)
+    since = parseSince(args.since)
+    if args.report == 'summary':
+        summary(db, since)
+    elif args.report == 'hotspots':
+        hotspots(db, since)
+    else:
+        heat(db, since, args.gridSize, args.top)
+
+
+if __name__ == '__main__':
+    main()
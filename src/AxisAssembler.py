@@ -0,0 +1,64 @@
+from array import array
+import threading
+import time
+
+
+class AxisAssembler:
+    """ Joins one-axis-at-a-time acceleration callbacks into timestamped 3-axis samples.
+
+    The legacy ctypes Accelerometer reports every axis separately. Values are collected
+    in a preallocated scratch buffer until every axis has reported, or until timeout
+    seconds have passed since the first one did, and then handed to sink as
+    sink(sample, timestamp) - the same shape the Phidget22 whole-vector callback uses,
+    and the same time base: milliseconds since the first axis arrived, as Phidget22 counts
+    from the channel opening. A partial sample only goes out on the next axis or poll(), so
+    the consumer's loop calls poll(). Axes that did not report in time keep their previous
+    value. The sample buffer is reused for every call so sinks must copy anything they
+    want to keep.
+    """
+
+    def __init__(self, sink, axisCount=3, timeout=0.004):
+        self.sink = sink
+        self.axisCount = axisCount
+        self.timeout = timeout
+        self.values = array('d', [0.0] * axisCount)
+        self.sample = array('d', [0.0] * axisCount)
+        self.fresh = 0
+        self.complete = (1 << axisCount) - 1
+        self.firstArrival = 0.0
+        self.epoch = None
+        self.assembled = 0
+        self.timedOut = 0
+        self.lock = threading.Lock()
+
+    def ingestAxis(self, index, value, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.epoch is None:
+                self.epoch = now
+            if self.fresh and (now - self.firstArrival > self.timeout or self.fresh & (1 << index)):
+                # the rest of the previous sample is not coming
+                self.timedOut += 1
+                self._flush()
+            if not self.fresh:
+                self.firstArrival = now
+            self.values[index] = value
+            self.fresh |= 1 << index
+            if self.fresh == self.complete:
+                self.assembled += 1
+                self._flush()
+
+    def poll(self, now=None):
+        """ Flushes a partial sample whose missing axes are overdue """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.fresh and now - self.firstArrival > self.timeout:
+                self.timedOut += 1
+                self._flush()
+
+    def _flush(self):
+        self.sample[:] = self.values
+        self.fresh = 0
+        self.sink(self.sample, (self.firstArrival - self.epoch) * 1000.0)
@@ -0,0 +1,30 @@
+import time
+
+
+class SystemClock:
+    """ Wall clock seconds, what the sensors and gesture processors use on the table """
+
+    def time(self):
+        return time.time()
+
+
+class VirtualClock:
+    """ Seconds that only move when told to, so recorded or synthetic input can be pushed
+    through the gesture logic as fast as it will go and give the same answer every run.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def set(self, now):
+        self.now = now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
+
+
+systemClock = SystemClock()
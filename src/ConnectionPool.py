@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import logging
+import time
+from rtcbot import RTCConnection
+
+
+class ConnectionPool:
+    """ RTCConnections with their offer made and ICE candidates gathered, waiting for a display.
+
+    A display asks for an offer with take(), answers it, and the answer is matched back to
+    its connection with claim(). Taking an entry starts a background refill, so a kiosk
+    reload does not wait for peer connection setup or ICE gathering. Entries older than
+    maxAge seconds are closed and replaced, their server reflexive candidates may have gone
+    stale.
+    """
+
+    def __init__(self, size=2, maxAge=300.0, claimTimeout=30.0):
+        self.size = size
+        self.maxAge = maxAge
+        self.claimTimeout = claimTimeout
+        self.entries = []
+        self.handedOut = {}
+        self.ids = itertools.count(1)
+        self.filling = None
+        self.hits = 0
+        self.misses = 0
+        self.lastGatherTime = 0.0
+        self.maxGatherTime = 0.0
+        self._logger = logging.getLogger('connectionpool')
+
+    async def create(self):
+        start = time.time()
+        conn = RTCConnection()
+        # creates the default channel and the offer, and waits for ICE gathering to finish
+        offer = await conn.getLocalDescription()
+        self.lastGatherTime = time.time() - start
+        self.maxGatherTime = max(self.maxGatherTime, self.lastGatherTime)
+        return { 'id': next(self.ids), 'conn': conn, 'offer': offer, 'created': time.time() }
+
+    async def fill(self):
+        d = {'clientip': "pool", 'user': "fill"}
+        try:
+            while len(self.entries) < self.size:
+                self.entries.append(await self.create())
+                self._logger.debug('pooled connection ready: %s', "gathered in %.3fs" % self.lastGatherTime, extra=d)
+        except Exception as e:
+            self._logger.error('could not pre-create a connection: %s', e, extra=d)
+        finally:
+            self.filling = None
+
+    def start(self):
+        if self.size > 0 and self.filling is None:
+            self.filling = asyncio.ensure_future(self.fill())
+
+    async def closeEntries(self, entries):
+        # RTCConnection.close is a coroutine, a close that is not awaited leaves the ICE/DTLS state behind
+        d = {'clientip': "pool", 'user': "close"}
+        results = await asyncio.gather(*[ entry['conn'].close() for entry in entries ], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self._logger.error('could not close a pooled connection: %s', result, extra=d)
+
+    async def expire(self, now):
+        expired = [ e for e in self.entries if now - e['created'] > self.maxAge ]
+        for entry in expired:
+            self.entries.remove(entry)
+        for id, entry in list(self.handedOut.items()):
+            if now - entry['handedOut'] > self.claimTimeout:
+                # offered to a display that never answered
+                del self.handedOut[id]
+                expired.append(entry)
+        await self.closeEntries(expired)
+
+    async def take(self):
+        """ Returns (id, offer) for the next display """
+        now = time.time()
+        await self.expire(now)
+        if self.entries:
+            entry = self.entries.pop(0)
+            self.hits += 1
+        else:
+            entry = await self.create()
+            self.misses += 1
+        entry['handedOut'] = time.time()
+        self.handedOut[entry['id']] = entry
+        self.start()
+        return entry['id'], entry['offer']
+
+    def claim(self, id):
+        """ The connection offered as id, and when its offer was asked for; KeyError if unknown or expired """
+        entry = self.handedOut.pop(id)
+        return entry['conn'], entry['handedOut']
+
+    def getMetrics(self):
+        return { 'pooled': len(self.entries),
+                 'size': self.size,
+                 'awaitingAnswer': len(self.handedOut),
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'lastGatherTime': self.lastGatherTime,
+                 'maxGatherTime': self.maxGatherTime }
+
+    async def close(self):
+        if self.filling is not None:
+            self.filling.cancel()
+        entries = self.entries + list(self.handedOut.values())
+        self.entries = []
+        self.handedOut = {}
+        await self.closeEntries(entries)
@@ -0,0 +1,218 @@
+import gzip
+import json as JSON
+import logging
+import math
+import os
+import os.path
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ A small least-recently-used map, safe to share between executor threads """
+    def __init__(self, maxEntries=64):
+        self.items = OrderedDict()
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxEntries:
+                self.items.popitem(last=False)
+
+    def size(self):
+        return len(self.items)
+
+
+def simplifyLine(points, tolerance):
+    """ Douglas-Peucker: drop points closer than tolerance to the line through their neighbours """
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = points[first][0], points[first][1]
+        dx = points[last][0] - x0
+        dy = points[last][1] - y0
+        length = math.hypot(dx, dy)
+        maxDistance = 0.0
+        index = first
+        for i in range(first + 1, last):
+            px = points[i][0] - x0
+            py = points[i][1] - y0
+            if length:
+                distance = abs(px * dy - py * dx) / length
+            else:
+                distance = math.hypot(px, py)
+            if distance > maxDistance:
+                maxDistance = distance
+                index = i
+        if maxDistance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def quantize(points, decimals):
+    retval = []
+    for point in points:
+        quantized = [round(point[0], decimals), round(point[1], decimals)]
+        if not retval or quantized != retval[-1]:
+            retval.append(quantized)
+    return retval
+
+
+def simplifyRing(ring, tolerance, decimals):
+    simplified = quantize(simplifyLine(ring, tolerance), decimals)
+    if len(simplified) < 4:
+        return None
+    if simplified[0] != simplified[-1]:
+        simplified.append(simplified[0])
+    return simplified
+
+
+def simplifyPolygon(rings, tolerance, decimals):
+    retval = []
+    for ring in rings:
+        simplified = simplifyRing(ring, tolerance, decimals)
+        if simplified:
+            retval.append(simplified)
+        elif not retval:
+            # the outer ring collapsed at this zoom so the whole polygon is too small to see
+            return None
+    return retval
+
+
+def simplifyGeometry(geometry, tolerance, decimals):
+    if not geometry:
+        return geometry
+    kind = geometry['type']
+    coordinates = geometry.get('coordinates')
+    if kind == 'Point':
+        coordinates = quantize([coordinates], decimals)[0]
+    elif kind == 'MultiPoint':
+        coordinates = quantize(coordinates, decimals)
+    elif kind == 'LineString':
+        coordinates = quantize(simplifyLine(coordinates, tolerance), decimals)
+    elif kind == 'MultiLineString':
+        coordinates = [quantize(simplifyLine(line, tolerance), decimals) for line in coordinates]
+    elif kind == 'Polygon':
+        coordinates = simplifyPolygon(coordinates, tolerance, decimals)
+        if coordinates is None:
+            return None
+    elif kind == 'MultiPolygon':
+        polygons = [simplifyPolygon(polygon, tolerance, decimals) for polygon in coordinates]
+        coordinates = [polygon for polygon in polygons if polygon]
+        if not coordinates:
+            return None
+    elif kind == 'GeometryCollection':
+        geometries = [simplifyGeometry(g, tolerance, decimals) for g in geometry['geometries']]
+        return {'type': kind, 'geometries': [g for g in geometries if g]}
+    return {'type': kind, 'coordinates': coordinates}
+
+
+def simplifyFeatures(geojson, tolerance, decimals):
+    if geojson.get('type') == 'FeatureCollection':
+        features = []
+        for feature in geojson['features']:
+            geometry = simplifyGeometry(feature.get('geometry'), tolerance, decimals)
+            if geometry:
+                features.append(dict(feature, geometry=geometry))
+        return dict(geojson, features=features)
+    if geojson.get('type') == 'Feature':
+        return dict(geojson, geometry=simplifyGeometry(geojson.get('geometry'), tolerance, decimals))
+    return simplifyGeometry(geojson, tolerance, decimals)
+
+
+class GeoJsonCache:
+    """ Serves GeoJSON sources simplified for a map zoom level.
+
+    Each (zoom, source) is simplified to about half a screen pixel, its coordinates
+    rounded to the precision that zoom can show, gzipped, and kept both on disk
+    and in an in-memory LRU so it is only ever built once per source change.
+    """
+    tileSize = 256
+    pixelTolerance = 0.5
+
+    def __init__(self, sourceDir, cacheDir, maxEntries=64):
+        self.sourceDir = os.path.realpath(sourceDir)
+        self.cacheDir = cacheDir
+        self.memory = LRUCache(maxEntries)
+        self.builds = 0
+        self.hits = 0
+        self.diskFailed = False
+        self._logger = logging.getLogger('geojsoncache')
+
+    def degreesPerPixel(self, zoom):
+        return 360.0 / (self.tileSize * 2.0 ** zoom)
+
+    def tolerance(self, zoom):
+        return self.pixelTolerance * self.degreesPerPixel(zoom)
+
+    def decimals(self, zoom):
+        # enough digits to keep rounding error under a quarter pixel
+        return max(0, int(math.ceil(-math.log10(self.degreesPerPixel(zoom) / 4))))
+
+    def sourcePath(self, path):
+        sourcePath = os.path.realpath(os.path.join(self.sourceDir, path))
+        if not sourcePath.startswith(self.sourceDir + os.sep) or not sourcePath.endswith('.geojson'):
+            raise ValueError('not a geojson source: %s' % path)
+        if not os.path.isfile(sourcePath):
+            raise FileNotFoundError(path)
+        return sourcePath
+
+    def get(self, zoom, path):
+        """ Returns the gzipped, simplified GeoJSON for path at zoom """
+        sourcePath = self.sourcePath(path)
+        sourceTime = os.path.getmtime(sourcePath)
+        key = (zoom, sourcePath)
+        cached = self.memory.get(key)
+        if cached and cached[0] == sourceTime:
+            self.hits += 1
+            return cached[1]
+
+        cachePath = os.path.join(self.cacheDir, str(zoom), os.path.relpath(sourcePath, self.sourceDir) + '.gz')
+        if os.path.isfile(cachePath) and os.path.getmtime(cachePath) >= sourceTime:
+            with open(cachePath, 'rb') as f:
+                body = f.read()
+        else:
+            body = self.build(zoom, sourcePath, cachePath)
+        self.memory.put(key, (sourceTime, body))
+        return body
+
+    def build(self, zoom, sourcePath, cachePath):
+        with open(sourcePath, encoding='utf-8') as f:
+            geojson = JSON.load(f)
+        simplified = simplifyFeatures(geojson, self.tolerance(zoom), self.decimals(zoom))
+        body = gzip.compress(JSON.dumps(simplified, separators=(',', ':')).encode('utf-8'), 9)
+        self.builds += 1
+        self.write(cachePath, body)
+        return body
+
+    def write(self, cachePath, body):
+        # an unwritable cache dir only costs a rebuild after a restart, the memory LRU still serves
+        temporaryPath = '%s.%d.%d.tmp' % (cachePath, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            with open(temporaryPath, 'wb') as f:
+                f.write(body)
+            os.replace(temporaryPath, cachePath)
+        except OSError as e:
+            if not self.diskFailed:
+                d = {'clientip': "geojson", 'user': "cache"}
+                self._logger.error('could not write the geojson disk cache, keeping it in memory only: %s', e, extra=d)
+                self.diskFailed = True
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
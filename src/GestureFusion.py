@@ -0,0 +1,90 @@
+from Clock import systemClock
+
+
+class StreamClock:
+    """ Maps one device's timestamps (milliseconds) onto host time (seconds).
+
+    The offset is the smallest host-minus-device difference seen, i.e. the sample that
+    arrived with the least delay. It is allowed to creep up slowly so the two clocks
+    may drift apart by up to driftAllowance seconds per second.
+    """
+    driftAllowance = 1e-4
+
+    def __init__(self):
+        self.offset = None
+        self.lastHostTime = 0.0
+
+    def align(self, deviceTime, hostTime):
+        observed = hostTime - deviceTime / 1000.0
+        if self.offset is None:
+            self.offset = observed
+        else:
+            self.offset = min(self.offset + (hostTime - self.lastHostTime) * self.driftAllowance, observed)
+        self.lastHostTime = hostTime
+        return deviceTime / 1000.0 + self.offset
+
+
+class GestureFusion:
+    """ Fuses pan (tilt) and zoom (spin) actions that happened together into one combo frame.
+
+    Actions are offered with their device timestamps. When both streams have an action
+    whose aligned sample times are within window seconds of each other they leave as a
+    single 'combo' gesture. An action is only held back waiting for its partner while the
+    other stream is itself moving, and never for longer than the window.
+    """
+
+    def __init__(self, config, clock=None):
+        self.clock = clock or systemClock
+        self.window = config['fusionWindow'] / 1000.0
+        self.clocks = {'pan': StreamClock(), 'zoom': StreamClock()}
+        self.pending = {'pan': None, 'zoom': None}
+        self.lastSeen = {'pan': 0.0, 'zoom': 0.0}
+        self.fused = 0
+        self.separate = 0
+
+    def offer(self, action, deviceTime, now=None):
+        if now is None:
+            now = self.clock.time()
+        kind = action['gesture']
+        sampleTime = self.clocks[kind].align(deviceTime, now)
+        pending = self.pending[kind]
+        if kind == 'zoom' and pending:
+            # zoom deltas add up, the sample time stays that of the first one waiting
+            pending[0]['vector']['delta'] += action['vector']['delta']
+        else:
+            # pan is absolute, the newest tilt replaces one still waiting
+            self.pending[kind] = (action, sampleTime, pending[2] if pending else now)
+        self.lastSeen[kind] = now
+
+    def collect(self, now=None):
+        """ Returns the actions that are ready to send """
+        if now is None:
+            now = self.clock.time()
+        pan = self.pending['pan']
+        zoom = self.pending['zoom']
+        retval = []
+        if pan and zoom:
+            if abs(pan[1] - zoom[1]) <= self.window:
+                combo = { 'gesture': 'combo',
+                          'vector': { 'x': pan[0]['vector']['x'],
+                                      'y': pan[0]['vector']['y'],
+                                      'delta': zoom[0]['vector']['delta'] } }
+                if 'id' in zoom[0]:
+                    combo['id'] = zoom[0]['id']
+                retval.append(combo)
+                self.fused += 1
+            else:
+                retval = [pan[0], zoom[0]] if pan[1] <= zoom[1] else [zoom[0], pan[0]]
+                self.separate += 2
+            self.pending['pan'] = self.pending['zoom'] = None
+            return retval
+        for kind, other in (('pan', 'zoom'), ('zoom', 'pan')):
+            pending = self.pending[kind]
+            if not pending:
+                continue
+            partnerMoving = now - self.lastSeen[other] <= 2 * self.window
+            if not partnerMoving or now - pending[2] >= self.window:
+                retval.append(pending[0])
+                self.pending[kind] = None
+                self.separate += 1
+        return retval
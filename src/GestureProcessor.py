@@ -1,12 +1,17 @@
 from hashlib import new
 import json
+import math
 import time
+from Clock import systemClock
+from Scenario import Scenario
 
 class GestureProcessor:
     
-    def __init__(self,sensor,config):
+    def __init__(self,sensor,config,clock=None):
         self.sensor = sensor
         self.config = config
+        # the sensor's clock unless told otherwise, a VirtualClock when simulating
+        self.clock = clock or getattr(sensor, 'clock', None) or systemClock
         self.action = None
         self.requestCount = 0
         
@@ -22,22 +27,18 @@ class GestureProcessor:
         return (retval)
      
 class SpinGestureProcessor(GestureProcessor):
-    def __init__(self,sensor,config):
-        GestureProcessor.__init__(self,sensor,config)
+    def __init__(self,sensor,config,clock=None):
+        GestureProcessor.__init__(self,sensor,config,clock)
         self.position = 0.0
         self.rate = 0.0
         self.delta = 0
 
     def getSpin(self):
         retval = False
-        if self.sensor.spinHistory.size():
-            #print(repr(self.sensor.spinHistory.items))
-            newDelta = sum(self.sensor.spinHistory.items) / self.sensor.spinHistory.size()
-            self.sensor.spinHistory.enqueue(0)
-
-            self.delta = newDelta
-            if newDelta:
-                retval = True
+        newDelta = self.sensor.spinAccumulator.release(self.clock.time())
+        self.delta = newDelta
+        if newDelta:
+            retval = True
         return retval
 
     def run(self):
@@ -49,13 +50,12 @@ class SpinGestureProcessor(GestureProcessor):
                     'id': self.requestCount }
             self.requestCount += 1
             return True
-        print("Failed to get spin data", self.sensor.spinHistory.size())
         return False
 
 
 class TiltGestureProcessor(GestureProcessor):
-    def __init__(self,sensor,config):
-        GestureProcessor.__init__(self,sensor,config)
+    def __init__(self,sensor,config,clock=None):
+        GestureProcessor.__init__(self,sensor,config,clock)
         self.Xtilt = 0.0
         self.Ytilt = 0.0
 
@@ -64,23 +64,24 @@ class TiltGestureProcessor(GestureProcessor):
         if self.sensor.components[0].size() and \
             self.sensor.components[1].size() and \
             self.sensor.lastDataReceived > self.sensor.lastDataSent:
-            self.sensor.lastDataSent = time.time()
-            newXtilt = sum(self.sensor.components[0].items) / self.sensor.components[0].size()
-            if (abs(newXtilt) > self.config['tiltThreshold']):
+            self.sensor.lastDataSent = self.clock.time()
+            threshold = self.sensor.tiltThreshold()
+            newXtilt = self.sensor.components[0].mean
+            if (abs(newXtilt) > threshold):
                 #if (abs(newXtilt-self.Xtilt) > 0.01):
                 self.Xtilt = newXtilt
                 retval = True
             else:
                 self.Xtilt = 0.0
-            newYtilt = sum(self.sensor.components[1].items) / self.sensor.components[1].size()
-            if (abs(newYtilt) > self.config['tiltThreshold']):
+            newYtilt = self.sensor.components[1].mean
+            if (abs(newYtilt) > threshold):
                 #if (abs(newYtilt-self.Ytilt) > 0.01):
                 self.Ytilt = newYtilt
                 retval = True
             else:
                 self.Ytilt = 0.0
             # claculate the current tilt vector and put in self.Xtilt,self.Ytilt if not flat return true else false
-            #print(self.sensor.components[0].items,self.sensor.components[1].items)
+            #print(self.sensor.components[0].mean,self.sensor.components[1].mean)
             return retval
         return retval
     
@@ -97,66 +98,71 @@ class TiltGestureProcessor(GestureProcessor):
             #print(self.action)
             return True 
         else:
-            print('failed to get tilt vector', self.sensor, self.sensor.components[0].size())
             return False 
             
        
     
-class TestHarnessGestureProcessor(GestureProcessor):
-    def __init__(self,sensor,config):
-        GestureProcessor.__init__(self,sensor,config)
-        self.Xtilt = 0.0
-        self.Ytilt = 0.0
-        self.position = 0.0
-        self.rate = 0.0
-        self.delta = 0
-        self.testSet = {}
-        loops = 500
-        stepsize = 10.0
-        #for sp in range(loops):
+class SyntheticGestureProcessor(GestureProcessor):
+    """ A steady stream of pan frames tracing a slow circle, for load testing without a table """
+    def __init__(self,sensor,config,clock=None):
+        GestureProcessor.__init__(self,sensor,config,clock)
+        self.interval = 1.0 / config['testHarnessRate']
+        self.nextTime = self.clock.time()
+        self.angle = 0.0
 
-        #    self.testSet['spin%d' % sp] = { 'time': 1, "spin": stepsize, "tilt": { 'x': 0, 'y': 0}}
-        #self.testSet['end'] = { 'time': 25, "spin": -loops*stepsize, "tilt": { 'x': 0, 'y': 0}}
-        self.testSet['start'] = { 'time': 10, "spin": 0, "tilt": { 'x': 0, 'y': 0}}
-        self.testSet['end'] = { 'time': 2500, "spin": 0, "tilt": { 'x': 0, 'y': 0}}
-            
-        
+    def run(self, now=None):
+        if now is None:
+            now = self.clock.time()
+        if now < self.nextTime:
+            return False
+        self.nextTime = max(self.nextTime + self.interval, now - self.interval)
+        self.angle += 0.01
+        self.action = { 'gesture': 'pan',
+                        'vector': { 'x': 0.05 * math.cos(self.angle), 'y': 0.05 * math.sin(self.angle) },
+                        'id': self.requestCount }
+        self.requestCount += 1
+        return True
 
-        self.nextTest = 0
-        self.nextTime = time.time() + self.testSet[list(self.testSet.keys())[self.nextTest]]['time']
 
-    def getNextPose(self):
-        retval = False
-        if time.time() < self.nextTime:
-            return retval
-        if self.nextTest < len(self.testSet):
-            element = self.testSet[list(self.testSet.keys())[self.nextTest]]
-            self.Xtilt = element['tilt']['x']
-            self.Ytilt = element['tilt']['y']
-            self.delta = element['spin']
-            self.nextTest += 1
-            if self.nextTest >= len(self.testSet):
-                self.nextTest = 0
-            self.nextTime = time.time() + element['time']
-            retval = True
-        return retval
-    
-    
-    def run(self):
-# FSM looking for various possible gestures if after clocking the fsm there is a complete gesture return a dictionary describing the response to the gestureotherwise false
+class TestHarnessGestureProcessor(GestureProcessor):
+    """ Plays a Scenario through the real output path, speed times faster than its timeline.
 
-    # the most common gesture is a simple tilt which is defined as a delta from flat
-    # 
-        if self.getNextPose():
-            #self.action = { 'gesture': 'combo',
-            #    'vector': { 'x': self.Xtilt, 'y': self.Ytilt, 'delta': self.delta
-            #        }}
-            self.action = { 'gesture': 'zoom',
-                'vector': { 'delta': self.delta
-                    }}
-            return True 
-        else:
-            return False 
-            
-       
-    
+    Events are due by index, so run() costs the same however long the scenario is; the
+    server loop calls it with the same now until it returns False or the pass's batch is
+    used up, which lets thousands of events a second out without starving the event loop.
+    """
+    def __init__(self,sensor,config,scenario=None,speed=1.0,clock=None):
+        GestureProcessor.__init__(self,sensor,config,clock)
+        if scenario is None:
+            # the original test set: an empty zoom 10s and 20s in, every 2520s
+            scenario = Scenario({ 'loop': True,
+                                  'steps': [ { 'wait': 10 }, { 'zoom': { 'delta': 0 }, 'count': 1 },
+                                             { 'wait': 10 }, { 'zoom': { 'delta': 0 }, 'count': 1 },
+                                             { 'wait': 2500 } ] })
+        self.scenario = scenario
+        self.speed = speed
+        # set by the first run(), so playback starts with the gesture loop
+        self.startTime = None
+        # scenario time the current pass started at
+        self.offset = 0.0
+        self.nextTest = 0
+        self.passes = 0
+
+    def run(self, now=None):
+        if now is None:
+            now = self.clock.time()
+        if self.startTime is None:
+            self.startTime = now
+        if self.nextTest >= len(self.scenario):
+            if not self.scenario.loop or not len(self.scenario):
+                return False
+            self.nextTest = 0
+            self.offset += self.scenario.duration
+            self.passes += 1
+        if (now - self.startTime) * self.speed < self.offset + self.scenario.times[self.nextTest]:
+            return False
+        self.action = self.scenario.action(self.nextTest)
+        self.action['id'] = self.requestCount
+        self.requestCount += 1
+        self.nextTest += 1
+        return True
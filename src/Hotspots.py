@@ -0,0 +1,161 @@
+import json as JSON
+import math
+import time
+
+
+def loadHotspotConfig(path):
+    with open(path) as f:
+        return JSON.load(f)
+
+
+def mercator(lat, lng):
+    """ lat/lng to normalized web mercator coordinates (0..1 across the world) """
+    sinLat = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    return ((lng + 180.0) / 360.0,
+            0.5 - math.log((1 + sinLat) / (1 - sinLat)) / (4 * math.pi))
+
+
+class Viewport:
+    """ Server side copy of the browser's map view (center plus fractional zoom).
+
+    Integrates the same pan/zoom gestures the browser applies, using the constants
+    from geoconnectable.js, so the server can decide which hotspot is under the target.
+    Positions are kept in normalized web mercator coordinates. version counts the
+    changes, so a display sent the absolute state can tell a newer one from an older one.
+    reset() goes back to the map's center at its homeZoom, as the displays used to do
+    themselves after ten idle minutes.
+    """
+    tileSize = 256
+
+    def __init__(self, mapConfig):
+        self.minZoom = mapConfig['minZoom']
+        self.clicksPerZoomLevel = mapConfig['clicksPerZoomLevel']
+        self.pixelsPerGravitron = mapConfig['pixelsPerGravitron']
+        self.spinPosition = 0.0
+        self.x = 0.0
+        self.y = 0.0
+        self.version = 0
+        self.home = mapConfig['center']
+        self.homeZoom = mapConfig.get('homeZoom', self.minZoom)
+        self.setCenter(self.home[0], self.home[1])
+        self.lastMoved = time.time()
+
+    def zoom(self):
+        return self.minZoom + self.spinPosition / self.clicksPerZoomLevel
+
+    def worldSize(self):
+        return self.tileSize * 2.0 ** self.zoom()
+
+    def setCenter(self, lat, lng):
+        self.x, self.y = mercator(lat, lng)
+
+    def center(self):
+        lng = self.x * 360.0 - 180.0
+        lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * self.y))))
+        return (lat, lng)
+
+    def panBy(self, dx, dy):
+        # same sense as google.maps.Map.panBy: +x moves east, +y moves south
+        scale = self.worldSize()
+        self.x = (self.x + dx / scale) % 1.0
+        self.y = min(max(self.y + dy / scale, 0.0), 1.0)
+
+    def spin(self, delta):
+        self.spinPosition += delta
+        if self.spinPosition < 0:
+            self.spinPosition = 0.0
+
+    def reset(self):
+        """ Back to where the map starts """
+        self.setCenter(self.home[0], self.home[1])
+        self.spinPosition = (self.homeZoom - self.minZoom) * self.clicksPerZoomLevel
+        self.version += 1
+        self.lastMoved = None
+
+    def idleFor(self, now):
+        """ Seconds since a gesture last moved the view, 0 once it has been reset """
+        if self.lastMoved is None:
+            return 0.0
+        return now - self.lastMoved
+
+    def applyGesture(self, action):
+        """ Returns True if the view moved """
+        if not action:
+            return False
+        before = (self.x, self.y, self.spinPosition)
+        gesture = action.get('gesture')
+        vector = action.get('vector', {})
+        if gesture == 'pan' or gesture == 'combo':
+            self.panBy(self.pixelsPerGravitron * vector.get('x', 0.0),
+                       self.pixelsPerGravitron * vector.get('y', 0.0))
+        if gesture == 'zoom' or gesture == 'combo':
+            self.spin(vector.get('delta', 0))
+        if (self.x, self.y, self.spinPosition) == before:
+            return False
+        self.version += 1
+        self.lastMoved = time.time()
+        return True
+
+
+class HotspotIndex:
+    """ Per zoom layer grid of hotspots, answering "which hotspot is under the target".
+
+    Each layer's grid cell is as wide as the target box at that layer's integer zoom,
+    so a lookup only ever has to check the 3x3 cells around the view center.
+    """
+
+    def __init__(self, hotspotConfig):
+        mapConfig = hotspotConfig['map']
+        self.targetWidth = mapConfig['targetWidth']
+        self.viewportSize = mapConfig['viewportSize']
+        self.grids = {}
+        self.cellSizes = {}
+        self.current = None
+        for layer, siteIds in hotspotConfig['layers'].items():
+            zoom = int(layer)
+            cellSize = self.halfWidth(zoom) * 2
+            grid = {}
+            for order, siteId in enumerate(siteIds):
+                lat, lng = hotspotConfig['hotspots'][siteId]
+                x, y = mercator(lat, lng)
+                cell = (int(x // cellSize), int(y // cellSize))
+                grid.setdefault(cell, []).append((order, siteId, x, y))
+            self.grids[zoom] = grid
+            self.cellSizes[zoom] = cellSize
+
+    def halfWidth(self, zoom):
+        # matches hotBounds in geoconnectable.js: targetWidth of the visible map either side of center
+        return self.targetWidth * self.viewportSize / (Viewport.tileSize * 2.0 ** zoom)
+
+    def query(self, viewport):
+        zoom = viewport.zoom()
+        layer = int(math.floor(zoom))
+        grid = self.grids.get(layer)
+        if not grid:
+            return None
+        cellSize = self.cellSizes[layer]
+        halfWidth = self.halfWidth(zoom)
+        cx = int(viewport.x // cellSize)
+        cy = int(viewport.y // cellSize)
+        found = None
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                for order, siteId, x, y in grid.get((i, j), ()):
+                    if abs(x - viewport.x) <= halfWidth and abs(y - viewport.y) <= halfWidth:
+                        if found is None or order < found[0]:
+                            found = (order, siteId)
+        if found:
+            return found[1]
+        return None
+
+    def update(self, viewport):
+        """ Returns the enter/exit hotspot messages caused by the viewport's latest move """
+        events = []
+        siteId = self.query(viewport)
+        if siteId != self.current:
+            if self.current:
+                events.append({'gesture': 'hotspot', 'event': 'exit', 'site': self.current})
+            if siteId:
+                events.append({'gesture': 'hotspot', 'event': 'enter', 'site': siteId})
+            self.current = siteId
+        return events
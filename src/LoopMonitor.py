@@ -0,0 +1,49 @@
+import asyncio
+import time
+from RunningStats import WindowedStats
+
+
+class LoopMonitor:
+    """ How late the event loop wakes a sleeping task, and how much CPU the process is using.
+
+    A task sleeps interval seconds at a time; anything past that is lag that every other
+    task in the loop (the gesture loop, rtcbot's senders, aiohttp) saw too. Lag statistics
+    cover the last window seconds, CPU is the share of one core used over the last window.
+    """
+
+    def __init__(self, interval=0.01, window=1.0):
+        self.interval = interval
+        self.window = window
+        self.lag = WindowedStats(int(window / interval))
+        self.maxLag = 0.0
+        self.windowMaxLag = 0.0
+        self.cpu = 0.0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        windowStart = time.monotonic()
+        windowCpu = time.process_time()
+        windowMax = 0.0
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - before - self.interval, 0.0)
+            self.lag.add(lag)
+            windowMax = max(windowMax, lag)
+            self.maxLag = max(self.maxLag, lag)
+            if now - windowStart >= self.window:
+                cpu = time.process_time()
+                self.cpu = (cpu - windowCpu) / (now - windowStart)
+                self.windowMaxLag = windowMax
+                windowStart, windowCpu, windowMax = now, cpu, 0.0
+
+    def getMetrics(self):
+        return { 'cpu': self.cpu,
+                 'loopLag': self.lag.mean,
+                 'windowMaxLoopLag': self.windowMaxLag,
+                 'maxLoopLag': self.maxLag }
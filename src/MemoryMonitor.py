@@ -0,0 +1,112 @@
+import asyncio
+import gc
+import os
+import resource
+import time
+import tracemalloc
+
+
+# live instances worth counting in the sensor to display pipeline
+pipelineClasses = ( 'TiltData', 'SpinData', 'TiltGestureProcessor', 'SpinGestureProcessor',
+                    'AxisAssembler', 'SpinAccumulator', 'WindowedStats', 'DecayingStats',
+                    'RTCConnection', 'DataChannelLanes', 'WebSocketClient' )
+
+
+def residentBytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # peak rather than current, but still grows with a leak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def growthPerHour(samples):
+    """ Least squares slope of (time, bytes) samples, in bytes per hour """
+    if len(samples) < 2:
+        return 0.0
+    n = float(len(samples))
+    meanT = sum(t for t, b in samples) / n
+    meanB = sum(b for t, b in samples) / n
+    spread = sum((t - meanT) ** 2 for t, b in samples)
+    if spread == 0:
+        return 0.0
+    return sum((t - meanT) * (b - meanB) for t, b in samples) / spread * 3600.0
+
+
+class MemoryMonitor:
+    """ Where a long running server's memory is going.
+
+    RSS is sampled every interval seconds and the last history samples kept, so the
+    trend over a day or more is visible. Live instances of the named pipeline classes
+    are counted with each sample, since counting walks the whole heap; a report gives
+    the counts from the last sample unless asked to scan. With traceFrames > 0
+    tracemalloc runs from start(), and a report asked for allocators includes the top
+    allocating lines. Both cost some CPU, so tracing is off by default.
+    """
+
+    def __init__(self, classes=(), interval=60.0, history=1440, traceFrames=0, top=10):
+        self.classes = set(classes)
+        self.interval = interval
+        self.history = history
+        self.traceFrames = traceFrames
+        self.top = top
+        self.samples = []
+        self.objects = {}
+        self.objectsTime = None
+        self.started = time.time()
+        self.task = None
+
+    def start(self):
+        if self.traceFrames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceFrames)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def sample(self):
+        self.samples.append((time.time(), residentBytes()))
+        del self.samples[:-self.history]
+        self.objects = self.objectCounts()
+        self.objectsTime = time.time()
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def objectCounts(self):
+        counts = dict.fromkeys(self.classes, 0)
+        for o in gc.get_objects():
+            name = type(o).__name__
+            if name in counts:
+                counts[name] += 1
+        return counts
+
+    def topAllocators(self):
+        if not tracemalloc.is_tracing():
+            return []
+        stats = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        )).statistics('lineno')
+        return [ { 'where': str(s.traceback), 'bytes': s.size, 'blocks': s.count } for s in stats[:self.top] ]
+
+    def getMetrics(self, scan=False, allocators=False):
+        """ scan counts the objects now and allocators takes a tracemalloc snapshot, both
+        stall the caller for as long as the heap is big
+        """
+        if scan or self.objectsTime is None:
+            self.objects = self.objectCounts()
+            self.objectsTime = time.time()
+        report = { 'rss': residentBytes(),
+                   'rssGrowthPerHour': growthPerHour(self.samples),
+                   'uptime': time.time() - self.started,
+                   'rssHistory': [ { 'time': t, 'rss': b } for t, b in self.samples ],
+                   'objects': dict(self.objects),
+                   'objectsAge': time.time() - self.objectsTime,
+                   'gcCounts': gc.get_count() }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report['traced'] = { 'current': current, 'peak': peak }
+            if allocators:
+                report['topAllocators'] = self.topAllocators()
+        return report
@@ -0,0 +1,162 @@
+""" How the accelerometer sits in the table, as one 3x3 matrix from sensor axes to table axes.
+
+The matrix is worked out once, from --mounting or the old --swapXY/--flipX/--flipY, and
+each sample is then three dot products less the leveled offset. A board mounted at an
+odd angle is described by its roll, pitch and yaw, or measured with the guided
+calibration, which only needs the table held level and then tilted two ways:
+
+    python Mounting.py calibrate
+    python Mounting.py angles --roll 0 --pitch 180 --yaw 30
+"""
+import argparse
+import math
+import time
+
+
+def axisMapping(swapXY, flipX, flipY):
+    """ The old swap and flip settings as a matrix """
+    if swapXY == 1:
+        return [ [ 0.0, flipX, 0.0 ], [ flipY, 0.0, 0.0 ], [ 0.0, 0.0, 1.0 ] ]
+    return [ [ flipX, 0.0, 0.0 ], [ 0.0, flipY, 0.0 ], [ 0.0, 0.0, 1.0 ] ]
+
+
+def rotation(roll, pitch, yaw):
+    """ Sensor to table for a board turned roll, pitch and yaw degrees about its x, y and z axes """
+    r, p, y = math.radians(roll), math.radians(pitch), math.radians(yaw)
+    cr, sr, cp, sp, cy, sy = math.cos(r), math.sin(r), math.cos(p), math.sin(p), math.cos(y), math.sin(y)
+    # Rz(yaw) Ry(pitch) Rx(roll)
+    return [ [ cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr ],
+             [ sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr ],
+             [ -sp, cp * sr, cp * cr ] ]
+
+
+def multiply(a, b):
+    return [ [ sum(a[i][k] * b[k][j] for k in range(3)) for j in range(3) ] for i in range(3) ]
+
+
+def mountingMatrix(config):
+    """ --mounting as nine numbers (the matrix, row by row) or three (roll, pitch and yaw in
+    degrees, turned before the swaps and flips), or empty for the swaps and flips alone
+    """
+    mapping = axisMapping(config['swapXY'], config['flipX'], config['flipY'])
+    spec = config.get('mounting') or ''
+    values = [ float(v) for v in spec.replace(',', ' ').split() ]
+    if len(values) == 9:
+        return [ values[0:3], values[3:6], values[6:9] ]
+    if len(values) == 3:
+        return multiply(mapping, rotation(*values))
+    if values:
+        raise ValueError('--mounting takes 3 angles or 9 matrix entries, not %d numbers' % len(values))
+    return mapping
+
+
+def normalize(v):
+    length = math.sqrt(sum(c * c for c in v))
+    if length == 0:
+        raise ValueError('a zero length reading')
+    return [ c / length for c in v ]
+
+
+def dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def calibrate(level, towardX, towardY):
+    """ The matrix from three averaged readings: the table level, then tilted the way that
+    should pan the map toward +x (east), then toward +y (south). Any mounting angle works,
+    upside down included; the second tilt only needs to be roughly square to the first.
+    """
+    ez = normalize(level)
+    rows = [ None, None, ez ]
+    for i, reading in enumerate((towardX, towardY)):
+        v = normalize(reading)
+        d = [ a - b for a, b in zip(v, ez) ]
+        for axis in [ ez ] + [ r for r in rows[:i] ]:
+            d = [ c - dot(d, axis) * a for c, a in zip(d, axis) ]
+        rows[i] = normalize(d)
+    return rows
+
+
+class Mounting:
+    """ The matrix and the leveled offset, applied to a sample as one transform """
+
+    def __init__(self, matrix):
+        self.matrix = [ [ float(c) for c in row ] for row in matrix ]
+        ((self.m00, self.m01, self.m02),
+         (self.m10, self.m11, self.m12),
+         (self.m20, self.m21, self.m22)) = self.matrix
+        self.setZeros((0.0, 0.0, 0.0))
+
+    def setZeros(self, zeros):
+        """ zeros is the raw reading of the table at level, taken off every sample """
+        x, y, z = zeros
+        self.o0 = self.m00 * x + self.m01 * y + self.m02 * z
+        self.o1 = self.m10 * x + self.m11 * y + self.m12 * z
+        self.o2 = self.m20 * x + self.m21 * y + self.m22 * z
+
+    def apply(self, sample):
+        x, y, z = sample[0], sample[1], sample[2]
+        return (self.m00 * x + self.m01 * y + self.m02 * z - self.o0,
+                self.m10 * x + self.m11 * y + self.m12 * z - self.o1,
+                self.m20 * x + self.m21 * y + self.m22 * z - self.o2)
+
+    def applyBatch(self, xs, ys, zs):
+        """ Parallel sequences of raw x, y and z in, lists of table x, y and z out """
+        m00, m01, m02, m10, m11, m12, m20, m21, m22 = (self.m00, self.m01, self.m02, self.m10, self.m11,
+                                                         self.m12, self.m20, self.m21, self.m22)
+        o0, o1, o2 = self.o0, self.o1, self.o2
+        return ([ m00 * x + m01 * y + m02 * z - o0 for x, y, z in zip(xs, ys, zs) ],
+                [ m10 * x + m11 * y + m12 * z - o1 for x, y, z in zip(xs, ys, zs) ],
+                [ m20 * x + m21 * y + m22 * z - o2 for x, y, z in zip(xs, ys, zs) ])
+
+
+def readAverage(seconds):
+    """ Mean acceleration over seconds from the first accelerometer found """
+    from Phidget22.Devices.Accelerometer import Accelerometer
+    samples = []
+    accelerometer = Accelerometer()
+    accelerometer.setOnAccelerationChangeHandler(lambda e, acceleration, timestamp: samples.append(acceleration))
+    accelerometer.openWaitForAttachment(5000)
+    accelerometer.setDataInterval(accelerometer.getMinDataInterval())
+    accelerometer.setAccelerationChangeTrigger(0.0)
+    time.sleep(seconds)
+    accelerometer.close()
+    if not samples:
+        raise RuntimeError('no samples from the accelerometer')
+    return [ sum(s[i] for s in samples) / len(samples) for i in range(3) ]
+
+
+def formatMatrix(matrix):
+    return ','.join('%.6f' % c for row in matrix for c in row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Work out the --mounting matrix for the table\'s accelerometer.')
+    parser.add_argument('how', choices=['calibrate', 'angles'],
+                        help='calibrate: guided, from the accelerometer; angles: from --roll, --pitch and --yaw')
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help='seconds to average each calibration reading over (default: 2)')
+    parser.add_argument('--roll', type=float, default=0.0)
+    parser.add_argument('--pitch', type=float, default=0.0)
+    parser.add_argument('--yaw', type=float, default=0.0)
+    parser.add_argument('--swapXY', type=int, default=1)
+    parser.add_argument('--flipX', type=int, default=1)
+    parser.add_argument('--flipY', type=int, default=-1)
+    args = parser.parse_args()
+
+    if args.how == 'angles':
+        matrix = mountingMatrix({ 'swapXY': args.swapXY, 'flipX': args.flipX, 'flipY': args.flipY,
+                                  'mounting': '%f,%f,%f' % (args.roll, args.pitch, args.yaw) })
+    else:
+        readings = []
+        for prompt in ('Hold the table level', 'Tilt the table the way that should pan the map east',
+                       'Tilt the table the way that should pan the map south'):
+            input(prompt + ' and press enter ')
+            readings.append(readAverage(args.seconds))
+            print('  %.4f %.4f %.4f' % tuple(readings[-1]))
+        matrix = calibrate(*readings)
+    print('--mounting ' + formatMatrix(matrix))
+
+
+if __name__ == '__main__':
+    main()
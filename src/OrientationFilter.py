@@ -0,0 +1,66 @@
+import math
+
+
+class ComplementaryFilter:
+    """ Tilt from a gyroscope and accelerometer together, one sample at a time.
+
+    The estimate is the gravity vector in the sensor's frame, in g. Each sample it is
+    turned by the angular rate over dt, then pulled toward the measured acceleration with
+    weight dt / (tau + dt): the gyro follows fast tilting without lag, the accelerometer
+    corrects the gyro's drift over a few tau, and shaking or bumping the table (which
+    moves the accelerometer but not the gyro) is mostly filtered out. Because the output
+    is in the same units as raw acceleration, zeros, swaps and flips apply to it unchanged.
+    """
+
+    def __init__(self, tau=0.5):
+        self.tau = tau
+        self.reset()
+
+    def reset(self):
+        self.gravity = None
+        self.lastTimestamp = None
+
+    def update(self, acceleration, angularRate, timestamp):
+        """ acceleration in g, angularRate in degrees per second, timestamp in ms """
+        ax, ay, az = acceleration
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if self.gravity is None or self.lastTimestamp is None:
+            self.lastTimestamp = timestamp
+            if norm > 0:
+                self.gravity = [ ax / norm, ay / norm, az / norm ]
+            return self.gravity or [ 0.0, 0.0, 1.0 ]
+        dt = (timestamp - self.lastTimestamp) / 1000.0
+        self.lastTimestamp = timestamp
+        if dt <= 0 or dt > 1.0:
+            # out of order or after a gap, the gyro has nothing useful to say
+            dt = 0.0
+        gx, gy, gz = self.gravity
+        wx = math.radians(angularRate[0]) * dt
+        wy = math.radians(angularRate[1]) * dt
+        wz = math.radians(angularRate[2]) * dt
+        # a vector fixed in the world turns the other way in the sensor frame: g -= w x g
+        gx, gy, gz = (gx - (wy * gz - wz * gy),
+                      gy - (wz * gx - wx * gz),
+                      gz - (wx * gy - wy * gx))
+        if norm > 0:
+            k = dt / (self.tau + dt) if dt > 0 else 1.0
+            gx += k * (ax / norm - gx)
+            gy += k * (ay / norm - gy)
+            gz += k * (az / norm - gz)
+        length = math.sqrt(gx * gx + gy * gy + gz * gz) or 1.0
+        self.gravity = [ gx / length, gy / length, gz / length ]
+        return self.gravity
+
+    def angles(self):
+        """ roll and pitch in degrees """
+        if self.gravity is None:
+            return 0.0, 0.0
+        gx, gy, gz = self.gravity
+        return (math.degrees(math.atan2(gy, gz)),
+                math.degrees(math.atan2(-gx, math.sqrt(gy * gy + gz * gz))))
+
+
+def makeTiltFilter(config):
+    if config.get('tiltFilter', 'accel') == 'complementary':
+        return ComplementaryFilter(config.get('tiltFilterTau', 0.5))
+    return None
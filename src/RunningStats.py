@@ -0,0 +1,79 @@
+from array import array
+import math
+
+
+class WindowedStats:
+    """ Mean and variance of the last `length` samples, updated in O(1) per sample.
+
+    Welford's update, extended to also remove the sample that falls out of the window.
+    """
+
+    def __init__(self, length):
+        self.length = max(1, length)
+        self.values = array('d', [0.0] * self.length)
+        self.reset()
+
+    def reset(self):
+        self.index = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        if self.count == self.length:
+            old = self.values[self.index]
+            oldMean = self.mean
+            self.mean += (x - old) / self.count
+            self.m2 += (x - old) * (x - self.mean + old - oldMean)
+        else:
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+        self.values[self.index] = x
+        self.index = (self.index + 1) % self.length
+
+    def size(self):
+        return self.count
+
+    def head(self):
+        if self.count:
+            return self.values[self.index - 1]
+        return 0.0
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return max(self.m2 / self.count, 0.0)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class DecayingStats:
+    """ Exponentially weighted mean and variance; alpha is the weight of the newest sample """
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def add(self, x):
+        if self.count == 0:
+            self.mean = x
+        else:
+            diff = x - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.var = (1 - self.alpha) * (self.var + diff * increment)
+        self.count += 1
+
+    def variance(self):
+        return self.var
+
+    def std(self):
+        return math.sqrt(self.var)
@@ -0,0 +1,117 @@
+from array import array
+import json as JSON
+import random
+
+# gesture kinds in the compiled event array
+PAN, ZOOM, COMBO = 1, 2, 3
+_kinds = { 'pan': PAN, 'zoom': ZOOM, 'combo': COMBO }
+
+
+def loadScenario(path, seed=None):
+    with open(path) as f:
+        return Scenario(JSON.load(f), seed)
+
+
+class Scenario:
+    """ A gesture timeline compiled into flat per-event arrays, ready to be played back by index.
+
+    The spec is a list of steps run one after the other, each lasting duration seconds
+    and emitting rate events per second (or count events spread over duration, all at
+    once when duration is 0):
+
+        {"wait": 5}
+        {"pan": {"x": 0.1, "y": 0.0}, "duration": 2, "rate": 60}
+        {"zoom": {"delta": 2}, "duration": 1, "rate": 30}
+        {"combo": {"x": 0.1, "y": 0.0, "delta": 1}, "duration": 1, "rate": 60}
+        {"ramp": "pan", "from": {"x": 0, "y": 0}, "to": {"x": 0.2, "y": -0.1}, "duration": 3, "rate": 100}
+        {"walk": "pan", "step": 0.01, "limit": 0.3, "duration": 30, "rate": 100}
+        {"burst": "zoom", "vector": {"delta": 1}, "count": 5000}
+        {"repeat": 10, "steps": [ ... ]}
+
+    The whole spec is either that list or {"loop": true, "seed": 1, "steps": [...]}.
+    Random walks are seeded so a scenario plays the same every time.
+    """
+
+    def __init__(self, spec, seed=None):
+        if isinstance(spec, list):
+            spec = { 'steps': spec }
+        self.loop = spec.get('loop', False)
+        self.rng = random.Random(spec.get('seed', 1) if seed is None else seed)
+        self.times = array('d')
+        self.kinds = array('B')
+        self.xs = array('d')
+        self.ys = array('d')
+        self.deltas = array('d')
+        self.duration = self.compile(spec['steps'], 0.0)
+        if self.loop and self.duration <= 0:
+            raise ValueError('a looping scenario needs a duration')
+        self.rng = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def emit(self, t, kind, vector):
+        self.times.append(t)
+        self.kinds.append(_kinds[kind])
+        self.xs.append(vector.get('x', 0.0))
+        self.ys.append(vector.get('y', 0.0))
+        self.deltas.append(vector.get('delta', 0.0))
+
+    def stepTimes(self, step, start):
+        duration = step.get('duration', 0.0)
+        if 'count' in step:
+            count = step['count']
+        else:
+            count = int(round(duration * step.get('rate', 1.0)))
+        spacing = duration / count if count else 0.0
+        return [ start + i * spacing for i in range(count) ], duration
+
+    def compile(self, steps, start):
+        t = start
+        for step in steps:
+            if 'wait' in step:
+                t += step['wait']
+            elif 'repeat' in step:
+                for i in range(step['repeat']):
+                    t = self.compile(step['steps'], t)
+            elif 'ramp' in step:
+                times, duration = self.stepTimes(step, t)
+                last = max(len(times) - 1, 1)
+                for i, when in enumerate(times):
+                    f = i / last
+                    vector = { k: step['from'].get(k, 0.0) + f * (step['to'].get(k, 0.0) - step['from'].get(k, 0.0))
+                               for k in set(step['from']) | set(step['to']) }
+                    self.emit(when, step['ramp'], vector)
+                t += duration
+            elif 'walk' in step:
+                times, duration = self.stepTimes(step, t)
+                limit = step.get('limit', 1.0)
+                vector = dict(step.get('vector', {}))
+                keys = ('delta',) if step['walk'] == 'zoom' else ('x', 'y')
+                for when in times:
+                    for k in keys:
+                        vector[k] = min(max(vector.get(k, 0.0) + self.rng.uniform(-step['step'], step['step']), -limit), limit)
+                    self.emit(when, step['walk'], vector)
+                t += duration
+            elif 'burst' in step:
+                times, duration = self.stepTimes(step, t)
+                for when in times:
+                    self.emit(when, step['burst'], step['vector'])
+                t += duration
+            else:
+                kind = [ k for k in _kinds if k in step ]
+                if not kind:
+                    raise ValueError('unknown scenario step: %s' % step)
+                times, duration = self.stepTimes(step, t)
+                for when in times:
+                    self.emit(when, kind[0], step[kind[0]])
+                t += duration
+        return t
+
+    def action(self, index):
+        kind = self.kinds[index]
+        if kind == PAN:
+            return { 'gesture': 'pan', 'vector': { 'x': self.xs[index], 'y': self.ys[index] } }
+        if kind == ZOOM:
+            return { 'gesture': 'zoom', 'vector': { 'delta': self.deltas[index] } }
+        return { 'gesture': 'combo', 'vector': { 'x': self.xs[index], 'y': self.ys[index], 'delta': self.deltas[index] } }
@@ -0,0 +1,119 @@
+from multiprocessing import shared_memory, resource_tracker
+import struct
+import time
+
+
+class SharedRing:
+    """ Single-writer ring of short records in a multiprocessing.shared_memory block.
+
+    Every record gets a sequence number and the time it was written. Each slot is
+    guarded like a seqlock: the writer clears the slot's sequence number, fills it in
+    and then stamps the new number, so a reader that sees the same number before and
+    after copying a slot knows the copy is whole. Readers never block the writer; one
+    that falls more than a ring behind skips ahead and counts the records it lost.
+
+    A record longer than a slot goes out in consecutive slots, each marked as having a
+    part before or after it, and comes out of read() whole. If any part is lost to an
+    overrun the whole record is dropped.
+    """
+    _header = struct.Struct('<QII')
+    _slotHeader = struct.Struct('<QdHB')
+    _more = 1
+    _continued = 2
+
+    def __init__(self, name=None, slots=1024, slotSize=512, create=False, sharedTracker=False):
+        if create:
+            size = SharedRing._header.size + slots * slotSize
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+            SharedRing._header.pack_into(self.memory.buf, 0, 0, slots, slotSize)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            if not sharedTracker:
+                # only the creator may unlink the block, see bpo-39959; a multiprocessing
+                # child shares the creator's tracker and must leave its entry alone
+                resource_tracker.unregister(self.memory._name, 'shared_memory')
+        self.owner = create
+        self.name = self.memory.name
+        _, self.slots, self.slotSize = SharedRing._header.unpack_from(self.memory.buf, 0)
+        self.capacity = self.slotSize - SharedRing._slotHeader.size
+        self.written = self.writeSequence()
+        self.readSequence = self.written
+        self.overruns = 0
+        self.partial = []
+        self.partialNext = None
+
+    def writeSequence(self):
+        # a torn read of the counter shows up as two different values
+        while True:
+            first = SharedRing._header.unpack_from(self.memory.buf, 0)[0]
+            if SharedRing._header.unpack_from(self.memory.buf, 0)[0] == first:
+                return first
+
+    def slotOffset(self, sequence):
+        return SharedRing._header.size + ((sequence - 1) % self.slots) * self.slotSize
+
+    def write(self, payload, stamp=None):
+        # a reader has to be able to hold every part of a record in the ring at once
+        if len(payload) > self.capacity * (self.slots // 4):
+            raise ValueError('record of %d bytes does not fit a quarter of the %d byte ring'
+                             % (len(payload), self.capacity * self.slots))
+        if stamp is None:
+            stamp = time.time()
+        parts = [ payload[i:i + self.capacity] for i in range(0, len(payload), self.capacity) ] or [ payload ]
+        for i, part in enumerate(parts):
+            flags = (SharedRing._more if i < len(parts) - 1 else 0) | (SharedRing._continued if i > 0 else 0)
+            sequence = self.writeSlot(part, stamp, flags)
+        return sequence
+
+    def writeSlot(self, payload, stamp, flags):
+        sequence = self.written + 1
+        offset = self.slotOffset(sequence)
+        buf = self.memory.buf
+        SharedRing._slotHeader.pack_into(buf, offset, 0, stamp, len(payload), flags)
+        start = offset + SharedRing._slotHeader.size
+        buf[start:start + len(payload)] = payload
+        struct.pack_into('<Q', buf, offset, sequence)
+        struct.pack_into('<Q', buf, 0, sequence)
+        self.written = sequence
+        return sequence
+
+    def read(self):
+        """ Returns the (sequence, stamp, payload) records written since the last read """
+        retval = []
+        newest = self.writeSequence()
+        if newest - self.readSequence > self.slots:
+            self.overruns += newest - self.readSequence - self.slots
+            self.readSequence = newest - self.slots
+        buf = self.memory.buf
+        while self.readSequence < newest:
+            sequence = self.readSequence + 1
+            self.readSequence = sequence
+            offset = self.slotOffset(sequence)
+            found, stamp, length, flags = SharedRing._slotHeader.unpack_from(buf, offset)
+            start = offset + SharedRing._slotHeader.size
+            payload = bytes(buf[start:start + min(length, self.capacity)])
+            if found != sequence or struct.unpack_from('<Q', buf, offset)[0] != sequence:
+                # overwritten while we were getting to it
+                self.overruns += 1
+                continue
+            if flags & SharedRing._continued:
+                if self.partialNext != sequence:
+                    # the start of this record was lost, or came before we attached
+                    self.partial = []
+                    self.partialNext = None
+                    continue
+                self.partial.append(payload)
+            else:
+                self.partial = [ payload ]
+            if flags & SharedRing._more:
+                self.partialNext = sequence + 1
+                continue
+            retval.append((sequence, stamp, b''.join(self.partial)))
+            self.partial = []
+            self.partialNext = None
+        return retval
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,57 @@
+import math
+import threading
+import time
+
+
+class SpinAccumulator:
+    """ Exact count of encoder ticks, handed to the gesture loop however often it runs.
+
+    Encoder callbacks add signed ticks under a lock; release() drains everything added
+    since the last call. With a smoothing time constant tau (seconds) the drained ticks
+    are let out exponentially over time rather than all at once, so how much zoom leaves
+    depends on elapsed time and not on how many loop passes there were. Either way every
+    tick is eventually released exactly once: total zoom travel matches the rotation.
+    """
+    # a backlog smaller than this is released in one go rather than decaying forever
+    settled = 0.01
+
+    def __init__(self, tau=0.0):
+        self.tau = tau
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.held = 0.0
+        self.added = 0
+        self.released = 0.0
+        self.lastRelease = None
+
+    def add(self, ticks):
+        with self.lock:
+            self.pending += ticks
+            self.added += ticks
+
+    def drain(self):
+        with self.lock:
+            ticks = self.pending
+            self.pending = 0
+        return ticks
+
+    def release(self, now=None):
+        if now is None:
+            now = time.time()
+        self.held += self.drain()
+        if self.tau <= 0 or self.lastRelease is None:
+            fraction = 1.0 if self.tau <= 0 else 0.0
+        else:
+            fraction = 1.0 - math.exp(-(now - self.lastRelease) / self.tau)
+        self.lastRelease = now
+        retval = self.held * fraction
+        if abs(self.held - retval) < SpinAccumulator.settled:
+            retval = self.held
+        self.held -= retval
+        self.released += retval
+        return retval
+
+    def getMetrics(self):
+        return { 'ticks': self.added,
+                 'released': self.released,
+                 'backlog': self.held + self.pending }
@@ -1,34 +1,52 @@
 from GestureProcessor import SpinGestureProcessor, TestHarnessGestureProcessor
-from Queue import Queue
-from Phidget22.Devices.Encoder import *
+from SpinAccumulator import SpinAccumulator
+from Clock import systemClock
 import logging
-from Phidget22.PhidgetException import *
+import weakref
 import datetime
 
 class SpinData:
 
-    _all = set()
+    # weak, so a SpinData nobody else holds is not kept alive by the callbacks' registry
+    _all = weakref.WeakSet()
     _logger = None
-    _spinner  = Encoder()
+    # the Phidget22 encoder channel, created by the first SpinData that opens the device
+    _spinner = None
     _waitTimeForConnect = 5000
     
     def __init__(self,
                  config = {},
                  positionChange=0,
                  elapsedtime=0.0,
-                 position=0):
+                 position=0,
+                 clock=None,
+                 openDevice=True):
         SpinData._all.add(self)
         self.config = config
+        self.clock = clock or systemClock
         self.gestureProcessor = SpinGestureProcessor(self, config)
         self.position = position
         self.delta = positionChange
         self.timestamp = datetime.time()
         self.elapsedTime = elapsedtime
-        self.spinHistory = Queue(config['encoderQueueLength'])
+        self.deviceTime = 0.0
+        self.sampler = None
+        # every tick counted exactly, released on the time axis
+        self.spinAccumulator = SpinAccumulator(config['spinSmoothing'] / 1000.0)
         
         if (SpinData._logger == None):
             SpinData._logger = logging.getLogger('spinsensorserver')
+        if not openDevice:
+            # fed by a simulation instead of the encoder
+            return
+        self.openEncoder()
 
+    def openEncoder(self):
+        if SpinData._spinner is not None:
+            return
+        from Phidget22.Devices.Encoder import Encoder
+        from Phidget22.PhidgetException import PhidgetException
+        SpinData._spinner = Encoder()
         try:
             SpinData._spinner.setOnAttachHandler(SpinData.encoderAttached)
             SpinData._spinner.setOnDetachHandler(SpinData.encoderDetached)
@@ -39,6 +57,7 @@ class SpinData:
             d = {'clientip': "spinner", 'user':"__init__"}
             SpinData._logger.critical('_spinner init failed: %s', 'details%s'% e.details, extra=d)
             SpinData._spinner = None
+            return
         try:
             SpinData._spinner.openWaitForAttachment(SpinData._waitTimeForConnect)
             SpinData._spinner.setDataInterval(SpinData._spinner.getMinDataInterval());
@@ -47,11 +66,22 @@ class SpinData:
             SpinData._logger.critical('_spinner connect failed: %s', 'details%s'% e.details, extra=d)
             SpinData._spinner = None
 
+    def encoderChannel(self):
+        """ The open Phidget22 encoder channel, None without one """
+        return SpinData._spinner
+
 
     def ingestSpinData(self, positionChange, time):
         self.delta = positionChange
         self.elapsedTime = time
-        self.spinHistory.enqueue( positionChange * self.config['flipZ'])
+        # the encoder only reports the time since its last change, summing them gives a device clock
+        self.deviceTime += time
+        self.spinAccumulator.add(positionChange * self.config['flipZ'])
+        if self.sampler:
+            self.sampler.noteSpin(positionChange)
+
+    def getMetrics(self):
+        return self.spinAccumulator.getMetrics()
 
     #Information Display Function
     def displayDeviceInfo():
@@ -0,0 +1,79 @@
+import json as JSON
+import logging
+import os
+import os.path
+import time
+
+
+class StateSnapshot:
+    """ Keeps calibration and live pipeline state in a small JSON file across restarts.
+
+    Saves are atomic: the state is written to a temporary file next to the snapshot,
+    fsynced and renamed over it, so a crash or power cut leaves either the old or the
+    new snapshot and never a torn one. The fsync can take a while on an SD card, so the
+    server checks due() in its loop and runs trySave() in an executor.
+    """
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.lastSave = 0.0
+        self.lastSaved = None
+        self.saves = 0
+        self.saving = False
+        self._logger = logging.getLogger('statesnapshot')
+
+    def load(self):
+        d = {'clientip': "snapshot", 'user': "load"}
+        try:
+            with open(self.path) as f:
+                state = JSON.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self._logger.error('ignoring unreadable snapshot %s: %s', self.path, e, extra=d)
+            return {}
+        self.lastSaved = state
+        self._logger.info('restored snapshot %s', self.path, extra=d)
+        return state
+
+    def save(self, state):
+        if state == self.lastSaved:
+            return False
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        temporaryPath = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temporaryPath, 'w') as f:
+            JSON.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaryPath, self.path)
+        self.lastSaved = state
+        self.saves += 1
+        return True
+
+    def due(self, now=None):
+        """ True, once, when the last save is more than interval seconds old and none is running """
+        if now is None:
+            now = time.time()
+        if self.saving or now - self.lastSave < self.interval:
+            return False
+        self.lastSave = now
+        self.saving = True
+        return True
+
+    def trySave(self, state):
+        try:
+            return self.save(state)
+        except OSError as e:
+            d = {'clientip': "snapshot", 'user': "save"}
+            self._logger.error('could not save snapshot %s: %s', self.path, e, extra=d)
+            return False
+        finally:
+            self.saving = False
+
+    def maybeSave(self, getState, now=None):
+        """ Saves getState() if it is due, in the calling thread """
+        if not self.due(now):
+            return False
+        return self.trySave(getState())
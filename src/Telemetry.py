@@ -0,0 +1,84 @@
+""" What the displays report back: their clock against ours, and what visitors actually see """
+import time
+
+
+def syncReply(request, received):
+    """ The server's half of an NTP style exchange: the display's send time t0 comes back
+    with when we got it (t1) and when we answered (t2), in seconds since the epoch.
+    The display adds its receive time t3 and works out its offset and round trip from the four.
+    """
+    return { 'sync': { 't0': request.get('t0'), 't1': received, 't2': time.time() } }
+
+
+class ClientTelemetry:
+    """ One display's reports, the latest one as sent and running totals across all of them.
+
+    A report covers the display's last few seconds:
+
+        { "offset": s, "rtt": s,                     clock offset to the server, and the round trip it came from
+          "frames": n, "lateFrames": n,              animation frames, and those over 1.5 vsyncs
+          "frameTime": { "mean": ms, "p95": ms, "max": ms },
+          "receiveToRender": { ... ms },             message arriving to the frame that drew it
+          "serverToPixel": { ... ms },               the server stamping it (ts) to that frame, on the server's clock
+          "messages": n, "dropped": n,               frames handled, and sequence gaps seen
+          "decode": ms }                             mean parse time per message
+    """
+
+    def __init__(self, name=''):
+        self.name = name
+        self.connected = time.time()
+        self.reports = 0
+        self.lastReport = None
+        self.lastReportAt = None
+        self.syncs = 0
+        self.totals = { 'frames': 0, 'lateFrames': 0, 'messages': 0, 'dropped': 0 }
+        self.worst = { 'frameTime': 0.0, 'receiveToRender': 0.0, 'serverToPixel': 0.0 }
+
+    def handle(self, message, reply):
+        """ Takes a sync or telemetry message from the display, False if it was neither """
+        if 'sync' in message:
+            self.syncs += 1
+            reply(syncReply(message['sync'], time.time()))
+            return True
+        if 'telemetry' in message:
+            self.noteReport(message['telemetry'])
+            return True
+        return False
+
+    def noteReport(self, report):
+        self.reports += 1
+        self.lastReport = report
+        self.lastReportAt = time.time()
+        for key in self.totals:
+            self.totals[key] += report.get(key, 0) or 0
+        for key in self.worst:
+            p95 = (report.get(key) or {}).get('p95')
+            if p95 is not None:
+                self.worst[key] = max(self.worst[key], p95)
+
+    def getMetrics(self):
+        return { 'name': self.name,
+                 'connected': self.connected,
+                 'syncs': self.syncs,
+                 'reports': self.reports,
+                 'age': time.time() - self.lastReportAt if self.lastReportAt else None,
+                 'last': self.lastReport,
+                 'totals': dict(self.totals),
+                 'worstP95': dict(self.worst) }
+
+
+def summarize(clients):
+    """ Across displays: the worst recent p95 of each latency and the totals """
+    summary = { 'displays': 0, 'serverToPixelP95': None, 'receiveToRenderP95': None, 'frameTimeP95': None,
+                'frames': 0, 'lateFrames': 0, 'dropped': 0 }
+    for telemetry in clients:
+        if not telemetry.lastReport:
+            continue
+        summary['displays'] += 1
+        for key in ('serverToPixel', 'receiveToRender', 'frameTime'):
+            p95 = (telemetry.lastReport.get(key) or {}).get('p95')
+            if p95 is not None:
+                summary[key + 'P95'] = max(p95, summary[key + 'P95'] or 0.0)
+        for key in ('frames', 'lateFrames', 'dropped'):
+            summary[key] += telemetry.totals[key]
+    return summary
@@ -1,52 +1,100 @@
 from GestureProcessor import TiltGestureProcessor, TestHarnessGestureProcessor
-from Queue import Queue
-from Phidget22.Devices.Accelerometer import *
+from RunningStats import WindowedStats, DecayingStats
+from Clock import systemClock
+from OrientationFilter import makeTiltFilter
+from Mounting import Mounting, mountingMatrix
+from VibrationDetectors import makeVibrationDetectors
+from AxisAssembler import AxisAssembler
 import logging
-from Phidget22.PhidgetException import *
+import weakref
 import time
 import json as JSON
 
 
 class TiltData:
-    _all = set()
+    # weak, so a TiltData nobody else holds is not kept alive by the callbacks' registry
+    _all = weakref.WeakSet()
     _logger = None
-    _accelerometer  = Accelerometer()
+    # Phidget22 channels, created by the first TiltData that opens a device, so importing
+    # this module (e.g. in simulate.py) needs no libphidget22
+    _accelerometer = None
+    # opened instead of the accelerometer when a tilt filter wants the gyro as well
+    _spatial = None
+    # or the old Phidget21 ctypes Accelerometer (src/Accelerometer.py), one axis per callback
+    _legacy = None
     _waitTimeForConnect = 5000
 
     def __init__(self,
                  config = {},
                  positionChange=0,
                  elapsedtime=0.0,
-                 position=0):
+                 position=0,
+                 clock=None,
+                 openDevice=True):
         TiltData._all.add(self)
         self.config = config
+        self.clock = clock or systemClock
         self.lastDataReceived = 0
         self.lastDataSent = 0
         self.gestureProcessor = TiltGestureProcessor(self, config)
-        self.queueLength = config['accelerometerQueueLength']
-        self.components = [ Queue(self.queueLength),
-                            Queue(self.queueLength),
-                            Queue(self.queueLength) ]
-        self.variances =  [ Queue(self.queueLength),
-                            Queue(self.queueLength),
-                            Queue(self.queueLength) ]
+        # the legacy accelerometer has no gyro for a filter to use
+        self.tiltFilter = None if config['legacyAccelerometer'] else makeTiltFilter(config)
+        # knocks and shakes, looked for in the unfiltered samples
+        self.vibration = makeVibrationDetectors(config)
+        # the filter does the smoothing, a boxcar on top would only add lag
+        self.queueLength = 1 if self.tiltFilter else config['accelerometerQueueLength']
+        # windowed mean/variance per axis, the mean is the boxcar average the gesture processor pans by
+        self.components = [ WindowedStats(self.queueLength),
+                            WindowedStats(self.queueLength),
+                            WindowedStats(self.queueLength) ]
+        # slowly decaying statistics of the signal at rest, for the noise-adaptive threshold
+        self.noise = [ DecayingStats(config['noiseAlpha']),
+                       DecayingStats(config['noiseAlpha']),
+                       DecayingStats(config['noiseAlpha']) ]
+        self.threshold = config['tiltThreshold']
         self.magnitude = 0.0
+        # raw readings at level, the mounting takes them off in the same transform
         self.zeros = [ 0.0, 0.0, 0.0 ]
+        self.mounting = Mounting(mountingMatrix(config))
         self.serialNumber = ''
+        self.lastSampleTime = 0
+        self.calibrated = False
+        self.savedZeros = {}
+        self.sampler = None
+        self.axisAssembler = None
+        if config['legacyAccelerometer']:
+            self.axisAssembler = AxisAssembler(self.ingest_accelerometerData,
+                                               timeout=config['axisAssemblyTimeout'] / 1000.0)
 
         
         if (TiltData._logger == None):
             TiltData._logger = logging.getLogger('tiltsensorserver')
+        if not openDevice:
+            # fed by a simulation instead of the accelerometer
+            return
+        if self.axisAssembler:
+            self.openLegacyAccelerometer()
+        elif self.tiltFilter:
+            self.openSpatial()
+        else:
+            self.openAccelerometer()
 
+    def openAccelerometer(self):
+        if TiltData._accelerometer is not None:
+            return
+        from Phidget22.Devices.Accelerometer import Accelerometer
+        from Phidget22.PhidgetException import PhidgetException
+        TiltData._accelerometer = Accelerometer()
         try:
             TiltData._accelerometer.setOnAttachHandler(TiltData._accelerometerAttached)
             TiltData._accelerometer.setOnDetachHandler(TiltData._accelerometerDetached)
             TiltData._accelerometer.setOnErrorHandler(TiltData._accelerometerError)
             TiltData._accelerometer.setOnAccelerationChangeHandler(TiltData._accelerometerAccelerationChanged)
         except PhidgetException as e:
-            _accelerometer = None
             d = {'clientip': "tilter", 'user':"__init__"}
             TiltData._logger.critical('Tilter init failed: %s', e.details, extra=d)
+            TiltData._accelerometer = None
+            return
         try:
             TiltData._accelerometer.openWaitForAttachment(TiltData._waitTimeForConnect)
         except PhidgetException as e:
@@ -54,65 +102,171 @@ class TiltData:
             TiltData._logger.critical('Tilter connect failed: %s', e.details, extra=d)
             TiltData._accelerometer = None
 
+    def openLegacyAccelerometer(self):
+        if TiltData._legacy is not None:
+            return
+        from Accelerometer import Accelerometer as LegacyAccelerometer
+        from Phidgets.PhidgetException import PhidgetException as LegacyPhidgetException
+        try:
+            TiltData._legacy = LegacyAccelerometer()
+            TiltData._legacy.setOnAxisChangeHandler(TiltData._accelerometerAxisChanged)
+            TiltData._legacy.openPhidget()
+            TiltData._legacy.waitForAttach(TiltData._waitTimeForConnect)
+            serialNumber = TiltData._legacy.getSerialNum()
+        except (LegacyPhidgetException, OSError) as e:
+            d = {'clientip': "tilter", 'user':"openLegacyAccelerometer"}
+            TiltData._logger.critical('Legacy accelerometer connect failed: %s', getattr(e, 'details', e.args), extra=d)
+            TiltData._legacy = None
+            return
+        for tilter in TiltData._all:
+            tilter.serialNumber = serialNumber
+        d = {'clientip': "tilter", 'user':"openLegacyAccelerometer"}
+        TiltData._logger.info('legacy accelerometer Attached! %s', serialNumber, extra=d)
+
+    def tiltChannel(self):
+        """ The open Phidget22 channel the samples come from, None without one """
+        if self.axisAssembler:
+            # the sampler only knows Phidget22's rate calls
+            return None
+        if self.tiltFilter:
+            return TiltData._spatial
+        return TiltData._accelerometer
+
+    def openSpatial(self):
+        if TiltData._spatial is not None:
+            return
+        from Phidget22.Devices.Spatial import Spatial
+        from Phidget22.PhidgetException import PhidgetException
+        try:
+            TiltData._spatial = Spatial()
+            TiltData._spatial.setOnAttachHandler(TiltData._spatialAttached)
+            TiltData._spatial.setOnDetachHandler(TiltData._accelerometerDetached)
+            TiltData._spatial.setOnErrorHandler(TiltData._accelerometerError)
+            TiltData._spatial.setOnSpatialDataHandler(TiltData._spatialData)
+            TiltData._spatial.openWaitForAttachment(TiltData._waitTimeForConnect)
+        except PhidgetException as e:
+            d = {'clientip': "tilter", 'user':"openSpatial"}
+            TiltData._logger.critical('Spatial connect failed: %s', e.details, extra=d)
+            TiltData._spatial = None
 
     def setZeros(self,x0,y0,z0):
         self.zeros = [ x0, y0, z0 ]
+        self.mounting.setZeros(self.zeros)
+        self.calibrated = True
         print("set zeros to", self.zeros)
 
+    def restoreCalibration(self, calibration):
+        # zeros per device serial from a previous run, used instead of leveling on the first sample
+        self.savedZeros = dict(calibration.get('zeros', {}))
+
+    def getCalibration(self):
+        zeros = dict(self.savedZeros)
+        if self.calibrated:
+            zeros[str(self.serialNumber)] = list(self.zeros)
+        return { 'zeros': zeros }
+
+    def recalibrate(self):
+        # level again from the next samples, for a table that has been moved or shimmed
+        self.savedZeros.pop(str(self.serialNumber), None)
+        self.calibrated = False
+        d = {'clientip': "tilter", 'user': "recalibrate"}
+        TiltData._logger.info('releveling: %s', "serial %s" % self.serialNumber, extra=d)
+
+    def needsZeros(self):
+        if self.calibrated:
+            return False
+        saved = self.savedZeros.get(str(self.serialNumber))
+        if saved:
+            self.setZeros(saved[0], saved[1], saved[2])
+            return False
+        return True
+
     def set_accelerometerZero(self, index, newZero):
         self.zeros[index] = newZero
+        self.mounting.setZeros(self.zeros)
 
     def level_table(self):
-        self.components = [ Queue(self.queueLength),
-                            Queue(self.queueLength),
-                            Queue(self.queueLength) ]
-        self.variances =  [ Queue(self.queueLength),
-                            Queue(self.queueLength),
-                            Queue(self.queueLength) ]
-        
+        for component in self.components:
+            component.reset()
+
+    def tiltThreshold(self):
+        return self.threshold
+
+    def updateThreshold(self):
+        # k standard deviations of the resting signal, once there is enough of it to trust
+        if self.config['noiseK'] > 0 and self.noise[0].count > 1.0 / self.config['noiseAlpha']:
+            self.threshold = self.config['noiseK'] * max(self.noise[0].std(), self.noise[1].std())
+
     def populateQueues(self, newX, newY, newZ):
-        #print("populate queues", newX, newY, self.components[0].size(), self.variances[0].size())
-        self.variances[0].enqueue(newX - self.components[0].head())
-        self.variances[1].enqueue(newY - self.components[1].head())
-        self.variances[2].enqueue(newZ - self.components[2].head())
-        self.components[0].enqueue(newX)
-        self.components[1].enqueue(newY)
-        self.components[2].enqueue(newZ) 
+        #print("populate queues", newX, newY, self.components[0].size())
+        self.components[0].add(newX)
+        self.components[1].add(newY)
+        self.components[2].add(newZ) 
+        self.lastDataReceived = self.clock.time()
+        # never gate tighter than the configured threshold, or the estimate would shrink itself
+        restLimit = max(self.threshold, self.config['tiltThreshold'])
+        if abs(newX) < restLimit and abs(newY) < restLimit:
+            self.noise[0].add(newX)
+            self.noise[1].add(newY)
+            self.noise[2].add(newZ)
+            self.updateThreshold()
+        if self.sampler:
+            self.sampler.noteTilt(newX, newY)
 
     def ingestSpatialData(self, sensorData):
-        if self.components[0].size() == 0:
-            self.setZeros(sensorData.Acceleration[0],sensorData.Acceleration[1],sensorData.Acceleration[2])
-        if (self.config['swapXY'] == 1) :
-            newY = self.config['flipY'] * (sensorData.Acceleration[0] - self.zeros[0])
-            newX = self.config['flipX'] * (sensorData.Acceleration[1] - self.zeros[1])
-        else: 
-            newX = self.config['flipX'] * (sensorData.Acceleration[0] - self.zeros[0])
-            newY = self.config['flipY'] * (sensorData.Acceleration[1] - self.zeros[1])
-        newZ = sensorData.Acceleration[2] - self.zeros[2]
-        self.lastDataReceived = time.time()
-        self.populateQueues(round(newX, 3), round(newY,3), round(newZ,3))
-        #print(newX, newY)
+        if self.tiltFilter and getattr(sensorData, 'AngularRate', None) is not None:
+            timestamp = getattr(sensorData, 'Timestamp', None)
+            if timestamp is None:
+                timestamp = self.clock.time() * 1000.0
+            self.ingestSpatialSample(sensorData.Acceleration, sensorData.AngularRate, timestamp)
+            return
+        self.ingest_accelerometerData(sensorData.Acceleration)
         
      
-    def ingest_accelerometerData(self, sensorData):
-        
-        if self.components[0].size() == 0:
-                if (self.config['swapXY'] == 1) :
-                    self.setZeros(sensorData[1],sensorData[0],sensorData[2])
-                else:
-                    self.setZeros(sensorData[0],sensorData[1],sensorData[2])
-        if (self.config['swapXY'] == 1) :
-            newY = self.config['flipY'] * (sensorData[0] - self.zeros[1])
-            newX = self.config['flipX'] * (sensorData[1] - self.zeros[0])
-        else: 
-            newX = self.config['flipX'] * (sensorData[0] - self.zeros[0])
-            newY = self.config['flipY'] * (sensorData[1] - self.zeros[1])
-        newZ = sensorData [2] - self.zeros[2]
-        self.populateQueues(round(newX, 3), round(newY,3), round(newZ,3))
-        #print(self.config['swapXY'],sensorData, newX, newY)
+    def ingestSpatialSample(self, acceleration, angularRate, timestamp):
+        # acceleration in g, angular rate in degrees per second, timestamp in ms
+        if self.tiltFilter:
+            if self.vibration:
+                x, y, z = self.mounting.apply(acceleration)
+                self.vibration.add(x, y, z, self.clock.time())
+            acceleration = self.tiltFilter.update(acceleration, angularRate, timestamp)
+        self.ingest_accelerometerData(acceleration, timestamp)
+
+    def ingestAccelerometerAxis(self, index, value):
+        self.axisAssembler.ingestAxis(index, value, self.clock.time())
+
+    def pollAxes(self):
+        # a partial sample whose other axes are overdue, e.g. the last x as the table comes to rest
+        if self.axisAssembler:
+            self.axisAssembler.poll(self.clock.time())
+
+    def ingest_accelerometerData(self, sensorData, timestamp=None):
+        if timestamp is not None:
+            self.lastSampleTime = timestamp
+        if self.needsZeros():
+            self.setZeros(sensorData[0],sensorData[1],sensorData[2])
+        newX, newY, newZ = self.mounting.apply(sensorData)
+        self.populateQueues(newX, newY, newZ)
+        if self.vibration and not self.tiltFilter:
+            self.vibration.add(newX, newY, newZ, self.clock.time())
+
+    def vibrationGestures(self):
+        if self.vibration:
+            return self.vibration.collect(self.clock.time())
+        return []
 
 
                       
+    def getMetrics(self):
+        metrics = { 'threshold': self.threshold,
+                    'restingStd': [ n.std() for n in self.noise ],
+                    'windowStd': [ c.std() for c in self.components ] }
+        if self.tiltFilter:
+            metrics['rollPitch'] = self.tiltFilter.angles()
+        if self.vibration:
+            metrics['vibration'] = self.vibration.getMetrics()
+        return metrics
+
     def getJSON(self):
         jsonBundle = { 'type':        'tilt',
                     'packet': { 'sensorID':  '',
@@ -132,6 +286,21 @@ class TiltData:
         d = {'clientip': "tilter", 'user':"_accelerometerAttached", 'foo': "accelerometer attached"}
         TiltData._logger.info('accelerometer Attached! %s', 'yay', extra=d)
 
+    def _spatialAttached(e):
+        attached = e
+        for tilter in TiltData._all:
+            tilter.serialNumber = attached.getDeviceSerialNumber()
+            # every sample, at the fastest rate the device has, the filter wants them all
+            attached.setDataInterval(attached.getMinDataInterval())
+
+        d = {'clientip': "tilter", 'user':"_spatialAttached"}
+        TiltData._logger.info('spatial Attached! %s', 'yay', extra=d)
+
+    def _spatialData(e, acceleration, angularRate, magneticField, timestamp):
+        for tilter in TiltData._all:
+            if tilter.serialNumber == e.getDeviceSerialNumber():
+                tilter.ingestSpatialSample(acceleration, angularRate, timestamp)
+
     def _accelerometerDetached(e):
         detached = e
         d = {'clientip': "tilter", 'user':"_accelerometerDetached", 'foo': "accelerometer Detached! %s" % (detached.getDeviceSerialNumber())}
@@ -151,7 +320,14 @@ class TiltData:
             if tilter.serialNumber == e.getDeviceSerialNumber():
                 #print(repr(tilter), len(TiltData._all ))     
                 if tilter:
-                    tilter.ingest_accelerometerData(acceleration)
+                    tilter.ingest_accelerometerData(acceleration, timestamp)
+
+    def _accelerometerAxisChanged(device, index, acceleration):
+        # per-axis handler for the legacy Accelerometer (see Accelerometer.setOnAxisChangeHandler),
+        # there is only ever the one so no serial number check
+        for tilter in TiltData._all:
+            if tilter.axisAssembler:
+                tilter.ingestAccelerometerAxis(index, acceleration)
 
     #   print("_accelerometer %i: Axis %i: %6f" % (source.getDeviceSerialNumber(), e.index, e.acceleration))
 
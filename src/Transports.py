@@ -0,0 +1,190 @@
+""" Ways of getting the gesture stream to a display besides the rtcbot data channel """
+import asyncio
+import json as JSON
+import logging
+import struct
+import time
+from Telemetry import ClientTelemetry, summarize
+
+
+# binary frames: one type byte, then little-endian float32s; state frames add a key flag
+# and the version, and keep float64s so the center survives at street level zooms
+PAN, ZOOM, COMBO, STATE = 1, 2, 3, 4
+_pan = struct.Struct('<Bff')
+_zoom = struct.Struct('<Bf')
+_combo = struct.Struct('<Bfff')
+_state = struct.Struct('<BBIddd')
+
+
+def encodeFrames(message):
+    """ Returns the message as JSON text and, for the high rate gestures, as a binary frame """
+    text = JSON.dumps(message, separators=(',', ':'))
+    gesture = message.get('gesture') if isinstance(message, dict) else None
+    if gesture == 'pan':
+        data = _pan.pack(PAN, message['vector']['x'], message['vector']['y'])
+    elif gesture == 'zoom':
+        data = _zoom.pack(ZOOM, message['vector']['delta'])
+    elif gesture == 'combo':
+        vector = message['vector']
+        data = _combo.pack(COMBO, vector['x'], vector['y'], vector['delta'])
+    elif gesture == 'state':
+        vector = message['vector']
+        data = _state.pack(STATE, 1 if message['key'] else 0, message['version'] & 0xffffffff,
+                           vector['position'], vector['lat'], vector['lng'])
+    else:
+        data = None
+    return text, data
+
+
+class WebSocketClient:
+    """ One display on /ws, with rtcbot's put_nowait so the server loop can treat it like the data channel.
+
+    Frames wait in a bounded queue for a writer task; a display that stops reading
+    loses its oldest frames instead of holding up the loop or the other displays.
+    """
+
+    def __init__(self, ws, binary=False, queueSize=256, name='ws'):
+        self.ws = ws
+        self.binary = binary
+        self.queue = asyncio.Queue(queueSize)
+        self.dropped = 0
+        self.sent = 0
+        self.telemetry = ClientTelemetry(name)
+
+    def put_nowait(self, message):
+        self.send(*encodeFrames(message))
+
+    def send(self, text, data=None):
+        frame = data if self.binary and data is not None else text
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    async def run(self):
+        while not self.ws.closed:
+            frame = await self.queue.get()
+            if isinstance(frame, bytes):
+                await self.ws.send_bytes(frame)
+            else:
+                await self.ws.send_str(frame)
+            self.sent += 1
+
+
+class Displays:
+    """ Every display connected to the server, whichever transport it came in on.
+
+    Messages are encoded once per broadcast however many WebSocket clients there are.
+    Each WebRTC display has its own connection and DataChannelLanes, added once it has
+    negotiated and dropped again when the connection closes.
+    """
+
+    def __init__(self):
+        self.connections = set()
+        self.clients = set()
+        self.lastSetup = {}
+        self._logger = logging.getLogger('displays')
+
+    def add(self, client):
+        self.clients.add(client)
+
+    def remove(self, client):
+        self.clients.discard(client)
+
+    def addConnection(self, lanes):
+        self.connections.add(lanes)
+
+    def removeConnection(self, lanes):
+        self.connections.discard(lanes)
+
+    def put_nowait(self, message):
+        for lanes in list(self.connections):
+            lanes.put_nowait(message)
+            if lanes.setup:
+                self.lastSetup = lanes.setup
+        if self.clients:
+            text, data = encodeFrames(message)
+            for client in self.clients:
+                client.send(text, data)
+
+    def getMetrics(self):
+        return { 'webrtc': [ lanes.getMetrics() for lanes in self.connections ],
+                 'lastSetup': self.lastSetup,
+                 'websockets': [ { 'binary': c.binary, 'sent': c.sent, 'dropped': c.dropped, 'queued': c.queue.qsize(),
+                                   'telemetry': c.telemetry.getMetrics() }
+                                 for c in self.clients ],
+                 'telemetry': summarize([ lanes.telemetry for lanes in self.connections ] +
+                                        [ c.telemetry for c in self.clients ]) }
+
+
+class DataChannelLanes:
+    """ rtcbot's default channel plus an unordered, never retransmitted 'pan' channel.
+
+    Only the latest tilt matters, so pan frames, and state frames other than key frames,
+    go where a lost SCTP packet cannot hold up the ones behind it; zoom deltas, combos,
+    key frames and control messages stay on the reliable ordered default channel. Every frame carries its lane and a per-lane sequence number
+    so the display can count loss and reordering and report them back.
+
+    Also times how long it took from the display asking to connect (started) to its
+    channel opening and to the first frame going out.
+    """
+
+    def __init__(self, webRTC, started=None, panLane=True):
+        self.webRTC = webRTC
+        self.panLane = panLane
+        self.pan = None
+        self.seq = {'default': 0, 'pan': 0}
+        self.sent = {'default': 0, 'pan': 0}
+        self.received = {}
+        self.started = started if started is not None else time.time()
+        self.readyAt = None
+        self.setup = {}
+        self.telemetry = ClientTelemetry('webrtc')
+        self._logger = logging.getLogger('datachannellanes')
+
+    def open(self):
+        if self.readyAt is None:
+            self.readyAt = time.time()
+        if not self.panLane or self.pan is not None:
+            return
+        d = {'clientip': "webrtc", 'user': "lanes"}
+        try:
+            self.pan = self.webRTC._rtc.createDataChannel('pan', ordered=False, maxRetransmits=0)
+        except Exception as e:
+            self._logger.error('could not open the pan lane, pans stay reliable: %s', e, extra=d)
+            self.panLane = False
+            return
+        self._logger.info('pan lane: %s', "unordered, maxRetransmits=0", extra=d)
+
+    def put_nowait(self, message):
+        lane = 'default'
+        if self.pan is not None and self.pan.readyState == 'open' and self.lossy(message):
+            lane = 'pan'
+        if not self.setup and self.readyAt is not None and 'gesture' in message:
+            self.setup = { 'ready': self.readyAt - self.started,
+                           'firstFrame': time.time() - self.started }
+        message = dict(message, lane=lane, seq=self.seq[lane])
+        self.seq[lane] += 1
+        self.sent[lane] += 1
+        if lane == 'pan':
+            self.pan.send(JSON.dumps(message, separators=(',', ':')))
+        else:
+            self.webRTC.put_nowait(message)
+
+    @staticmethod
+    def lossy(message):
+        gesture = message.get('gesture')
+        return gesture == 'pan' or (gesture == 'state' and not message.get('key'))
+
+    def noteReport(self, report):
+        """ Loss and reordering per lane as counted by the display, and its own first frame time """
+        self.received = report['lanes']
+        if 'firstFrame' in report:
+            self.setup['displayFirstFrame'] = report['firstFrame'] / 1000.0
+
+    def getMetrics(self):
+        return { 'panLane': self.pan.readyState if self.pan is not None else None,
+                 'setup': self.setup,
+                 'sent': dict(self.sent),
+                 'received': self.received,
+                 'telemetry': self.telemetry.getMetrics() }
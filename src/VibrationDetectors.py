@@ -0,0 +1,184 @@
+from array import array
+import math
+from RunningStats import WindowedStats, DecayingStats
+
+
+class SlidingDFT:
+    """ A few bins of the DFT of the last length samples, updated in O(bins) per sample.
+
+    Each bin is rotated by its twiddle factor as the newest sample comes in and the one
+    leaving the window goes out. A damping factor just under 1 keeps rounding errors
+    from piling up over days of samples.
+    """
+
+    def __init__(self, length, bins, damping=0.9999):
+        self.length = length
+        self.bins = list(bins)
+        self.values = array('d', [0.0] * length)
+        self.index = 0
+        self.dampingN = damping ** length
+        self.twiddles = [ complex(math.cos(2 * math.pi * k / length), math.sin(2 * math.pi * k / length)) * damping
+                          for k in self.bins ]
+        self.spectrum = [ 0j ] * len(self.bins)
+
+    def add(self, x):
+        delta = x - self.dampingN * self.values[self.index]
+        self.values[self.index] = x
+        self.index = (self.index + 1) % self.length
+        spectrum = self.spectrum
+        twiddles = self.twiddles
+        for i in range(len(spectrum)):
+            spectrum[i] = (spectrum[i] + delta) * twiddles[i]
+
+    def amplitude(self):
+        """ Amplitude of the signal across the bins, in the units of the samples """
+        return 2.0 * math.sqrt(sum(abs(c) ** 2 for c in self.spectrum)) / self.length
+
+
+class VibrationDetectors:
+    """ Knocks and shakes in the accelerometer stream, as gestures for the staff.
+
+    Tilt is taken off with running means, a fast one for knocks and a slower one for
+    shakes, so only what happens in a fraction of a second is left. A knock is a short
+    burst of energy, well above both the resting noise and knockThreshold g, that is over
+    within knockDuration seconds. Knocks are held until the table has been quiet for a
+    moment: two within doubleKnockWindow seconds make a double-knock, one on its own is a
+    knock once that window has passed, and more than two, or any while the shake band is
+    busy, are a rattle and not sent at all. A shake is more than shakeThreshold g in the
+    shakeBand (Hz) of the sliding DFT, at a zero crossing rate in the same band, held for
+    shakeDuration seconds.
+
+    Every sample costs a fixed amount of work. The windows assume samples come at
+    sampleRate, which they do while the table is being moved or knocked; when the adaptive
+    sampler has slowed the idle table down, the first knock wakes it rather than counting.
+    """
+
+    def __init__(self, sampleRate, knockThreshold=0.08, shakeThreshold=0.06, sensitivity=6.0,
+                 knockDuration=0.12, doubleKnockWindow=0.6, shakeBand=(2.0, 6.0),
+                 shakeDuration=0.4, shakeCooldown=2.0, settle=0.5):
+        self.sampleRate = sampleRate
+        self.knockThreshold = knockThreshold
+        self.shakeThreshold = shakeThreshold
+        self.sensitivity = sensitivity
+        self.knockDuration = knockDuration
+        self.doubleKnockWindow = doubleKnockWindow
+        self.shakeBand = shakeBand
+        self.shakeDuration = shakeDuration
+        self.shakeCooldown = shakeCooldown
+        self.alpha = 1.0 / max(1.0, settle * sampleRate)
+        self.knockAlpha = 1.0 / max(1.0, 0.02 * sampleRate)
+        self.means = [ None, None ]
+        self.knockMeans = [ None, None, None ]
+        # energy of the last ~5ms, against the resting noise floor
+        self.energy = WindowedStats(max(2, int(round(0.005 * sampleRate))))
+        self.floor = DecayingStats(0.01)
+        # a window of a few shake periods for the DFT and the zero crossings
+        length = max(8, int(round(2.0 * sampleRate / shakeBand[0])))
+        binWidth = sampleRate / float(length)
+        bins = [ k for k in range(1, length // 2) if shakeBand[0] <= k * binWidth <= shakeBand[1] ] or [ 1 ]
+        self.dftX = SlidingDFT(length, bins)
+        self.dftY = SlidingDFT(length, bins)
+        self.crossings = WindowedStats(length)
+        self.lastSign = 0
+        self.burstStart = None
+        self.burstPeak = 0.0
+        self.knocks = []
+        self.amplitude = 0.0
+        self.shakeStart = None
+        self.lastShake = None
+        self.gestures = []
+        self.counts = { 'knock': 0, 'double-knock': 0, 'shake': 0 }
+
+    def add(self, x, y, z, now):
+        means = self.means
+        knockMeans = self.knockMeans
+        if means[0] is None:
+            means[0], means[1] = x, y
+            knockMeans[0], knockMeans[1], knockMeans[2] = x, y, z
+
+        # knocks: a short burst of energy over what the last ~20ms looked like
+        a = self.knockAlpha
+        kx, ky, kz = x - knockMeans[0], y - knockMeans[1], z - knockMeans[2]
+        knockMeans[0] += a * kx
+        knockMeans[1] += a * ky
+        knockMeans[2] += a * kz
+        e = kx * kx + ky * ky + kz * kz
+        self.energy.add(e)
+        level = math.sqrt(self.energy.mean)
+        limit = max(self.knockThreshold, self.sensitivity * math.sqrt(self.floor.mean))
+        if level > limit:
+            if self.burstStart is None:
+                self.burstStart = now
+                self.burstPeak = 0.0
+            self.burstPeak = max(self.burstPeak, math.sqrt(e))
+        else:
+            if self.burstStart is not None:
+                if now - self.burstStart <= self.knockDuration:
+                    self.knocked(now)
+                else:
+                    # too long for a knock, so neither were the ones just before it
+                    self.knocks = [ (now, 0.0) ] * 3
+                self.burstStart = None
+            self.floor.add(e)
+
+        # shakes: sustained amplitude in the shake band, crossing zero at the same rate
+        a = self.alpha
+        means[0] += a * (x - means[0])
+        means[1] += a * (y - means[1])
+        hx, hy = x - means[0], y - means[1]
+        self.dftX.add(hx)
+        self.dftY.add(hy)
+        sign = 1 if hx > 0 else -1
+        self.crossings.add(1.0 if sign != self.lastSign else 0.0)
+        self.lastSign = sign
+        self.amplitude = amplitude = math.hypot(self.dftX.amplitude(), self.dftY.amplitude())
+        frequency = self.crossings.mean * self.sampleRate / 2.0
+        if amplitude > self.shakeThreshold and self.shakeBand[0] <= frequency <= self.shakeBand[1] * 1.5:
+            if self.shakeStart is None:
+                self.shakeStart = now
+            elif now - self.shakeStart >= self.shakeDuration and \
+                    (self.lastShake is None or now - self.lastShake >= self.shakeCooldown):
+                self.lastShake = now
+                self.emit('shake', { 'amplitude': amplitude, 'frequency': frequency })
+        else:
+            self.shakeStart = None
+
+    def knocked(self, now):
+        if self.amplitude > self.shakeThreshold / 2 or self.shakeStart is not None:
+            # the start of a shake looks like knocks
+            self.knocks = [ (now, 0.0) ] * 3
+            return
+        self.knocks.append((now, self.burstPeak))
+
+    def emit(self, gesture, vector):
+        self.counts[gesture] += 1
+        self.gestures.append({ 'gesture': gesture, 'vector': vector })
+
+    def collect(self, now):
+        """ Gestures found since the last call, including knocks no further knock can change """
+        knocks = self.knocks
+        if knocks and (self.amplitude > self.shakeThreshold / 2 or self.shakeStart is not None):
+            # it became a shake
+            self.knocks = knocks = [ (now, 0.0) ] * 3
+        if knocks and self.burstStart is None and now - knocks[-1][0] > self.knockDuration:
+            if len(knocks) == 2 and now - knocks[-1][0] > 2 * self.knockDuration:
+                if knocks[1][0] - knocks[0][0] <= self.doubleKnockWindow:
+                    self.emit('double-knock', { 'strength': max(knocks[0][1], knocks[1][1]) })
+                self.knocks = []
+            elif now - knocks[-1][0] > self.doubleKnockWindow:
+                if len(knocks) == 1:
+                    self.emit('knock', { 'strength': knocks[0][1] })
+                self.knocks = []
+        gestures, self.gestures = self.gestures, []
+        return gestures
+
+    def getMetrics(self):
+        return { 'counts': dict(self.counts),
+                 'noiseFloor': math.sqrt(self.floor.mean),
+                 'shakeBins': self.dftX.bins }
+
+
+def makeVibrationDetectors(config):
+    if not config.get('vibrationGestures'):
+        return None
+    return VibrationDetectors(config['tiltSampleRate'], config['knockThreshold'], config['shakeThreshold'])
@@ -0,0 +1,147 @@
+""" Compare sensor loop jitter with acquisition in the web process and in its own process.
+
+A synthetic 8ms gesture loop stands in for the sensor half of rtcbotserver's loop.
+Synthetic clients load the web process's event loop the way aiortc does: bursts of
+short pure-Python work (JSON, small-packet hashing, object churn for the collector)
+every frame. In 'single' mode the gesture loop is a task in that event loop; in
+'split' mode it runs in another process and writes to a SharedRing that the event
+loop polls every 8ms.
+
+Reports how late each gesture pass ran against its schedule, and how long a frame
+took from being made to being picked up by the event loop.
+
+    python benchJitter.py --clients 4 --seconds 10
+"""
+import argparse
+import asyncio
+import hashlib
+import json as JSON
+import multiprocessing
+import struct
+import time
+from SharedRing import SharedRing
+
+
+INTERVAL = 0.008
+frame = struct.Struct('<dd')
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000.0
+    return { 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1] * 1000.0 }
+
+
+def burst(packets):
+    # roughly what one client costs the event loop per frame: SCTP/DTLS bookkeeping,
+    # JSON in and out, and garbage
+    garbage = []
+    for i in range(packets):
+        message = JSON.dumps({ 'gesture': 'pan', 'vector': { 'x': i * 0.1, 'y': -i * 0.1 }, 'seq': i })
+        hashlib.sha256(message.encode()).digest()
+        garbage.append({ 'message': JSON.loads(message), 'parts': [message] * 4 })
+    return len(garbage)
+
+
+async def client(packets, stop):
+    while not stop.is_set():
+        burst(packets)
+        await asyncio.sleep(0)
+        await asyncio.sleep(INTERVAL / 2)
+
+
+def gestureLoop(sink, seconds):
+    """ The synthetic sensor loop, returns how late each pass was """
+    lateness = []
+    start = deadline = time.monotonic()
+    while deadline - start < seconds:
+        deadline += INTERVAL
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        late = time.monotonic() - deadline
+        lateness.append(late)
+        sink(frame.pack(time.monotonic(), late))
+    return lateness
+
+
+async def asyncGestureLoop(sink, seconds):
+    lateness = []
+    start = deadline = time.monotonic()
+    while deadline - start < seconds:
+        deadline += INTERVAL
+        delay = deadline - time.monotonic()
+        await asyncio.sleep(max(delay, 0))
+        late = time.monotonic() - deadline
+        lateness.append(late)
+        sink(frame.pack(time.monotonic(), late))
+    return lateness
+
+
+def acquisition(ringName, seconds, ready):
+    ring = SharedRing(ringName, sharedTracker=True)
+    ready.set()
+    gestureLoop(ring.write, seconds)
+    ring.close()
+
+
+async def single(clients, packets, seconds):
+    stop = asyncio.Event()
+    delivery = []
+    sink = lambda payload: delivery.append(time.monotonic() - frame.unpack(payload)[0])
+    loads = [asyncio.ensure_future(client(packets, stop)) for i in range(clients)]
+    lateness = await asyncGestureLoop(sink, seconds)
+    stop.set()
+    await asyncio.gather(*loads)
+    return lateness, delivery
+
+
+async def split(clients, packets, seconds):
+    ring = SharedRing(slots=4096, slotSize=64, create=True)
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=acquisition, args=(ring.name, seconds, ready))
+    process.start()
+    ready.wait()
+    stop = asyncio.Event()
+    loads = [asyncio.ensure_future(client(packets, stop)) for i in range(clients)]
+    lateness = []
+    delivery = []
+    while process.is_alive():
+        now = time.monotonic()
+        for sequence, stamp, payload in ring.read():
+            made, late = frame.unpack(payload)
+            lateness.append(late)
+            delivery.append(now - made)
+        await asyncio.sleep(INTERVAL)
+    for sequence, stamp, payload in ring.read():
+        lateness.append(frame.unpack(payload)[1])
+    stop.set()
+    await asyncio.gather(*loads)
+    process.join()
+    ring.close()
+    return lateness, delivery
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sensor loop jitter, single process vs split acquisition.')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='synthetic clients loading the web event loop (default: 4)')
+    parser.add_argument('--packets', type=int, default=60,
+                        help='messages each client handles per burst (default: 60)')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='length of each run (default: 10)')
+    args = parser.parse_args()
+
+    print("%d clients x %d messages per burst, %.0fs per run, %.0fms gesture loop" % (args.clients, args.packets, args.seconds, INTERVAL * 1000))
+    print("%-7s %-22s %8s %8s %8s %8s" % ('mode', 'ms', 'p50', 'p95', 'p99', 'max'))
+    for mode, run in (('single', single), ('split', split)):
+        lateness, delivery = asyncio.run(run(args.clients, args.packets, args.seconds))
+        for name, values in (('gesture pass lateness', lateness), ('frame to event loop', delivery)):
+            p = percentiles(values)
+            print("%-7s %-22s %8.2f %8.2f %8.2f %8.2f" % (mode, name, p['p50'], p['p95'], p['p99'], p['max']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" How long the server takes to import and to boot, so startup cost can be tracked.
+
+Import time comes from `python -X importtime -c "import rtcbotserver"`, run in a fresh
+interpreter each time, along with the modules create_app imports lazily. Boot time is from
+starting `rtcbotserver.py --noDevices` to its first good /metrics response, for each
+transport setting. Exits with status 1 if importing rtcbotserver takes longer than
+--importBudget ms, so it can gate a build.
+
+    python benchStartup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def importTime(module):
+    """ Cumulative import time of module in a fresh interpreter, in ms """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=here, capture_output=True, text=True)
+    if result.returncode != 0:
+        return float('nan')
+    for line in reversed(result.stderr.splitlines()):
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    return float('nan')
+
+
+def bootTime(port, transport, workdir, timeout=30.0):
+    """ Seconds from starting the server to its first /metrics response """
+    logfile = os.path.join(workdir, 'server.log')
+    open(logfile, 'a').close()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(here, 'rtcbotserver.py'), '--localhost', '--noDevices',
+                               '--port', str(port), '--transport', transport, '--loglevel', 'warning',
+                               '--logfilename', logfile,
+                               '--stateFile', os.path.join(workdir, 'state.json'),
+                               '--analyticsDb', os.path.join(workdir, 'analytics.db'),
+                               '--geojsonCacheDir', os.path.join(workdir, 'geojson')],
+                              cwd=os.path.dirname(here), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                return float('nan')
+            try:
+                with urllib.request.urlopen('http://127.0.0.1:%d/metrics' % port, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        return float('nan')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the server\'s import and boot time.')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='repetitions of each measurement, the median is reported (default: 5)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port for the booted servers (default: 8765)')
+    parser.add_argument('--importBudget', type=float, default=250,
+                        help='fail if importing rtcbotserver takes longer than this many ms (default: 250)')
+    args = parser.parse_args()
+
+    print("%-32s %10s" % ('import (median of %d)' % args.runs, 'ms'))
+    imports = {}
+    for module in ('rtcbotserver', 'aiohttp', 'rtcbot', 'Phidget22.Devices.Accelerometer'):
+        imports[module] = statistics.median([importTime(module) for i in range(args.runs)])
+        print("%-32s %10.1f" % (module, imports[module]))
+
+    print("%-32s %10s" % ('boot to first response', 'ms'))
+    with tempfile.TemporaryDirectory() as workdir:
+        for transport in ('ws', 'webrtc', 'both'):
+            times = [bootTime(args.port, transport, workdir) for i in range(args.runs)]
+            print("%-32s %10.1f" % ('--transport ' + transport, statistics.median(times) * 1000.0))
+
+    if not imports['rtcbotserver'] <= args.importBudget:
+        print("import of rtcbotserver takes %.1fms, over the %.0fms budget" % (imports['rtcbotserver'], args.importBudget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+""" Lag and noise of the tilt filters, the accelerometer boxcar against the complementary filter.
+
+Input is the simulate.py recording format with a gyro reading on each sample:
+
+    {"t": 12.500, "tilt": [0.012, -0.003, 0.998], "gyro": [1.5, -0.2, 0.0]}
+
+Without --input a synthetic table is generated at --sampleRate: tilted in steps and
+ramps, with accelerometer noise, bumps and shaking (which the gyro does not feel) and gyro
+noise and bias. The reference for a synthetic run is the true gravity vector; for a
+recording it is a centred (zero lag) moving average of the accelerometer.
+
+Lag is the shift that best lines a filter's x and y up with the reference, noise is the
+standard deviation of what is left after that shift, both over the whole run.
+
+    python benchTiltFilter.py --seconds 120 --boxcar 10 --tau 0.5
+"""
+import argparse
+import json as JSON
+import math
+import random
+import statistics
+import time
+from RunningStats import WindowedStats
+from OrientationFilter import ComplementaryFilter
+
+
+def syntheticSpatial(seconds, sampleRate, seed):
+    """ (t, acceleration, angularRate, true gravity) at sampleRate for seconds """
+    rng = random.Random(seed)
+    dt = 1.0 / sampleRate
+    bias = [ rng.uniform(-0.5, 0.5) for i in range(3) ]
+    roll = pitch = 0.0
+    rollRate = pitchRate = 0.0
+    nextMove = 0.0
+    shakeUntil = 0.0
+    t = 0.0
+    while t < seconds:
+        if t >= nextMove:
+            nextMove = t + rng.uniform(0.5, 3.0)
+            # tilt somewhere new over a fraction of a second, or hold
+            target = (rng.uniform(-12, 12), rng.uniform(-12, 12)) if rng.random() < 0.7 else (roll, pitch)
+            moveTime = rng.uniform(0.1, 0.6)
+            rollRate = (target[0] - roll) / moveTime
+            pitchRate = (target[1] - pitch) / moveTime
+            moveUntil = t + moveTime
+            if rng.random() < 0.2:
+                shakeUntil = t + rng.uniform(0.2, 1.0)
+        if t >= moveUntil:
+            rollRate = pitchRate = 0.0
+        roll += rollRate * dt
+        pitch += pitchRate * dt
+        r, p = math.radians(roll), math.radians(pitch)
+        gravity = [ -math.sin(p), math.sin(r) * math.cos(p), math.cos(r) * math.cos(p) ]
+        linear = [ 0.0, 0.0, 0.0 ]
+        if t < shakeUntil:
+            linear = [ 0.05 * math.sin(2 * math.pi * 17 * t), 0.05 * math.cos(2 * math.pi * 13 * t), 0.0 ]
+        elif rng.random() < 0.002:
+            linear = [ rng.gauss(0, 0.1), rng.gauss(0, 0.1), rng.gauss(0, 0.1) ]
+        acceleration = [ g + l + rng.gauss(0.0, 0.004) for g, l in zip(gravity, linear) ]
+        angularRate = [ rollRate + bias[0] + rng.gauss(0.0, 0.3),
+                        pitchRate + bias[1] + rng.gauss(0.0, 0.3),
+                        bias[2] + rng.gauss(0.0, 0.3) ]
+        yield t, acceleration, angularRate, gravity
+        t += dt
+
+
+def recordedSpatial(filename, window):
+    """ (t, acceleration, angularRate, centred moving average of acceleration) from a recording """
+    with open(filename) as f:
+        events = [ JSON.loads(line) for line in f if line.strip() ]
+    samples = [ (e['t'], e['tilt'], e['gyro']) for e in events if 'gyro' in e ]
+    half = window // 2
+    for i, (t, acceleration, angularRate) in enumerate(samples):
+        around = samples[max(0, i - half):i + half + 1]
+        reference = [ sum(s[1][k] for s in around) / len(around) for k in range(3) ]
+        yield t, acceleration, angularRate, reference
+
+
+def runFilters(samples, boxcar, tau):
+    """ x, y of the reference, boxcar and complementary filter per sample, and the cost of each filter """
+    stats = [ WindowedStats(boxcar), WindowedStats(boxcar) ]
+    fusion = ComplementaryFilter(tau)
+    out = { 'reference': ([], []), 'boxcar': ([], []), 'complementary': ([], []) }
+    cost = { 'boxcar': 0.0, 'complementary': 0.0 }
+    times = []
+    for t, acceleration, angularRate, reference in samples:
+        times.append(t)
+        start = time.perf_counter()
+        stats[0].add(acceleration[0])
+        stats[1].add(acceleration[1])
+        cost['boxcar'] += time.perf_counter() - start
+        start = time.perf_counter()
+        gravity = fusion.update(acceleration, angularRate, t * 1000.0)
+        cost['complementary'] += time.perf_counter() - start
+        for name, x, y in (('reference', reference[0], reference[1]),
+                           ('boxcar', stats[0].mean, stats[1].mean),
+                           ('complementary', gravity[0], gravity[1])):
+            out[name][0].append(x)
+            out[name][1].append(y)
+    return times, out, cost
+
+
+def lagAndNoise(reference, signal, maxShift):
+    """ samples of shift that best line signal up with reference, and the residual's std there """
+    best = None
+    for shift in range(maxShift + 1):
+        residual = [ s - r for r, s in zip(reference[:len(reference) - shift], signal[shift:]) ]
+        error = sum(e * e for e in residual) / len(residual)
+        if best is None or error < best[1]:
+            best = (shift, error, residual)
+    return best[0], statistics.pstdev(best[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare lag and noise of the tilt filters.')
+    parser.add_argument('--input',
+                        help='recording with tilt and gyro on each sample (default: synthetic)')
+    parser.add_argument('--seconds', type=float, default=120,
+                        help='length of the synthetic run (default: 120)')
+    parser.add_argument('--sampleRate', type=float, default=250,
+                        help='samples per second of the synthetic run (default: 250)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed for the synthetic run (default: 1)')
+    parser.add_argument('--boxcar', type=int, default=10,
+                        help='boxcar length, as --accelerometerQueueLength (default: 10)')
+    parser.add_argument('--tau', type=float, default=0.5,
+                        help='complementary filter time constant, as --tiltFilterTau (default: 0.5)')
+    parser.add_argument('--maxLag', type=float, default=0.5,
+                        help='longest lag to look for, in seconds (default: 0.5)')
+    args = parser.parse_args()
+
+    if args.input:
+        samples = recordedSpatial(args.input, args.boxcar * 5)
+    else:
+        samples = syntheticSpatial(args.seconds, args.sampleRate, args.seed)
+    times, out, cost = runFilters(samples, args.boxcar, args.tau)
+    interval = (times[-1] - times[0]) / max(len(times) - 1, 1)
+    maxShift = max(1, int(args.maxLag / interval))
+
+    print("%d samples, %.1f Hz" % (len(times), 1.0 / interval))
+    print("%-14s %8s %8s %10s %10s %12s" % ('filter', 'lagX ms', 'lagY ms', 'noiseX g', 'noiseY g', 'us/sample'))
+    for name in ('boxcar', 'complementary'):
+        lagX, noiseX = lagAndNoise(out['reference'][0], out[name][0], maxShift)
+        lagY, noiseY = lagAndNoise(out['reference'][1], out[name][1], maxShift)
+        print("%-14s %8.1f %8.1f %10.5f %10.5f %12.2f" % (name, lagX * interval * 1000.0, lagY * interval * 1000.0,
+                                                        noiseX, noiseY, cost[name] / len(times) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
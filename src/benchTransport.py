@@ -0,0 +1,192 @@
+""" Compare the rtcbot data channel with the /ws WebSocket for the gesture stream.
+
+Starts a small server in a subprocess that offers both transports the way
+rtcbotserver.py does, then for each transport measures
+  connect     from starting to connect until the first message arrives
+  cpu/msg     server process CPU time per gesture sent
+  latency     send to receive, same host
+for a stream of pan gestures at the server loop's 8ms pace.
+
+    python benchTransport.py --messages 1000
+"""
+import argparse
+import asyncio
+import json as JSON
+import os
+import struct
+import subprocess
+import sys
+import time
+import aiohttp
+from aiohttp import web
+from rtcbot import RTCConnection
+from Transports import WebSocketClient, encodeFrames
+
+
+INTERVAL = 0.008
+stamp = struct.Struct('<d')
+
+
+def gesture(i):
+    return { 'gesture': 'pan', 'vector': { 'x': 0.001 * i, 'y': -0.001 * i } }
+
+
+async def stream(send, count):
+    """ Sends count gestures one per INTERVAL, returns the CPU time it took """
+    cpu = time.process_time()
+    deadline = time.monotonic()
+    for i in range(count):
+        send(i)
+        deadline += INTERVAL
+        await asyncio.sleep(max(deadline - time.monotonic(), 0))
+    return time.process_time() - cpu
+
+
+def serve(port):
+    routes = web.RouteTableDef()
+    connections = []
+
+    def command(msg, put):
+        request = JSON.loads(msg) if isinstance(msg, str) else msg
+        if request.get('command') == 'hello':
+            put({ 'data': 'pong' })
+        elif request.get('command') == 'stream':
+            async def run():
+                cpu = await stream(lambda i: put(dict(gesture(i), t=time.time())), request['count'])
+                put({ 'data': 'done', 'cpu': cpu })
+            asyncio.ensure_future(run())
+
+    @routes.post("/connect")
+    async def connect(request):
+        conn = RTCConnection()
+        connections.append(conn)
+        conn.subscribe(lambda msg: command(msg, conn.put_nowait))
+        return web.json_response(await conn.getLocalDescription(await request.json()))
+
+    @routes.get("/ws")
+    async def websocket(request):
+        ws = web.WebSocketResponse(compress=False)
+        await ws.prepare(request)
+        client = WebSocketClient(ws, binary=request.query.get('format') == 'binary')
+
+        def put(message):
+            text, data = encodeFrames(message)
+            if data is not None:
+                # the send time rides along at the end of the frame
+                data += stamp.pack(message['t'])
+            client.send(text, data)
+        writer = asyncio.ensure_future(client.run())
+        async for msg in ws:
+            if msg.type == web.WSMsgType.TEXT:
+                command(msg.data, put)
+        writer.cancel()
+        return ws
+
+    app = web.Application()
+    app.add_routes(routes)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+class Receiver:
+    """ Collects latencies and tells us when the server said pong and done """
+
+    def __init__(self):
+        self.latencies = []
+        self.pong = asyncio.Event()
+        self.done = asyncio.Event()
+        self.serverCpu = 0.0
+
+    def onMessage(self, message):
+        now = time.time()
+        if isinstance(message, bytes):
+            self.latencies.append(now - stamp.unpack(message[-stamp.size:])[0])
+            return
+        if isinstance(message, str):
+            message = JSON.loads(message)
+        if 't' in message:
+            self.latencies.append(now - message['t'])
+        elif message.get('data') == 'pong':
+            self.pong.set()
+        elif message.get('data') == 'done':
+            self.serverCpu = message['cpu']
+            self.done.set()
+
+
+async def benchWebSocket(url, count, format):
+    receiver = Receiver()
+    async with aiohttp.ClientSession() as session:
+        start = time.monotonic()
+        async with session.ws_connect(url + '/ws?format=' + format, compress=0) as ws:
+            async def read():
+                async for msg in ws:
+                    receiver.onMessage(msg.data)
+            reader = asyncio.ensure_future(read())
+            await ws.send_str(JSON.dumps({ 'command': 'hello' }))
+            await receiver.pong.wait()
+            connectTime = time.monotonic() - start
+            cpu = time.process_time()
+            await ws.send_str(JSON.dumps({ 'command': 'stream', 'count': count }))
+            await receiver.done.wait()
+            clientCpu = time.process_time() - cpu
+            reader.cancel()
+    return connectTime, receiver, clientCpu
+
+
+async def benchDataChannel(url, count):
+    receiver = Receiver()
+    conn = RTCConnection()
+    conn.subscribe(receiver.onMessage)
+    start = time.monotonic()
+    offer = await conn.getLocalDescription()
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url + '/connect', data=JSON.dumps(offer)) as response:
+            await conn.setRemoteDescription(await response.json())
+    conn.put_nowait({ 'command': 'hello' })
+    await receiver.pong.wait()
+    connectTime = time.monotonic() - start
+    cpu = time.process_time()
+    conn.put_nowait({ 'command': 'stream', 'count': count })
+    await receiver.done.wait()
+    clientCpu = time.process_time() - cpu
+    await conn.close()
+    return connectTime, receiver, clientCpu
+
+
+def report(name, count, connectTime, receiver, clientCpu):
+    latencies = sorted(receiver.latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000.0
+    print("%-16s %10.1f %12.1f %12.1f %8.2f %8.2f %8.2f %6d" % (name, connectTime * 1000.0,
+          receiver.serverCpu / count * 1e6, clientCpu / count * 1e6,
+          pick(0.5), pick(0.99), latencies[-1] * 1000.0, len(latencies)))
+
+
+async def bench(url, count):
+    print("%-16s %10s %12s %12s %8s %8s %8s %6s" % ('transport', 'connect ms', 'server us/msg', 'client us/msg', 'p50 ms', 'p99 ms', 'max ms', 'recvd'))
+    report('websocket json', count, *await benchWebSocket(url, count, 'json'))
+    report('websocket binary', count, *await benchWebSocket(url, count, 'binary'))
+    report('data channel', count, *await benchDataChannel(url, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data channel vs WebSocket: connect time, CPU per message and latency.')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='gestures streamed per transport (default: 1000)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port for the benchmark server (default: 8765)')
+    parser.add_argument('--serve', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port)
+        return
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port)])
+    try:
+        time.sleep(2)
+        asyncio.run(bench('http://127.0.0.1:%d' % args.port, args.messages))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
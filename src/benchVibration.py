@@ -0,0 +1,107 @@
+""" CPU cost and hit rate of the knock and shake detectors on a synthetic table.
+
+The stream is resting noise with slow tilting (what panning looks like), with knocks,
+double knocks and shakes dropped in at known times. Each is reported as found or missed,
+with any gesture found where there was none counted as false. Cost is per sample and
+as a share of one core at each sample rate, up to the accelerometer's fastest.
+
+    python benchVibration.py --rates 100,250,1000 --events 40
+"""
+import argparse
+import math
+import random
+import time
+from VibrationDetectors import VibrationDetectors
+
+
+def syntheticStream(rate, events, seed):
+    """ (t, x, y, z) samples and the (t, gesture) events in them """
+    rng = random.Random(seed)
+    planned = []
+    t = 2.0
+    for i in range(events):
+        gesture = rng.choice(('knock', 'double-knock', 'shake', 'none'))
+        planned.append((t, gesture))
+        t += rng.uniform(3.0, 5.0)
+    end = t + 2.0
+    samples = []
+    impulses = {}
+    shakes = []
+    for start, gesture in planned:
+        if gesture == 'knock':
+            impulses[int(start * rate)] = rng.uniform(0.2, 0.5)
+        elif gesture == 'double-knock':
+            impulses[int(start * rate)] = rng.uniform(0.2, 0.5)
+            impulses[int((start + rng.uniform(0.2, 0.4)) * rate)] = rng.uniform(0.2, 0.5)
+        elif gesture == 'shake':
+            shakes.append((start, start + rng.uniform(1.0, 1.5), rng.uniform(3.0, 5.0), rng.uniform(0.1, 0.25)))
+    for i in range(int(end * rate)):
+        t = i / float(rate)
+        # slow tilting, as when someone pans around
+        x = 0.15 * math.sin(2 * math.pi * 0.1 * t) + rng.gauss(0.0, 0.002)
+        y = 0.1 * math.sin(2 * math.pi * 0.07 * t + 1.0) + rng.gauss(0.0, 0.002)
+        z = 1.0 + rng.gauss(0.0, 0.002)
+        # a knock rings down over a few milliseconds
+        for lag in range(int(0.01 * rate) + 1):
+            if i - lag in impulses:
+                z += impulses[i - lag] * math.exp(-lag / (0.003 * rate + 1e-9)) * (-1) ** lag
+        for start, stop, frequency, amplitude in shakes:
+            if start <= t < stop:
+                x += amplitude * math.sin(2 * math.pi * frequency * (t - start))
+                y += 0.5 * amplitude * math.sin(2 * math.pi * frequency * (t - start) + 0.5)
+        samples.append((t, x, y, z))
+    return samples, planned
+
+
+def run(rate, events, seed, collectEvery=0.008):
+    samples, planned = syntheticStream(rate, events, seed)
+    detectors = VibrationDetectors(rate)
+    found = []
+    nextCollect = 0.0
+    cost = 0.0
+    for t, x, y, z in samples:
+        start = time.perf_counter()
+        detectors.add(x, y, z, t)
+        cost += time.perf_counter() - start
+        if t >= nextCollect:
+            # the server loop's pass
+            for gesture in detectors.collect(t):
+                found.append((t, gesture['gesture']))
+            nextCollect = t + collectEvery
+    # match each planned event to the first gesture found within 1.5s of it
+    hits = { 'knock': [0, 0], 'double-knock': [0, 0], 'shake': [0, 0] }
+    used = set()
+    for start, gesture in planned:
+        if gesture == 'none':
+            continue
+        hits[gesture][1] += 1
+        for i, (t, kind) in enumerate(found):
+            if i not in used and start <= t <= start + 1.5:
+                used.add(i)
+                if kind == gesture:
+                    hits[gesture][0] += 1
+                break
+    false = len(found) - len(used)
+    return cost / len(samples), hits, false, len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU cost and hit rate of the vibration detectors.')
+    parser.add_argument('--rates', default='100,250,1000',
+                        help='sample rates to try, in Hz (default: 100,250,1000)')
+    parser.add_argument('--events', type=int, default=40,
+                        help='knocks, double knocks, shakes and quiet spells to drop in (default: 40)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print("%6s %10s %10s %8s %14s %8s %8s" % ('Hz', 'us/sample', '% of core', 'knock', 'double-knock', 'shake', 'false'))
+    for rate in [ int(r) for r in args.rates.split(',') ]:
+        perSample, hits, false, count = run(rate, args.events, args.seed)
+        print("%6d %10.2f %10.2f %8s %14s %8s %8d" % (rate, perSample * 1e6, perSample * rate * 100.0,
+                                                     '%d/%d' % tuple(hits['knock']),
+                                                     '%d/%d' % tuple(hits['double-knock']),
+                                                     '%d/%d' % tuple(hits['shake']), false))
+
+
+if __name__ == '__main__':
+    main()
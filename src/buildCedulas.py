@@ -0,0 +1,96 @@
+""" Offline build step for the GeoConnecTable cedula images
+
+Resizes each web/cedulas/Tilty N.png to the size it is shown at on the table
+and writes AVIF/WebP variants plus a manifest.json that the browser uses to
+load a cedula only when its zoom layer is entered.
+
+Run once after changing the artwork:
+    python src/buildCedulas.py --source web/cedulas
+"""
+
+import argparse
+import json as JSON
+import os.path
+import re
+
+from PIL import Image, features
+
+
+# cedulas open at 828x762 (img.open in geoconnectable.css) inside the 1080x1080 table
+parser = argparse.ArgumentParser(prog='buildCedulas', description='Build lazy-loadable cedula image variants.')
+parser.add_argument('--source', default='web/cedulas',
+                    help='directory holding the "Tilty N.png" originals (default: web/cedulas)')
+parser.add_argument('--output', default=None,
+                    help='directory for the variants (default: <source>/1080)')
+parser.add_argument('--maxWidth', type=int, dest='maxWidth', default=828,
+                    help='largest width a cedula is displayed at (default: 828)')
+parser.add_argument('--maxHeight', type=int, dest='maxHeight', default=762,
+                    help='largest height a cedula is displayed at (default: 762)')
+parser.add_argument('--quality', type=int, default=80,
+                    help='encoder quality for the lossy variants (default: 80)')
+
+
+# (mime type, extension, Pillow format) in the order the browser should prefer them
+variantFormats = [
+    ('image/avif', 'avif', 'AVIF'),
+    ('image/webp', 'webp', 'WEBP'),
+]
+
+sourcePattern = re.compile(r'^Tilty (\d+)\.png$')
+
+
+def availableFormats():
+    retval = []
+    for mimeType, extension, pillowFormat in variantFormats:
+        if features.check(pillowFormat.lower()):
+            retval.append((mimeType, extension, pillowFormat))
+        else:
+            print("skipping %s: not supported by this Pillow build" % mimeType)
+    return retval
+
+
+def buildCedula(sourcePath, outputDir, siteId, formats, args):
+    image = Image.open(sourcePath)
+    image.thumbnail((args.maxWidth, args.maxHeight), Image.LANCZOS)
+    urlBase = os.path.basename(os.path.normpath(args.source))
+    outputUrl = urlBase + '/' + os.path.relpath(outputDir, args.source).replace(os.sep, '/')
+    variants = []
+    for mimeType, extension, pillowFormat in formats:
+        fileName = '%s.%s' % (siteId, extension)
+        outputPath = os.path.join(outputDir, fileName)
+        image.save(outputPath, pillowFormat, quality=args.quality)
+        variants.append({'type': mimeType,
+                         'src': outputUrl + '/' + fileName,
+                         'bytes': os.path.getsize(outputPath)})
+    # the untouched original stays last as the fallback for browsers without either codec
+    variants.append({'type': 'image/png',
+                     'src': urlBase + '/' + os.path.basename(sourcePath),
+                     'bytes': os.path.getsize(sourcePath)})
+    return {'width': image.width,
+            'height': image.height,
+            'variants': variants}
+
+
+def main():
+    args = parser.parse_args()
+    outputDir = args.output or os.path.join(args.source, '1080')
+    os.makedirs(outputDir, exist_ok=True)
+    formats = availableFormats()
+
+    manifest = {}
+    for fileName in sorted(os.listdir(args.source)):
+        match = sourcePattern.match(fileName)
+        if not match:
+            continue
+        siteId = 'site%s' % match.group(1)
+        manifest[siteId] = buildCedula(os.path.join(args.source, fileName), outputDir, siteId, formats, args)
+        print(siteId, ' '.join('%s=%d' % (v['type'], v['bytes']) for v in manifest[siteId]['variants']))
+
+    manifestPath = os.path.join(args.source, 'manifest.json')
+    with open(manifestPath, 'w') as f:
+        JSON.dump(manifest, f, indent=1, sort_keys=True)
+    print("wrote %d cedulas to %s" % (len(manifest), manifestPath))
+
+
+if __name__ == '__main__':
+    main()
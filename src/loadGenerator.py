@@ -0,0 +1,174 @@
+""" Finds how many displays one server can feed, by connecting more and more headless peers.
+
+Each peer is an aiortc connection set up the way the page does it (GET /offer, answer,
+POST /connect) and subscribed to the gesture stream. At every step the generator adds
+peers, lets them run for --stepSeconds, and reports per-peer receive rate, gaps in the
+sequence numbers, latency from the server's 'ts' stamp, and the server's own CPU and
+event loop lag from /metrics. It stops at --max peers or once the step saturates: the
+slowest peer gets less than --minRate of the stream rate, p99 latency passes
+--maxLatency, or the server's loop lag passes --maxLoopLag.
+
+Run the server with a synthetic stream so there is something to receive:
+
+    python rtcbotserver.py --noDevices --testHarness 60
+    python loadGenerator.py --url http://127.0.0.1:8080 --step 2 --max 20
+
+Peers run in this process, on the same machine, so the generator's own CPU is
+reported alongside the server's.
+"""
+import argparse
+import asyncio
+import json as JSON
+import time
+import aiohttp
+from rtcbot import RTCConnection
+
+
+class Peer:
+    """ One headless display """
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.conn = RTCConnection()
+        self.conn.subscribe(self.onMessage)
+        # rtcbot.js hands every channel's messages to the page's subscriber, the Python side
+        # keeps the server's extra 'pan' lane separate
+        self.conn.onDataChannel(lambda channel: channel.subscribe(self.onMessage))
+        self.connectTime = None
+        self.started = None
+        self.next = {}
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.lost = 0
+        self.reordered = 0
+        self.latencies = []
+        self.windowStart = time.time()
+
+    async def connect(self):
+        self.started = time.time()
+        async with self.session.get(self.url + '/offer') as response:
+            offer = await response.json()
+        await self.conn.setRemoteDescription({ 'sdp': offer['sdp'], 'type': offer['type'] })
+        answer = await self.conn.getLocalDescription()
+        async with self.session.post(self.url + '/connect', data=JSON.dumps(dict(answer, id=offer['id']))) as response:
+            await response.read()
+        self.conn.put_nowait("Display connected!")
+
+    def onMessage(self, message):
+        now = time.time()
+        if not isinstance(message, dict) or 'gesture' not in message:
+            return
+        if self.connectTime is None:
+            self.connectTime = now - self.started
+        self.frames += 1
+        if 'ts' in message:
+            self.latencies.append(now - message['ts'])
+        lane = message.get('lane')
+        if lane is not None:
+            expected = self.next.get(lane, message['seq'])
+            if message['seq'] < expected:
+                self.reordered += 1
+                self.lost -= 1
+            else:
+                self.lost += message['seq'] - expected
+                self.next[lane] = message['seq'] + 1
+
+    def rate(self):
+        return self.frames / max(time.time() - self.windowStart, 1e-6)
+
+    async def close(self):
+        await self.conn.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def serverMetrics(session, url):
+    try:
+        async with session.get(url + '/metrics') as response:
+            return (await response.json()).get('server', {})
+    except (aiohttp.ClientError, ValueError):
+        return {}
+
+
+async def run(args):
+    peers = []
+    baseline = None
+    print("%5s %10s %9s %9s %7s %7s %8s %8s %8s %8s %8s" % ('peers', 'connect ms', 'rate/s', 'min rate', 'lost', 'reord',
+          'p50 ms', 'p99 ms', 'srv cpu', 'lag ms', 'gen cpu'))
+    async with aiohttp.ClientSession() as session:
+        try:
+            count = args.start
+            while count <= args.max:
+                newPeers = [Peer(session, args.url) for i in range(count - len(peers))]
+                await asyncio.gather(*[p.connect() for p in newPeers])
+                peers += newPeers
+                await asyncio.sleep(args.settle)
+                for p in peers:
+                    p.reset()
+                cpu = time.process_time()
+                wall = time.time()
+                await asyncio.sleep(args.stepSeconds)
+                generatorCpu = (time.process_time() - cpu) / (time.time() - wall)
+                server = await serverMetrics(session, args.url)
+                rates = [p.rate() for p in peers]
+                latencies = [l for p in peers for l in p.latencies]
+                connects = [p.connectTime for p in newPeers if p.connectTime is not None]
+                meanRate = sum(rates) / len(rates)
+                p99 = percentile(latencies, 0.99)
+                print("%5d %10.1f %9.1f %9.1f %7d %7d %8.2f %8.2f %8.2f %8.2f %8.2f" % (len(peers),
+                      percentile(connects, 0.5) * 1000.0, meanRate, min(rates),
+                      sum(p.lost for p in peers), sum(p.reordered for p in peers),
+                      percentile(latencies, 0.5) * 1000.0, p99 * 1000.0,
+                      server.get('cpu', float('nan')), server.get('loopLag', float('nan')) * 1000.0, generatorCpu))
+                if baseline is None:
+                    baseline = meanRate
+                saturated = []
+                if min(rates) < args.minRate * baseline:
+                    saturated.append('slowest peer below %.0f%% of the stream rate' % (args.minRate * 100))
+                if p99 > args.maxLatency / 1000.0:
+                    saturated.append('p99 latency over %.0fms' % args.maxLatency)
+                if server.get('loopLag', 0.0) > args.maxLoopLag / 1000.0:
+                    saturated.append('server loop lag over %.0fms' % args.maxLoopLag)
+                if saturated:
+                    print("saturated at %d peers: %s" % (len(peers), ', '.join(saturated)))
+                    break
+                count += args.step
+            else:
+                print("not saturated at %d peers" % len(peers))
+        finally:
+            await asyncio.gather(*[p.close() for p in peers], return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ramp headless WebRTC displays against the server until it saturates.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080',
+                        help='the server (default: http://127.0.0.1:8080)')
+    parser.add_argument('--start', type=int, default=1,
+                        help='peers in the first step (default: 1)')
+    parser.add_argument('--step', type=int, default=1,
+                        help='peers added per step (default: 1)')
+    parser.add_argument('--max', type=int, default=32,
+                        help='stop after this many peers (default: 32)')
+    parser.add_argument('--stepSeconds', type=float, default=10,
+                        help='seconds measured per step (default: 10)')
+    parser.add_argument('--settle', type=float, default=2,
+                        help='seconds after connecting before measuring (default: 2)')
+    parser.add_argument('--minRate', type=float, default=0.9,
+                        help='saturated when the slowest peer gets less than this share of the one-peer rate (default: 0.9)')
+    parser.add_argument('--maxLatency', type=float, default=100,
+                        help='saturated when p99 latency passes this many ms (default: 100)')
+    parser.add_argument('--maxLoopLag', type=float, default=8,
+                        help='saturated when the server\'s mean loop lag passes this many ms (default: 8)')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,27 @@
 import logging
 import argparse
+import os
 import socket
 import datetime
+import gzip
+import time
+import json as JSON
 from shutil import copyfile
-from GestureProcessor import TiltGestureProcessor, SpinGestureProcessor, TestHarnessGestureProcessor
-from Queue import Queue
-from SpinData import SpinData
-from TiltData import TiltData
+from GestureProcessor import TestHarnessGestureProcessor, SyntheticGestureProcessor
+from Scenario import loadScenario
+from Hotspots import Viewport, HotspotIndex, loadHotspotConfig
+from GeoJsonCache import GeoJsonCache
+from StateSnapshot import StateSnapshot
+from Mounting import mountingMatrix
+from Acquisition import makeGestureSource, AcquisitionClient, IdleGestureSource
+from Transports import Displays, WebSocketClient, DataChannelLanes
+from LoopMonitor import LoopMonitor
+from MemoryMonitor import MemoryMonitor, pipelineClasses
+from Analytics import Analytics
 import asyncio
+# aiohttp, rtcbot and the Phidget sensor classes are imported by create_app, and only
+# the ones it needs: importing this module opens nothing and starts nothing
 
-from aiohttp import web
-routes = web.RouteTableDef()
-
-from rtcbot import RTCConnection, getRTCBotJS
 
 
 parser = argparse.ArgumentParser(prog='tiltyserver', description='Serve Phidget sensor data via websocket.')
@@ -20,8 +29,8 @@ parser.add_argument('--localhost', action='store_true',
                    help='force use of 127.0.0.1')
 parser.add_argument('--port', '-p', 
                     type=int, dest='local_port_num',
-                    default=5678,
-                   help='set a tcp port for the server (default: 5678)')
+                    default=8080,
+                   help='set a tcp port for the server (default: 8080)')
 parser.add_argument('--loglevel', nargs=1,
                     choices=['info', 'warning', 'debug', 'error', 'critical'],
                     default=['debug'],
@@ -36,7 +45,11 @@ parser.add_argument('--accelerometerQueueLength',
 parser.add_argument('--encoderQueueLength', 
                     type=int, dest='encoderQueueLength',
                     default=1,
-                    help='queue length for averaging spin data')
+                    help='no longer used, see --spinSmoothing')
+parser.add_argument('--spinSmoothing', 
+                    type=float, dest='spinSmoothing',
+                    default=0,
+                    help='time constant (in milliseconds) over which encoder ticks are let out as zoom (0 sends each loop\'s ticks at once)')
 parser.add_argument('--tiltSampleRate', 
                     type=float, dest='tiltSampleRate',
                     default=100,
@@ -45,6 +58,22 @@ parser.add_argument('--tiltThreshold',
                     type=float, dest='tiltThreshold',
                     default=0.004,
                     help='minimum accelerometer deflection from 0 to register as changed')
+parser.add_argument('--tiltFilter', 
+                    choices=['accel', 'complementary'], dest='tiltFilter',
+                    default='accel',
+                    help='accel averages the accelerometer over --accelerometerQueueLength samples, complementary fuses it with the Spatial\'s gyro (default: accel)')
+parser.add_argument('--tiltFilterTau', 
+                    type=float, dest='tiltFilterTau',
+                    default=0.5,
+                    help='seconds over which the complementary filter trusts the gyro before the accelerometer corrects it')
+parser.add_argument('--noiseK', 
+                    type=float, dest='noiseK',
+                    default=0,
+                    help='if set, use this many standard deviations of the resting signal as the tilt threshold instead of --tiltThreshold')
+parser.add_argument('--noiseAlpha', 
+                    type=float, dest='noiseAlpha',
+                    default=0.01,
+                    help='weight of each new resting sample in the noise estimate')
 parser.add_argument('--swapXY', 
                     type=int, dest='swapXY',
                     default=1,
@@ -61,186 +90,190 @@ parser.add_argument('--flipZ',
                     type=int, dest='flipZ',
                     default=-1,
                     help='change the logic of spin direction on zoom')
-args = parser.parse_args()
-
-numeric_level = getattr(logging, args.loglevel[0].upper(), None)
-if not isinstance(numeric_level, int):
-    raise ValueError('Invalid log level: %s' % args.loglevel[0].upper())
-copyfile(args.logfilename, args.logfilename + '.previous')
-#FORMAT = '%(asctime)-15s %(clientip)s %(user)-8s %(message)s'
-FORMAT = '%(asctime)-15s  %(message)s'
-logging.basicConfig(format=FORMAT, level=numeric_level, filename=args.logfilename, filemode='w', )
-logger = logging.getLogger('sensorserver')
-websocket_logger = logging.getLogger('websockets.server')
-websocket_logger.setLevel(logging.DEBUG)
-websocket_logger.addHandler(logging.StreamHandler)
-
-server_port = args.local_port_num
-
-if (args.localhost):
-    local_ip_address = "127.0.0.1"
-else:
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(('8.8.8.8', 1))  # connect() for UDP doesn't send packets
-    local_ip_address = s.getsockname()[0]
-d = {'clientip': local_ip_address, 'user': 'pi'}
-logger.warning('Server starting: %s', 'defaults loaded %s %s' %(local_ip_address,args), extra=d)
-
-config = {
-    'accelerometerQueueLength': args.accelerometerQueueLength,
-    'encoderQueueLength': args.encoderQueueLength,
-    'tiltSampleRate' : args.tiltSampleRate,
-    'tiltThreshold' : args.tiltThreshold,
-    'swapXY' : args.swapXY,
-    'flipX' : args.flipX,
-    'flipY' : args.flipY,
-    'flipZ' : args.flipZ,
-}
-
-#Create an encoder object
-try:
-    spindata = SpinData(config=config)
-except RuntimeError as e:
-
-    d = {'clientip': local_ip_address, 'user': 'pi'}
-    logger.error('Spin server starting error: %s', "Runtime spinner Exception: %s" % e.details, extra=d)
-    # exit(1)
-
-#Create an accelerometer object
-try:
-    tiltdata = TiltData(config=config)
-
-except RuntimeError as e:
-    print()
-    print("Exiting....")
-    d = {'clientip': local_ip_address, 'user': 'pi'}
-
-    logger.error('Tilt server starting error: %s', "Runtime Exception: %s" % e.details, extra=d)
-    exit(1)
-testgp = None # TestHarnessGestureProcessor(None, config)
-
-# For this example, we use just one global connection
-running = False
-print("setting up RTC")
-webRTC = RTCConnection()
-@webRTC.onReady
-def readyCallback():
-    print("RTC Ready!")
-    
-async def tilt():
-    d = {'clientip': local_ip_address, 'user': 'pi', }
-    #logger.info('webrtc connection made: %s', "tilt server %s port %d " % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
-    print("starting phidgets on webrtc")
-    tiltdata.level_table()
-    try:
-        while True:
-            now = datetime.datetime.utcnow().isoformat() + 'Z'
-            if (testgp and testgp.run()):
-                outbound_message = testgp.nextAction()
-                d = {'clientip': local_ip_address, 'user': 'pi' }
-                logger.debug('sending test data: %s', "testgp next action=%s" % outbound_message, extra=d)
-                try:
-                    #await websocket.send(outbound_message)
-                    webRTC.web.json_response(outbound_message)
-                    webRTC.put_nowait(outbound_message)
-                except Exception: #websockets.exceptions.ConnectionClosed:
-                    d = {'clientip': local_ip_address, 'user': 'pi' }
-                    logger.info('sending test data: %s', "client went away=%s" % outbound_message, extra=d)
-                    break           
-            if (tiltdata.gestureProcessor.run()):
-                outbound_message = tiltdata.gestureProcessor.nextAction()
-                d = {'clientip': local_ip_address, 'user': 'pi'}
-                logger.debug('sending tilt data: %s', "tilt nextAction=%s" % outbound_message, extra=d)
-                try:
-                    #await websocket.send(outbound_message)
-                    webRTC.put_nowait(outbound_message)
-                except Exception: #websockets.exceptions.ConnectionClosed:
-                    d = {'clientip': local_ip_address, 'user': 'pi' }
-                    logger.debug('sending tilt data: %s', "client went away=%s" % outbound_message, extra=d)
-                    break
-            if (spindata.gestureProcessor.run()):
-                outbound_message = spindata.gestureProcessor.nextAction()
-                d = {'clientip': local_ip_address, 'user': 'pi' }
-                logger.debug('sending spin data: %s', "spin gp nextAction=%s" % outbound_message, extra=d)
-                try:
-                    #await websocket.send(outbound_message)
-                    webRTC.put_nowait(outbound_message)
-                except Exception: #websockets.exceptions.ConnectionClosed:
-                    d = {'clientip': local_ip_address, 'user': 'pi' }
-                    logger.debug('sending spin data: %s', "client went away=%s" % outbound_message, extra=d)
-                    break
-            #await websocket.send(json.dumps(now))
-            await asyncio.sleep(0.008)
-    except  Exception: #websockets.exceptions.ConnectionResetError:
-        d = {'clientip': local_ip_address, 'user': 'pi', }
-        #logger.info('Websocket connection reset: %s', "tilt server %s port %d path %s" % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
-    d = {'clientip': local_ip_address, 'user': 'pi', }
-    #logger.info('Websocket connection ended: %s', "tilt server %s port %d path %s" % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
-
-#start_server = websockets.serve(tilt, '127.0.0.1', 5678)
-#start_server = websockets.serve(tilt, '192.168.1.73', 5678)
-#start_server = websockets.serve(tilt, '10.21.48.122', 5678)
-#  start_server = websockets.serve(tilt, local_ip_address, server_port)
-#  asyncio.get_event_loop().run_until_complete(start_server)
-#  try:
-#      asyncio.get_event_loop().run_forever()
-#  except:
-#      d = {'clientip': local_ip_address, 'user': 'pi', }
-#      logger.info('Uncaught error: %s', "%s" % (sys.exc_info()[0]))
-  
- 
-
-@webRTC.subscribe
-def onMessage(msg):  # Called when messages received from browser
-    global running
-    print("Got message:", msg)
-    if not running:
-        print("starting tilt process")
-        running = True
-        webRTC.put_nowait({"data": "pong"})
-        print(asyncio.all_tasks())
-        asyncio.ensure_future(tilt())
-        #asyncio.get_event_loop().run_forever()
-    
-# Serve the RTCBot javascript library at /rtcbot.js
-@routes.get("/rtcbot.js")
-async def rtcbotjs(request):
-    return web.Response(content_type="application/javascript", text=getRTCBotJS())
-
-@routes.get("/geoconnectable.css")
-async def rtcbotjs(request):
-    return web.FileResponse('./web/geoconnectable.css')
-
-@routes.get("/geoconnectable.js")
-async def rtcbotjs(request):
-    #script = with open("./web/geoconnectable.js", "r") as f:
-    #    return f.read()
-    #return web.Response(content_type="application/javascript", text=script)
-    return web.FileResponse('./web/geoconnectable.js')
-
-@routes.get("/mask.png")
-async def rtcbotjs(request):
-    return web.FileResponse('./web/mask.png')
-
-@routes.get("/svg.js")
-async def rtcbotjs(request):
-    return web.FileResponse('./web/svg.js')
-
+parser.add_argument('--mounting', 
+                    default='',
+                    help='accelerometer mounting: roll,pitch,yaw in degrees (turned before the swaps and flips) or a 3x3 matrix of 9 numbers row by row, see Mounting.py calibrate')
+parser.add_argument('--vibrationGestures', action='store_true', 
+                    help='look for knocks, double knocks and shakes in the accelerometer stream and send them as gestures')
+parser.add_argument('--knockThreshold', 
+                    type=float, dest='knockThreshold',
+                    default=0.08,
+                    help='g of a knock over the resting table, lower is more sensitive')
+parser.add_argument('--shakeThreshold', 
+                    type=float, dest='shakeThreshold',
+                    default=0.06,
+                    help='g of 2-6Hz shaking that counts as a shake, lower is more sensitive')
+parser.add_argument('--resetGesture', 
+                    choices=['knock', 'double-knock', 'shake', 'none'], dest='resetGesture',
+                    default='shake',
+                    help='vibration gesture that sends the map back to where it starts (default: shake)')
+parser.add_argument('--legacyAccelerometer', action='store_true', 
+                    help='read tilt from an old Phidget21 accelerometer (pip install Phidgets==2.1.8 and libphidget21), which reports one axis at a time; --tiltFilter does not apply')
+parser.add_argument('--axisAssemblyTimeout', 
+                    type=float, dest='axisAssemblyTimeout',
+                    default=4,
+                    help='milliseconds to wait for the other axes of a --legacyAccelerometer sample')
+parser.add_argument('--fusionWindow', 
+                    type=float, dest='fusionWindow',
+                    default=20,
+                    help='milliseconds within which tilt and spin samples are sent as one combo frame (0 to disable)')
+parser.add_argument('--idleTimeout', 
+                    type=float, dest='idleTimeout',
+                    default=120,
+                    help='seconds without motion before the sensors drop to their idle data rate (0 to disable)')
+parser.add_argument('--idleTiltSampleRate', 
+                    type=float, dest='idleTiltSampleRate',
+                    default=10,
+                    help='accelerometer data rate while idle')
+parser.add_argument('--idleTiltThreshold', 
+                    type=float, dest='idleTiltThreshold',
+                    default=0.02,
+                    help='accelerometer change trigger while idle, also the deflection that wakes the table')
+parser.add_argument('--idleEncoderInterval', 
+                    type=int, dest='idleEncoderInterval',
+                    default=50,
+                    help='encoder data interval (in milliseconds) while idle')
+parser.add_argument('--stateFile', 
+                    default='/var/lib/tilty/state.json',
+                    help='snapshot of calibration and map position used for a warm restart (default: /var/lib/tilty/state.json)')
+parser.add_argument('--stateInterval', 
+                    type=float, dest='stateInterval',
+                    default=5,
+                    help='seconds between state snapshots')
+parser.add_argument('--relevel', action='store_true', 
+                    help='ignore the zeros saved in --stateFile and level from the first samples, for a table that has been moved (or POST /calibrate while it runs)')
+parser.add_argument('--analyticsDb', 
+                    default='/var/lib/tilty/analytics.db',
+                    help='where gesture, hotspot, dwell and pan counts are kept, empty for none; report with Analytics.py (default: /var/lib/tilty/analytics.db)')
+parser.add_argument('--analyticsBucket', 
+                    type=int, dest='analyticsBucket',
+                    default=60,
+                    help='seconds of use counted together in the analytics')
+parser.add_argument('--analyticsFlush', 
+                    type=float, dest='analyticsFlush',
+                    default=30,
+                    help='seconds between analytics writes to the database')
+parser.add_argument('--heatGridSize', 
+                    type=float, dest='heatGridSize',
+                    default=0.01,
+                    help='size in degrees of the cells pans are counted in')
+parser.add_argument('--noDevices', action='store_true', 
+                    help='serve without opening the sensors, e.g. to play a --scenario')
+parser.add_argument('--transport', 
+                    choices=['webrtc', 'ws', 'both'],
+                    default='both',
+                    help='display transports to serve (default: both)')
+parser.add_argument('--split', action='store_true', 
+                    help='read the sensors in a separate acquisition process that feeds this one over shared memory')
+parser.add_argument('--reliablePan', action='store_true', 
+                    help='send pan frames on the reliable ordered data channel instead of their own unordered, unretransmitted one')
+parser.add_argument('--connectionPool', 
+                    type=int, dest='connectionPool',
+                    default=2,
+                    help='WebRTC connections kept ready with their ICE candidates gathered (0 to create them on /connect)')
+parser.add_argument('--keyframeInterval', 
+                    type=float, dest='keyframeInterval',
+                    default=1.0,
+                    help='seconds between full state frames sent on the reliable channel (default: 1)')
+parser.add_argument('--idleReset', 
+                    type=float, dest='idleReset',
+                    default=600,
+                    help='seconds without a gesture moving the map before it goes back to its center and homeZoom (0 to disable, default: 600)')
+parser.add_argument('--deltaFrames', action='store_true', 
+                    help='send the relative pan/zoom frames instead of absolute state, displays then drift if a frame is lost')
+parser.add_argument('--testHarness', 
+                    type=float, dest='testHarnessRate',
+                    default=0,
+                    help='also send this many synthetic pan frames per second, for load testing (see loadGenerator.py)')
+parser.add_argument('--scenario', 
+                    help='play this scripted gesture timeline (see Scenario.py) through the output path, for soak and stress runs')
+parser.add_argument('--scenarioSpeed', 
+                    type=float, dest='scenarioSpeed',
+                    default=1.0,
+                    help='how many times faster than its timeline to play --scenario (default: 1)')
+parser.add_argument('--scenarioBatch', 
+                    type=int, dest='scenarioBatch',
+                    default=250,
+                    help='most test harness events sent per pass of the gesture loop; more wait for the next pass (default: 250)')
+parser.add_argument('--memoryInterval', 
+                    type=float, dest='memoryInterval',
+                    default=60,
+                    help='seconds between the RSS samples and object counts in /debug/memory (default: 60)')
+parser.add_argument('--tracemalloc', 
+                    type=int, dest='traceFrames',
+                    default=0,
+                    help='trace allocations with this many frames for /debug/memory\'s top allocators (default: 0, off)')
+parser.add_argument('--hotspots', 
+                    default='./web/hotspots.json',
+                    help='hotspot locations per zoom layer and the map constants shared with geoconnectable.js')
+parser.add_argument('--geojsonDir', 
+                    default='./web',
+                    help='directory the map\'s GeoJSON sources are served from (default: ./web)')
+parser.add_argument('--geojsonCacheDir', 
+                    default='/var/cache/tilty/geojson',
+                    help='where simplified GeoJSON is cached on disk (default: /var/cache/tilty/geojson)')
+
+
+def configFromArgs(args):
+    """ The config dict create_app and the sensor classes run from """
+    return {
+        'accelerometerQueueLength': args.accelerometerQueueLength,
+        'encoderQueueLength': args.encoderQueueLength,
+        'spinSmoothing': args.spinSmoothing,
+        'tiltSampleRate' : args.tiltSampleRate,
+        'tiltThreshold' : args.tiltThreshold,
+        'tiltFilter' : args.tiltFilter,
+        'tiltFilterTau' : args.tiltFilterTau,
+        'noiseK' : args.noiseK,
+        'noiseAlpha' : args.noiseAlpha,
+        'swapXY' : args.swapXY,
+        'flipX' : args.flipX,
+        'flipY' : args.flipY,
+        'flipZ' : args.flipZ,
+        'mounting' : args.mounting,
+        'vibrationGestures' : args.vibrationGestures,
+        'knockThreshold' : args.knockThreshold,
+        'shakeThreshold' : args.shakeThreshold,
+        'resetGesture' : args.resetGesture,
+        'legacyAccelerometer' : args.legacyAccelerometer,
+        'axisAssemblyTimeout' : args.axisAssemblyTimeout,
+        'fusionWindow' : args.fusionWindow,
+        'idleTimeout' : args.idleTimeout,
+        'idleTiltSampleRate' : args.idleTiltSampleRate,
+        'idleTiltThreshold' : args.idleTiltThreshold,
+        'idleEncoderInterval' : args.idleEncoderInterval,
+        'testHarnessRate' : args.testHarnessRate,
+        'localIpAddress' : '127.0.0.1',
+        'logfilename' : args.logfilename,
+        'stateFile' : args.stateFile,
+        'stateInterval' : args.stateInterval,
+        'relevel' : args.relevel,
+        'analyticsDb' : args.analyticsDb,
+        'analyticsBucket' : args.analyticsBucket,
+        'analyticsFlush' : args.analyticsFlush,
+        'heatGridSize' : args.heatGridSize,
+        'split' : args.split,
+        'reliablePan' : args.reliablePan,
+        'connectionPool' : args.connectionPool,
+        'keyframeInterval' : args.keyframeInterval,
+        'idleReset' : args.idleReset,
+        'deltaFrames' : args.deltaFrames,
+        'scenario' : args.scenario,
+        'scenarioSpeed' : args.scenarioSpeed,
+        'scenarioBatch' : args.scenarioBatch,
+        'memoryInterval' : args.memoryInterval,
+        'traceFrames' : args.traceFrames,
+        'hotspots' : args.hotspots,
+        'geojsonDir' : args.geojsonDir,
+        'geojsonCacheDir' : args.geojsonCacheDir,
+    }
 
 
-# This sets up the connection
-@routes.post("/connect")
-async def connect(request):
-    clientOffer = await request.json()
-    serverResponse = await webRTC.getLocalDescription(clientOffer)
-    return web.json_response(serverResponse)
+def defaultConfig(argv=()):
+    return configFromArgs(parser.parse_args(list(argv)))
 
 
-@routes.get("/")
-async def index(request):
-    return web.Response(
-        content_type="text/html",
-        text="""
+indexPage = """
     <html>
         <head>
             <title>GeoConnecTable</title> 
@@ -253,26 +286,32 @@ async def index(request):
         <body>
 
             <script>
-                var rtcConnection = new rtcbot.RTCConnection();
+                // ?transport=ws (optionally &format=binary) uses /ws instead of the data channel
+                var transport = new URLSearchParams(window.location.search).get("transport") || "webrtc";
+                // a server started without the webrtc transport does not serve rtcbot.js
+                var rtcConnection = (typeof rtcbot !== 'undefined') ? new rtcbot.RTCConnection() : undefined;
 
-                rtcConnection.subscribe(m => console.log("Received from python:", m));
+                if (rtcConnection) rtcConnection.subscribe(m => console.log("Received from python:", m));
 
                 async function connect() {
-                    let offer = await rtcConnection.getLocalDescription();
-
-                    // POST the information to /connect
-                    let response = await fetch("/connect", {
+                    // the server offers a connection it set up ahead of time
+                    let response = await fetch("/offer", { cache: "no-cache" });
+                    let offer = await response.json();
+                    await rtcConnection.setRemoteDescription({ sdp: offer.sdp, type: offer.type });
+                    let answer = await rtcConnection.getLocalDescription();
+
+                    // POST the answer to /connect
+                    await fetch("/connect", {
                         method: "POST",
                         cache: "no-cache",
-                        body: JSON.stringify(offer)
+                        body: JSON.stringify({ id: offer.id, sdp: answer.sdp, type: answer.type })
                     });
 
-                    await rtcConnection.setRemoteDescription(await response.json());
                     rtcConnection.put_nowait("Display connected!");
 
                     console.log("Ready!");
                 }
-                connect();
+                if (transport == "webrtc") connect();
 
 
                   
@@ -328,100 +367,539 @@ async def index(request):
     </div> 
  
     <div class="instructions" id="site1">
-      <img src="cedulas/Tilty 1.png" id="site1_img">
+      <img data-src="cedulas/Tilty 1.png" id="site1_img">
     </div>
     <div class="overview" id="site2">
-      <img src="cedulas/Tilty 2.png" id="site2_img">
+      <img data-src="cedulas/Tilty 2.png" id="site2_img">
     </div>
     <div class="overview" id="site3">
-      <img src="cedulas/Tilty 3.png" id="site3_img">
+      <img data-src="cedulas/Tilty 3.png" id="site3_img">
     </div> 
 
     <div class="overview" id="site4">
-      <img src="cedulas/Tilty 4.png" id="site4_img">
+      <img data-src="cedulas/Tilty 4.png" id="site4_img">
     </div>  
 
     <div class="state" id="site5">
-      <img src="cedulas/Tilty 5.png" id="site5_img">
+      <img data-src="cedulas/Tilty 5.png" id="site5_img">
       <div class="site_name">Sinaloa</div>
     </div>  
 
 
     <div class="state" id="site6">
-      <img src="cedulas/Tilty 6.png" id="site6_img">
+      <img data-src="cedulas/Tilty 6.png" id="site6_img">
       <div class="site_name">Ciudad de México</div>
     </div>  
 
     <div class="state"  id="site7">
-      <img src="cedulas/Tilty 7.png" id="site7_img">
+      <img data-src="cedulas/Tilty 7.png" id="site7_img">
       <div class="site_name">Veracruz de Ignacio de la Llave</div>
     </div>  
 
     <div class="state"  id="site8">
-      <img src="cedulas/Tilty 8.png" id="site8_img">
+      <img data-src="cedulas/Tilty 8.png" id="site8_img">
       <div class="site_name">Chihuahua</div>
     </div>  
 
     <div class="state"  id="site9">
-      <img src="cedulas/Tilty 9.png" id="site9_img">
+      <img data-src="cedulas/Tilty 9.png" id="site9_img">
       <div class="site_name">Guerrero</div>
     </div>  
 
     <div class="overview"  id="site10">
-      <img src="cedulas/Tilty 10.png" id="site10_img">
+      <img data-src="cedulas/Tilty 10.png" id="site10_img">
       
     </div>  
 
     <div class="county"  id="site11">
-      <img src="cedulas/Tilty 11.png" id="site11_img">
+      <img data-src="cedulas/Tilty 11.png" id="site11_img">
       <div class="site_name">Ahome</div>
     </div>  
 
     <div class="county"  id="site12">
-      <img src="cedulas/Tilty 12.png" id="site12_img">
+      <img data-src="cedulas/Tilty 12.png" id="site12_img">
       <div class="site_name">Mazatlán</div>
     </div>  
 
     <div class="county"  id="site13">
-      <img src="cedulas/Tilty 13.png" id="site13_img">
+      <img data-src="cedulas/Tilty 13.png" id="site13_img">
       <div class="site_name">Culiacán</div>
     </div>  
 
     <div class="county"  id="site14">
-      <img src="cedulas/Tilty 14.png" id="site14_img">
+      <img data-src="cedulas/Tilty 14.png" id="site14_img">
       <div class="site_name">Badiguarato</div>
     </div>  
 
     <div class="county"  id="site15">incue
-      <img src="cedulas/Tilty 15.png" id="site15_img">
+      <img data-src="cedulas/Tilty 15.png" id="site15_img">
       <div class="site_name">Salvador Alvarado (Guamúchil)</div>
     </div>  
     </div>  
 
     <div class="overview"  id="site16">
-      <img src="cedulas/Tilty 16.png" id="site16_img">
+      <img data-src="cedulas/Tilty 16.png" id="site16_img">
     </div>  
 
 
     <div class="city" id="site17">
-      <img src="cedulas/Tilty 17.png" id="site17_img">
+      <img data-src="cedulas/Tilty 17.png" id="site17_img">
       <div class="site_name">La Central (Los Mochis)</div>
     </div>  
    
 <ul id="messages"></ul>  
         </body>
     </html>
-    """)
-
-
-async def cleanup(app=None):
-    print("closing connection")
-    await conn.close()
-
+    """
+
+
+def create_app(config, devices=True, transport=('webrtc', 'ws')):
+    """ The table's web application, built from config (see configFromArgs).
+
+    devices=False serves without the sensors, e.g. with a --scenario driving the output;
+    transport names the display transports to serve, rtcbot is only imported for 'webrtc'.
+    Nothing runs until the application starts.
+    """
+    from aiohttp import web
+    routes = web.RouteTableDef()
+    logger = logging.getLogger('sensorserver')
+    local_ip_address = config['localIpAddress']
+    webrtc = 'webrtc' in transport
+    if webrtc:
+        from rtcbot import RTCConnection, getRTCBotJS
+        from ConnectionPool import ConnectionPool
+
+    # come back from a restart already leveled and where the visitor left the map
+    snapshot = StateSnapshot(config['stateFile'], config['stateInterval'])
+    savedState = snapshot.load()
+    # saved zeros only hold for the mounting they were leveled with
+    mounting = { 'matrix': mountingMatrix(config) }
+    calibration = {}
+    if config['relevel']:
+        d = {'clientip': local_ip_address, 'user': 'pi' }
+        logger.info('releveling: %s', "saved zeros in %s ignored" % config['stateFile'], extra=d)
+    elif savedState.get('calibration', {}).get('mounting') == mounting:
+        calibration = savedState['calibration']
+
+    if not devices:
+        gestures = IdleGestureSource()
+    elif config['split']:
+        # the sensors get a process (and a GIL) of their own
+        gestures = AcquisitionClient(config, calibration, config['logfilename'] + '.acquisition')
+    else:
+        from SpinData import SpinData
+        from TiltData import TiltData
+        #Create an encoder object
+        try:
+            spindata = SpinData(config=config)
+        except RuntimeError as e:
+
+            d = {'clientip': local_ip_address, 'user': 'pi'}
+            logger.error('Spin server starting error: %s', "Runtime spinner Exception: %s" % e.details, extra=d)
+            # exit(1)
+
+        #Create an accelerometer object
+        try:
+            tiltdata = TiltData(config=config)
+
+        except RuntimeError as e:
+            print()
+            print("Exiting....")
+            d = {'clientip': local_ip_address, 'user': 'pi'}
+
+            logger.error('Tilt server starting error: %s', "Runtime Exception: %s" % e.details, extra=d)
+            exit(1)
+        tiltdata.restoreCalibration(calibration)
+        gestures = makeGestureSource(config, tiltdata, spindata)
+    testgp = None
+    if config['scenario']:
+        testgp = TestHarnessGestureProcessor(None, config, loadScenario(config['scenario']), config['scenarioSpeed'])
+    elif config['testHarnessRate'] > 0:
+        testgp = SyntheticGestureProcessor(None, config)
+
+    # the server tracks where the map is looking so the browser only hears about hotspot enter/exit
+    hotspotConfig = loadHotspotConfig(config['hotspots'])
+    viewport = Viewport(hotspotConfig['map'])
+    hotspotIndex = HotspotIndex(hotspotConfig)
+
+    if 'viewport' in savedState:
+        viewport.setCenter(savedState['viewport']['lat'], savedState['viewport']['lng'])
+        viewport.spinPosition = savedState['viewport']['spinPosition']
+
+    def snapshotState():
+        lat, lng = viewport.center()
+        calibration = dict(gestures.getCalibration())
+        calibration['mounting'] = mounting
+        return { 'calibration': calibration,
+                 'viewport': { 'lat': lat, 'lng': lng, 'spinPosition': viewport.spinPosition } }
+
+    def stateMessage(key=False):
+        # where the map is, absolutely; key frames also go to new displays and every --keyframeInterval
+        lat, lng = viewport.center()
+        return { 'gesture': 'state', 'key': key, 'version': viewport.version, 'ts': time.time(),
+                 'vector': { 'position': viewport.spinPosition, 'lat': lat, 'lng': lng } }
+
+    geojsonCache = GeoJsonCache(config['geojsonDir'], config['geojsonCacheDir'])
+
+    # Every display gets a connection of its own, usually from the pool so it does not wait
+    # for ICE gathering, and is dropped when its connection closes
+    running = False
+    pool = None
+    if webrtc:
+        print("setting up RTC")
+        pool = ConnectionPool(config['connectionPool'])
+    loopMonitor = LoopMonitor()
+    memoryMonitor = MemoryMonitor(pipelineClasses, config['memoryInterval'], traceFrames=config['traceFrames'])
+    analytics = None
+    if config['analyticsDb']:
+        analytics = Analytics(config['analyticsDb'], config['analyticsBucket'], config['analyticsFlush'],
+                              config['heatGridSize'], config['idleTimeout'])
+
+    # gestures go to every display's data channels and to every display on /ws
+    displays = Displays()
+
+    def adoptConnection(conn, started):
+        # pan frames get a lossy lane of their own, everything else stays reliable and ordered
+        lanes = DataChannelLanes(conn, started, panLane=not config['reliablePan'])
+        conn.subscribe(lambda msg: onMessage(msg, lanes))
+
+        @conn.onReady
+        def readyCallback():
+            if conn.ready:
+                print("RTC Ready!")
+                lanes.open()
+
+        @conn.onClose
+        def closeCallback():
+            displays.removeConnection(lanes)
+        displays.addConnection(lanes)
+    
+    def sendGesture(outbound_message, source):
+        d = {'clientip': local_ip_address, 'user': 'pi' }
+        logger.debug('sending %s data: %s', source, "nextAction=%s" % outbound_message, extra=d)
+        if source == 'vibration':
+            # staff gestures: the displays decide what they mean, except the reset
+            logger.info('vibration gesture: %s', outbound_message, extra=d)
+            if analytics:
+                analytics.noteGesture(outbound_message['gesture'])
+            if outbound_message['gesture'] == config['resetGesture']:
+                viewport.reset()
+                displays.put_nowait(stateMessage(key=True))
+            displays.put_nowait(dict(outbound_message, ts=time.time()))
+            return
+        moved = viewport.applyGesture(outbound_message)
+        if analytics:
+            if moved:
+                analytics.noteGesture(outbound_message.get('gesture'), *viewport.center())
+            else:
+                analytics.noteGesture(outbound_message.get('gesture'))
+        if not config['deltaFrames']:
+            # displays set themselves to the state, so any of these frames can be dropped or repeated
+            if not moved:
+                return
+            outbound_message = stateMessage()
+        outbound_message['ts'] = time.time()
+        if outbound_message.get('gesture') == 'pan':
+            # lets a display that lost pan frames catch up with where the server thinks the map is
+            lat, lng = viewport.center()
+            outbound_message['center'] = {'lat': lat, 'lng': lng}
+        try:
+            #await websocket.send(outbound_message)
+            displays.put_nowait(outbound_message)
+        except Exception: #websockets.exceptions.ConnectionClosed:
+            logger.debug('sending %s data: %s', source, "client went away=%s" % outbound_message, extra=d)
+            raise
+
+    async def tilt():
+        nonlocal running
+        d = {'clientip': local_ip_address, 'user': 'pi', }
+        #logger.info('webrtc connection made: %s', "tilt server %s port %d " % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
+        print("starting phidgets on webrtc")
+        gestures.start()
+        lastKeyframe = 0.0
+        try:
+            while True:
+                now = datetime.datetime.utcnow().isoformat() + 'Z'
+                if testgp:
+                    # a fast scenario can have many events due in one pass; they are due as of
+                    # one clock reading and capped, so the pass ends even if sending falls behind
+                    passTime = testgp.clock.time()
+                    for i in range(config['scenarioBatch']):
+                        if not testgp.run(passTime):
+                            break
+                        sendGesture(testgp.nextAction(), 'test')
+                for outbound_message, source in gestures.poll():
+                    sendGesture(outbound_message, source)
+                for outbound_message in hotspotIndex.update(viewport):
+                    d = {'clientip': local_ip_address, 'user': 'pi' }
+                    logger.debug('sending hotspot event: %s', "%s at %s zoom %f" % (outbound_message, viewport.center(), viewport.zoom()), extra=d)
+                    displays.put_nowait(outbound_message)
+                    if analytics:
+                        analytics.noteHotspot(outbound_message['event'], outbound_message['site'])
+                if analytics:
+                    analytics.tick(viewport.zoom())
+                if config['idleReset'] > 0 and viewport.idleFor(time.time()) >= config['idleReset']:
+                    # done here rather than in the displays, whose key frames would undo it
+                    logger.info('idle reset: %s', "no movement for %.0fs" % config['idleReset'], extra=d)
+                    viewport.reset()
+                    displays.put_nowait(stateMessage(key=True))
+                if time.time() - lastKeyframe >= config['keyframeInterval']:
+                    lastKeyframe = time.time()
+                    displays.put_nowait(stateMessage(key=True))
+                if snapshot.due():
+                    # the fsync stays off the loop, as the geojson reads do
+                    asyncio.get_event_loop().run_in_executor(None, snapshot.trySave, snapshotState())
+                #await websocket.send(json.dumps(now))
+                await asyncio.sleep(0.008)
+        except  Exception: #websockets.exceptions.ConnectionResetError:
+            d = {'clientip': local_ip_address, 'user': 'pi', }
+            #logger.info('Websocket connection reset: %s', "tilt server %s port %d path %s" % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
+            logger.exception('tilt loop stopped: %s', "restarts with the next display message", extra=d)
+        finally:
+            # lets startTilt bring delivery back rather than leaving it dead
+            running = False
+        d = {'clientip': local_ip_address, 'user': 'pi', }
+        #logger.info('Websocket connection ended: %s', "tilt server %s port %d path %s" % (websocket.remote_address[0], websocket.remote_address[1], path), extra=d)
+
+    #start_server = websockets.serve(tilt, '127.0.0.1', 5678)
+    #start_server = websockets.serve(tilt, '192.168.1.73', 5678)
+    #start_server = websockets.serve(tilt, '10.21.48.122', 5678)
+    #  start_server = websockets.serve(tilt, local_ip_address, server_port)
+    #  asyncio.get_event_loop().run_until_complete(start_server)
+    #  try:
+    #      asyncio.get_event_loop().run_forever()
+    #  except:
+    #      d = {'clientip': local_ip_address, 'user': 'pi', }
+    #      logger.info('Uncaught error: %s', "%s" % (sys.exc_info()[0]))
+  
+ 
 
-app = web.Application()
-app.add_routes(routes)
-app.add_routes([web.static('/cedulas', './web/cedulas')])
-app.add_routes([web.static('/postcards', './web/postcards')])
-app.on_shutdown.append(cleanup)
-web.run_app(app)
+    def startTilt(display):
+        nonlocal running
+        if not running:
+            print("starting tilt process")
+            running = True
+            display.put_nowait({"data": "pong"})
+            print(asyncio.all_tasks())
+            asyncio.ensure_future(tilt())
+            #asyncio.get_event_loop().run_forever()
+
+    def onMessage(msg, lanes):  # Called when messages received from browser
+        if isinstance(msg, dict) and 'lanes' in msg:
+            lanes.noteReport(msg)
+            return
+        # clock sync and telemetry answer straight back, past the lanes' sequence numbers
+        if isinstance(msg, dict) and lanes.telemetry.handle(msg, lanes.webRTC.put_nowait):
+            return
+        print("Got message:", msg)
+        if isinstance(msg, str):
+            # a display (re)connected, bring it to where the table is
+            lanes.webRTC.put_nowait(stateMessage(key=True))
+        startTilt(lanes.webRTC)
+    
+    # Serve the RTCBot javascript library at /rtcbot.js
+    @routes.get("/rtcbot.js")
+    async def rtcbotjs(request):
+        return web.Response(content_type="application/javascript", text=getRTCBotJS())
+
+    @routes.get("/geoconnectable.css")
+    async def rtcbotjs(request):
+        return web.FileResponse('./web/geoconnectable.css')
+
+    @routes.get("/geoconnectable.js")
+    async def rtcbotjs(request):
+        #script = with open("./web/geoconnectable.js", "r") as f:
+        #    return f.read()
+        #return web.Response(content_type="application/javascript", text=script)
+        return web.FileResponse('./web/geoconnectable.js')
+
+    @routes.get("/mask.png")
+    async def rtcbotjs(request):
+        return web.FileResponse('./web/mask.png')
+
+    @routes.get("/svg.js")
+    async def rtcbotjs(request):
+        return web.FileResponse('./web/svg.js')
+
+    # the page preloads cedulas from the same per layer site lists the server detects hotspots with
+    @routes.get("/hotspots.json")
+    async def hotspotsjson(request):
+        return web.FileResponse(config['hotspots'])
+
+
+
+    # GeoJSON sources simplified for the requested zoom, gzipped once and cached
+    @routes.get(r"/geojson/{zoom:\d+}/{path:.+}")
+    async def geojson(request):
+        zoom = min(int(request.match_info['zoom']), 22)
+        try:
+            body = await asyncio.get_event_loop().run_in_executor(None, geojsonCache.get, zoom, request.match_info['path'])
+        except (ValueError, FileNotFoundError):
+            raise web.HTTPNotFound()
+        headers = {'Cache-Control': 'max-age=86400'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            body = gzip.decompress(body)
+        return web.Response(body=body, content_type='application/geo+json', headers=headers)
+
+
+    @routes.get("/metrics")
+    async def metrics(request):
+        report = gestures.getMetrics()
+        report['displays'] = displays.getMetrics()
+        if pool:
+            report['pool'] = pool.getMetrics()
+        report['server'] = loopMonitor.getMetrics()
+        if analytics:
+            report['analytics'] = analytics.getMetrics()
+        return web.json_response(report)
+
+
+    @routes.post("/calibrate")
+    async def calibrate(request):
+        # the table is level now: take new zeros from the next samples
+        gestures.recalibrate()
+        return web.json_response({ 'releveling': True })
+
+    # counts are from the last --memoryInterval sample; ?scan=1 walks the heap now and
+    # ?allocators=1 adds tracemalloc's top lines, both stall the loop while they run
+    @routes.get("/debug/memory")
+    async def debugMemory(request):
+        return web.json_response(memoryMonitor.getMetrics(scan=request.query.get('scan') == '1',
+                                                          allocators=request.query.get('allocators') == '1'))
+
+
+    # A pooled connection's offer, answered by the display through /connect
+    @routes.get("/offer")
+    async def offer(request):
+        id, serverOffer = await pool.take()
+        return web.json_response(dict(serverOffer, id=id))
+
+
+    # This sets up the connection
+    @routes.post("/connect")
+    async def connect(request):
+        description = await request.json()
+        if description.get('type') == 'answer':
+            try:
+                conn, started = pool.claim(description['id'])
+            except KeyError:
+                raise web.HTTPGone()
+            await conn.setRemoteDescription({ 'sdp': description['sdp'], 'type': 'answer' })
+            serverResponse = {}
+        else:
+            # the display made the offer, set a connection up from scratch
+            started = time.time()
+            conn = RTCConnection()
+            serverResponse = await conn.getLocalDescription(description)
+        adoptConnection(conn, started)
+        return web.json_response(serverResponse)
+
+
+    # The same gesture stream over a plain WebSocket, no ICE/DTLS/SCTP on the kiosk LAN.
+    # ?format=binary sends pan/zoom/combo as packed floats (see Transports.encodeFrames)
+    @routes.get("/ws")
+    async def websocket(request):
+        ws = web.WebSocketResponse(compress=False, heartbeat=10)
+        await ws.prepare(request)
+        client = WebSocketClient(ws, binary=request.query.get('format') == 'binary', name='ws ' + str(request.remote))
+        d = {'clientip': request.remote, 'user': 'ws'}
+        logger.info('websocket display connected: %s', "binary=%s" % client.binary, extra=d)
+        displays.add(client)
+        writer = asyncio.ensure_future(client.run())
+        try:
+            async for msg in ws:
+                if msg.type == web.WSMsgType.TEXT:
+                    if msg.data.startswith('{'):
+                        try:
+                            report = JSON.loads(msg.data)
+                        except ValueError:
+                            report = None
+                        if isinstance(report, dict) and client.telemetry.handle(report, client.put_nowait):
+                            continue
+                    print("Got message:", msg.data)
+                    # a display (re)connected, bring it to where the table is
+                    client.put_nowait(stateMessage(key=True))
+                    startTilt(client)
+        finally:
+            displays.remove(client)
+            writer.cancel()
+            logger.info('websocket display disconnected: %s', "sent %d dropped %d" % (client.sent, client.dropped), extra=d)
+        return ws
+
+
+    @routes.get("/")
+    async def index(request):
+        return web.Response(content_type="text/html", text=indexPage)
+
+
+    async def startPool(app=None):
+        if pool:
+            pool.start()
+        loopMonitor.start()
+        memoryMonitor.start()
+        if analytics:
+            analytics.start()
+
+
+    async def cleanup(app=None):
+        print("closing connection")
+        snapshot.save(snapshotState())
+        if analytics:
+            # the last few seconds of counts go in before the process does
+            await asyncio.get_event_loop().run_in_executor(None, analytics.stop)
+        if pool:
+            await pool.close()
+        for lanes in list(displays.connections):
+            await lanes.webRTC.close()
+        if devices and config['split']:
+            gestures.close()
+
+    # routes for the transports that are not being served are left out
+    skipped = set()
+    if not webrtc:
+        skipped |= { '/rtcbot.js', '/offer', '/connect' }
+    if 'ws' not in transport:
+        skipped.add('/ws')
+    app = web.Application()
+    app.add_routes([ route for route in routes if route.path not in skipped ])
+    for name in ('cedulas', 'postcards'):
+        # postcards are installed on the table, not kept in the repository
+        if os.path.isdir('./web/' + name):
+            app.add_routes([web.static('/' + name, './web/' + name)])
+    app.on_startup.append(startPool)
+    app.on_shutdown.append(cleanup)
+    return app
+
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    numeric_level = getattr(logging, args.loglevel[0].upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.loglevel[0].upper())
+    copyfile(args.logfilename, args.logfilename + '.previous')
+    #FORMAT = '%(asctime)-15s %(clientip)s %(user)-8s %(message)s'
+    FORMAT = '%(asctime)-15s  %(message)s'
+    logging.basicConfig(format=FORMAT, level=numeric_level, filename=args.logfilename, filemode='w', )
+    logger = logging.getLogger('sensorserver')
+    websocket_logger = logging.getLogger('websockets.server')
+    websocket_logger.setLevel(logging.DEBUG)
+    websocket_logger.addHandler(logging.StreamHandler)
+
+    config = configFromArgs(args)
+    if not args.localhost:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(('8.8.8.8', 1))  # connect() for UDP doesn't send packets
+        config['localIpAddress'] = s.getsockname()[0]
+    d = {'clientip': config['localIpAddress'], 'user': 'pi'}
+    logger.warning('Server starting: %s', 'defaults loaded %s %s' %(config['localIpAddress'],args), extra=d)
+
+    from aiohttp import web
+    transport = ('webrtc', 'ws') if args.transport == 'both' else (args.transport,)
+    web.run_app(create_app(config, devices=not args.noDevices, transport=transport), port=args.local_port_num)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+""" Pushes recorded or synthetic sensor input through the gesture logic on a virtual clock.
+
+TiltData, SpinData, the gesture processors, the adaptive sampler and gesture fusion all
+run exactly as on the table, but time only moves as the input says, so hours of use go
+through in seconds and the same input always gives the same gestures.
+
+Input is JSON lines, one sensor event each, as raw device readings:
+
+    {"t": 12.500, "tilt": [0.012, -0.003, 0.998]}     accelerometer sample, g
+    {"t": 12.500, "tilt": [...], "gyro": [1.5, -0.2, 0.0]}   Spatial sample, g and degrees/s
+    {"t": 12.504, "spin": -2, "dt": 8}                 encoder change, ticks and ms
+
+    python simulate.py --input visit.jsonl --out gestures.jsonl
+    python simulate.py --synthetic 4 --seed 7 --config '{"noiseK": 3}'
+
+--out writes every gesture with its virtual time, for diffing two runs.
+
+--soak fails (exit status 1) if traced Python memory grows by more than that many MB
+between the end of the first simulated hour and the end of the run:
+
+    python simulate.py --synthetic 8 --soak 1
+"""
+import argparse
+import json as JSON
+import logging
+import math
+import random
+import sys
+import time
+import tracemalloc
+from Clock import VirtualClock
+from TiltData import TiltData
+from SpinData import SpinData
+from Acquisition import makeGestureSource
+from MemoryMonitor import residentBytes
+from rtcbotserver import defaultConfig
+
+
+def readRecording(filename):
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield JSON.loads(line)
+
+
+def syntheticInput(hours, seed, sampleRate):
+    """ Visitors coming and going: idle stretches, then tilting and spinning for a while """
+    rng = random.Random(seed)
+    interval = 1.0 / sampleRate
+    end = hours * 3600.0
+    t = 0.0
+    target = (0.0, 0.0)
+    visiting = False
+    until = rng.expovariate(1 / 30.0)
+    nextMove = 0.0
+    spinUntil = 0.0
+    spinDirection = 1
+    while t < end:
+        if t >= until:
+            visiting = not visiting
+            until = t + (rng.uniform(30, 180) if visiting else rng.expovariate(1 / 60.0))
+            target = (0.0, 0.0)
+        if visiting and t >= nextMove:
+            nextMove = t + rng.uniform(0.5, 4.0)
+            target = (rng.uniform(-0.2, 0.2), rng.uniform(-0.2, 0.2)) if rng.random() < 0.7 else (0.0, 0.0)
+            if rng.random() < 0.4:
+                spinUntil = t + rng.uniform(0.3, 2.0)
+                spinDirection = rng.choice((-1, 1))
+        x = target[0] + rng.gauss(0.0, 0.001)
+        y = target[1] + rng.gauss(0.0, 0.001)
+        z = math.sqrt(max(0.0, 1.0 - target[0] ** 2 - target[1] ** 2)) + rng.gauss(0.0, 0.001)
+        yield { 't': t, 'tilt': [x, y, z] }
+        if t < spinUntil:
+            yield { 't': t + interval / 2, 'spin': spinDirection * rng.randint(1, 3), 'dt': interval * 1000.0 }
+        t += interval
+
+
+def simulate(events, config, interval, out=None, checkpoint=None, every=3600.0):
+    clock = VirtualClock()
+    tiltdata = TiltData(config=config, clock=clock, openDevice=False)
+    spindata = SpinData(config=config, clock=clock, openDevice=False)
+    source = makeGestureSource(config, tiltdata, spindata, devices=False)
+    source.start()
+    counts = {}
+    totals = { 'x': 0.0, 'y': 0.0, 'delta': 0.0 }
+    nextPoll = None
+    simulated = 0.0
+    nextCheckpoint = every
+
+    def poll():
+        for outbound_message, origin in source.poll():
+            gesture = outbound_message['gesture']
+            counts[gesture] = counts.get(gesture, 0) + 1
+            for key in totals:
+                totals[key] += outbound_message['vector'].get(key, 0.0)
+            if out:
+                out.write(JSON.dumps({ 't': round(clock.time(), 6), 'source': origin, 'message': outbound_message }) + '\n')
+
+    for event in events:
+        if nextPoll is None:
+            nextPoll = event['t']
+        # the server loop runs every interval whether or not anything arrived
+        while nextPoll <= event['t']:
+            clock.set(nextPoll)
+            poll()
+            nextPoll += interval
+        clock.set(event['t'])
+        simulated = event['t']
+        if checkpoint and simulated >= nextCheckpoint:
+            checkpoint(simulated)
+            nextCheckpoint += every
+        if 'gyro' in event:
+            tiltdata.ingestSpatialSample(event['tilt'], event['gyro'], event['t'] * 1000.0)
+        elif 'tilt' in event:
+            tiltdata.ingest_accelerometerData(event['tilt'], event['t'] * 1000.0)
+        elif 'spin' in event:
+            spindata.ingestSpinData(event['spin'], event.get('dt', 0.0))
+    if nextPoll is not None:
+        # let smoothing and fusion let go of what they are still holding
+        for i in range(int(1.0 / interval)):
+            clock.set(nextPoll)
+            poll()
+            nextPoll += interval
+    return { 'simulatedSeconds': simulated,
+             'gestures': counts,
+             'totals': totals,
+             'metrics': source.getMetrics() }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run recorded or synthetic sensor input through the gesture logic on a virtual clock.')
+    parser.add_argument('--input',
+                        help='recording to play, JSON lines of tilt and spin events')
+    parser.add_argument('--synthetic', type=float, default=1.0,
+                        help='hours of synthetic visitors to generate when there is no --input (default: 1)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed for the synthetic visitors (default: 1)')
+    parser.add_argument('--config', default='{}',
+                        help='server config settings to change, as JSON (default: the server\'s defaults)')
+    parser.add_argument('--interval', type=float, default=0.008,
+                        help='seconds between gesture processing passes, as in the server loop (default: 0.008)')
+    parser.add_argument('--out',
+                        help='write every gesture to this file as JSON lines')
+    parser.add_argument('--soak', type=float,
+                        help='fail if memory grows by more than this many MB after the first simulated hour')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)-15s  %(message)s', level=logging.WARNING)
+    # the server's own defaults, so a new option needs nothing here
+    config = dict(defaultConfig(), **JSON.loads(args.config))
+    if args.input:
+        events = readRecording(args.input)
+    else:
+        events = syntheticInput(args.synthetic, args.seed, config['tiltSampleRate'])
+    out = open(args.out, 'w') if args.out else None
+    memory = []
+
+    def checkpoint(simulated):
+        current, peak = tracemalloc.get_traced_memory()
+        memory.append({ 'hour': simulated / 3600.0, 'traced': current, 'rss': residentBytes() })
+        print("%6.1fh  traced %9d bytes  rss %9d bytes" % (simulated / 3600.0, current, memory[-1]['rss']), file=sys.stderr)
+
+    if args.soak is not None:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        report = simulate(events, config, args.interval, out, checkpoint if args.soak is not None else None)
+    finally:
+        if out:
+            out.close()
+    wall = time.perf_counter() - start
+    report['wallSeconds'] = wall
+    report['speedup'] = report['simulatedSeconds'] / wall if wall > 0 else float('inf')
+    if args.soak is not None:
+        checkpoint(report['simulatedSeconds'])
+        report['memory'] = memory
+        # the first hour fills the windows, caches and counters that are allowed to grow
+        growth = memory[-1]['traced'] - memory[0]['traced'] if len(memory) > 1 else 0
+        report['soak'] = { 'growth': growth, 'limit': args.soak * 1e6, 'passed': growth <= args.soak * 1e6 }
+    print(JSON.dumps(report, indent=2))
+    if args.soak is not None and not report['soak']['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,20 +8,17 @@ import datetime
 import os.path
 import asyncio
 import json as JSON
-from aiohttp import web
-from rtcbot import RTCConnection, getRTCBotJS
-from Phidget22.Devices.Accelerometer import Accelerometer
-from Phidget22.Devices.Encoder import Encoder
-from Phidget22.PhidgetException import PhidgetException
 from GestureProcessor import TiltGestureProcessor, SpinGestureProcessor
+from AxisAssembler import AxisAssembler
+from RunningStats import WindowedStats
+from SpinAccumulator import SpinAccumulator
 
 
 __author__ = 'Dale MacDonald'
 __version__ = '3.0.0'
 __date__ = 'September 21, 2024'
 
-
-routes = web.RouteTableDef()
+# aiohttp, rtcbot and Phidget22 are imported by create_app, importing this module opens nothing
 
 
 #from queue import Queue
@@ -32,6 +29,9 @@ config = {
     'encoderQueueLength':10,
     'tiltSampleRate' : 0.1,
     'tiltThreshold' : 0.002,
+    # the old ctypes Accelerometer (src/Accelerometer.py), which reports one axis per callback
+    'legacyAccelerometer' : False,
+    'axisAssemblyTimeout' : 4,
     'flipX' : 1,
     'flipY' : -1,
     'flipZ' : -1,
@@ -69,29 +69,31 @@ class Queue:
         return len(self.items)
 
 class SpinData:
-    def __init__(self, positionChange=0, elapsedtime=0.0, position=0):
+    def __init__(self, config, positionChange=0, elapsedtime=0.0, position=0):
+        self.config = config
         self.gestureProcessor = SpinGestureProcessor(self, config)
         self.position = position
         self.delta = positionChange
         self.timestamp = datetime.time()
         self.elapsedTime = elapsedtime
-        self.spinHistory = Queue(config['encoderQueueLength'])
+        self.spinAccumulator = SpinAccumulator()
 
     def ingestSpinData(self, positionChange, time):
         self.delta = positionChange
         self.elapsedTime = time
-        self.spinHistory.enqueue( positionChange * config['flipZ'])
+        self.spinAccumulator.add( positionChange * self.config['flipZ'])
 
 class TiltData:
 
-    def __init__(self):
+    def __init__(self, config):
+        self.config = config
         self.gestureProcessor = TiltGestureProcessor(self, config)
-        self.components = [ Queue(config['accelerometerQueueLength']), Queue(config['accelerometerQueueLength']), Queue(config['accelerometerQueueLength']) ]
-        self.variances =  [ Queue(config['accelerometerQueueLength']), Queue(config['accelerometerQueueLength']), Queue(config['accelerometerQueueLength']) ]
+        self.components = [ WindowedStats(config['accelerometerQueueLength']), WindowedStats(config['accelerometerQueueLength']), WindowedStats(config['accelerometerQueueLength']) ]
         self.magnitude = 0.0
         self.zeros = [ 0.0, 0.0, 0.0 ]
 
         self.serialNumber = ''
+        self.axisAssembler = AxisAssembler(self.ingestSpatialData, timeout=config['axisAssemblyTimeout'] / 1000.0)
 
     def setZeros(self,x0,y0,z0):
         self.zeros = [ x0, y0, z0 ]
@@ -99,25 +101,22 @@ class TiltData:
     def setAccelerometerZero(self, index, newZero):
         self.zeros[index] = newZero
 
-    def ingestSpatialData(self, sensorData):
-        if self.components[0].qsize() == 0:
+    def ingestSpatialData(self, sensorData, timestamp=None):
+        if self.components[0].size() == 0:
             self.setZeros(sensorData[0],sensorData[1],sensorData[2])
-        newX = config['flipX'] * (sensorData[0] - self.zeros[0])
-        newY = config['flipY'] * (sensorData[1] - self.zeros[1])
+        newX = self.config['flipX'] * (sensorData[0] - self.zeros[0])
+        newY = self.config['flipY'] * (sensorData[1] - self.zeros[1])
         newZ = sensorData[2] - self.zeros[2]
-        self.variances[0].enqueue(newX - self.components[0].head())
-        self.variances[1].enqueue(newY - self.components[1].head())
-        self.variances[2].enqueue(newZ - self.components[2].head())
-        self.components[0].enqueue(newX)
-        self.components[1].enqueue(newY)
-        self.components[2].enqueue(newZ) 
+        self.components[0].add(newX)
+        self.components[1].add(newY)
+        self.components[2].add(newZ) 
      
+    def tiltThreshold(self):
+        return self.config['tiltThreshold']
+
     def ingestAccelerometerData(self, index, sensorData):
-        if self.components[index].qsize() == 0:
-            self.setAccelerometerZero(index,sensorData)
-        newX = sensorData - self.zeros[index]
-        self.variances[index].enqueue(newX - self.components[index].head())
-        self.components[index].enqueue(newX)
+        """ Per-axis input from the legacy Accelerometer, assembled into whole samples for ingestSpatialData """
+        self.axisAssembler.ingestAxis(index, sensorData)
  
 
                       
@@ -152,168 +151,208 @@ spinVector = {
 spinHistory = Queue()
 
 
-#Create an encoder object
-try:
-    spinner = Encoder()
-    spindata = SpinData()
-except RuntimeError as e:
-    print("Runtime spinner Exception: %s" % e)
-    print("Exiting....")
-    # exit(1)
-
-#Create an accelerometer object
-try:
-#    spatial = Spatial()
-    accelerometer = Accelerometer()
-    tiltdata = TiltData()
-
-except RuntimeError as e:
-    print("Runtime Exception: %s" % e)
-    print("Exiting....")
-    exit(1)
-
-# Function to handle encoder position change events
-def onEncoderPositionChange(device, positionChange, timeChange, indexTriggered):
-    position = positionChange
-    print(f"Encoder Position: {position}")
-    action = { 'gesture': 'zoom',
-                    'vector': {
-                        'delta': positionChange
-                    },
-                    'id': 666 }
-    data = {
-        "encoder_position": position
-    }
-    conn.put_nowait(action)
+def create_app(config=config, devices=True, transport=('webrtc',)):
+    """ The table's web application; devices=False serves it without opening the Phidgets """
+    if tuple(transport) != ('webrtc',):
+        raise ValueError('this server only has the webrtc transport, see rtcbotserver.py')
+    from aiohttp import web
+    from rtcbot import RTCConnection, getRTCBotJS
+    from Phidget22.Devices.Accelerometer import Accelerometer
+    from Phidget22.Devices.Encoder import Encoder
+    from Phidget22.PhidgetException import PhidgetException
+    routes = web.RouteTableDef()
 
-# Attach the encoder position change event handler
-spinner.setOnPositionChangeHandler(onEncoderPositionChange)
-
-# Initialize the Phidget accelerometer
-tilter = Accelerometer()
-def SpatialAttached(e):
-    attached = e
-    tiltdata.serialNumber = attached.getDeviceSerialNumber()
+    #Create an encoder object
+    try:
+        spinner = Encoder() if devices else None
+        spindata = SpinData(config)
+    except RuntimeError as e:
+        print("Runtime spinner Exception: %s" % e)
+        print("Exiting....")
+        # exit(1)
+
+    #Create an accelerometer object
+    try:
+    #    spatial = Spatial()
+        tiltdata = TiltData(config)
+
+    except RuntimeError as e:
+        print("Runtime Exception: %s" % e)
+        print("Exiting....")
+        exit(1)
+
+    # Function to handle encoder position change events
+    def onEncoderPositionChange(device, positionChange, timeChange, indexTriggered):
+        position = positionChange
+        print(f"Encoder Position: {position}")
+        action = { 'gesture': 'zoom',
+                        'vector': {
+                            'delta': positionChange
+                        },
+                        'id': 666 }
+        data = {
+            "encoder_position": position
+        }
+        conn.put_nowait(action)
+
+    # Attach the encoder position change event handler
+    if spinner:
+        spinner.setOnPositionChangeHandler(onEncoderPositionChange)
+
+    # Initialize the Phidget accelerometer
+    legacy = devices and config['legacyAccelerometer']
+    if legacy:
+        from Accelerometer import Accelerometer as LegacyAccelerometer
+        tilter = LegacyAccelerometer()
+    else:
+        tilter = Accelerometer() if devices else None
+    def SpatialAttached(e):
+        attached = e
+        tiltdata.serialNumber = attached.getDeviceSerialNumber()
+
+        print("Spatial %i Attached!" % (attached.getDeviceSerialNumber()))
+
+    def SpatialDetached(e):
+        detached = e
+        print("Spatial %i Detached!" % (detached.getDeviceSerialNumber()))
+
+    def SpatialError(e):
+        try:
+            source = e
+            print("Spatial %i: Phidget Error %i: %s" % (source.getDeviceSerialNumber(), e.eCode, e.description))
+        except PhidgetException as e:
+            print("Phidget Exception %i: %s" % (e.code, e.details))
+    def SpatialData(device, acceleration, timestamp):
+        source = device
+        if tiltdata.serialNumber == source.getDeviceSerialNumber():
+            if tiltdata:
+                tiltdata.ingestSpatialData(acceleration)
+            # for index, spatialData in enumerate(e.spatialData):
+            #     print("=== Data Set: %i ===" % (index))
+            #     if len(spatialData.Acceleration) > 0:
+            #         print("Acceleration> x: %6f  y: %6f  z: %6f" % (spatialData.Acceleration[0], spatialData.Acceleration[1], spatialData.Acceleration[2]))
+            #     if len(spatialData.AngularRate) > 0:
+            #         print("Angular Rate> x: %6f  y: %6f  z: %6f" % (spatialData.AngularRate[0], spatialData.AngularRate[1], spatialData.AngularRate[2]))
+            #     if len(spatialData.MagneticField) > 0:
+            #         print("Magnetic Field> x: %6f  y: %6f  z: %6f" % (spatialData.MagneticField[0], spatialData.MagneticField[1], spatialData.MagneticField[2]))
+            #     print("Time Span> Seconds Elapsed: %i  microseconds since last packet: %i" % (spatialData.Timestamp.seconds, spatialData.Timestamp.microSeconds))
+        
+            # print("------------------------------------------")
+        else:
+            print("wrong device: expected-", tiltdata.serialNumber, "got-", source.getDeviceSerialNumber())
 
-    print("Spatial %i Attached!" % (attached.getDeviceSerialNumber()))
+    try:
+        #logging example, uncomment to generate a log file
+        #spatial.enableLogging(PhidgetLogLevel.PHIDGET_LOG_VERBOSE, "phidgetlog.log")
 
-def SpatialDetached(e):
-    detached = e
-    print("Spatial %i Detached!" % (detached.getDeviceSerialNumber()))
 
-def SpatialError(e):
-    try:
-        source = e
-        print("Spatial %i: Phidget Error %i: %s" % (source.getDeviceSerialNumber(), e.eCode, e.description))
+        if legacy:
+            tilter.setOnAxisChangeHandler(lambda device, index, value: tiltdata.ingestAccelerometerData(index, value))
+        elif tilter:
+            tilter.setOnAttachHandler(SpatialAttached)
+            tilter.setOnDetachHandler(SpatialDetached)
+            tilter.setOnErrorHandler(SpatialError)
+            tilter.setOnAccelerationChangeHandler(SpatialData)
     except PhidgetException as e:
         print("Phidget Exception %i: %s" % (e.code, e.details))
-def SpatialData(device, acceleration, timestamp):
-    source = device
-    if tiltdata.serialNumber == source.getDeviceSerialNumber():
-        if tiltdata:
-            tiltdata.ingestSpatialData(acceleration)
-        # for index, spatialData in enumerate(e.spatialData):
-        #     print("=== Data Set: %i ===" % (index))
-        #     if len(spatialData.Acceleration) > 0:
-        #         print("Acceleration> x: %6f  y: %6f  z: %6f" % (spatialData.Acceleration[0], spatialData.Acceleration[1], spatialData.Acceleration[2]))
-        #     if len(spatialData.AngularRate) > 0:
-        #         print("Angular Rate> x: %6f  y: %6f  z: %6f" % (spatialData.AngularRate[0], spatialData.AngularRate[1], spatialData.AngularRate[2]))
-        #     if len(spatialData.MagneticField) > 0:
-        #         print("Magnetic Field> x: %6f  y: %6f  z: %6f" % (spatialData.MagneticField[0], spatialData.MagneticField[1], spatialData.MagneticField[2]))
-        #     print("Time Span> Seconds Elapsed: %i  microseconds since last packet: %i" % (spatialData.Timestamp.seconds, spatialData.Timestamp.microSeconds))
+        print("Exiting....")
+        tilter = None
+
+
+    conn = RTCConnection()  # For this example, we use just one global connection
+
+    @conn.subscribe
+    def onMessage(msg):  # Called when messages received from browser
+        print("Got message:", msg["data"])
+        conn.put_nowait({"data": "pong"})
+
+    # Function to read accelerometer data and send it via WebRTC
+    async def send_accelerometer_data():
+        while True:
+            if legacy:
+                # an axis change the others never followed, e.g. the last x as the table comes
+                # to rest, is only sent on by a poll
+                tiltdata.axisAssembler.poll()
+                acceleration = [ component.head() for component in tiltdata.components ]
+            else:
+                acceleration = tilter.getAcceleration()
+            data = action = { 'gesture': 'pan',
+                      'vector': { 'x': acceleration[0], 'y': acceleration[1]}
+                            }
         
-        # print("------------------------------------------")
-    else:
-        print("wrong device: expected-", tiltdata.serialNumber, "got-", source.getDeviceSerialNumber())
-
-try:
-    #logging example, uncomment to generate a log file
-    #spatial.enableLogging(PhidgetLogLevel.PHIDGET_LOG_VERBOSE, "phidgetlog.log")
-
-
-    tilter.setOnAttachHandler(SpatialAttached)
-    tilter.setOnDetachHandler(SpatialDetached)
-    tilter.setOnErrorHandler(SpatialError)
-    tilter.setOnAccelerationChangeHandler(SpatialData)
-except PhidgetException as e:
-    print("Phidget Exception %i: %s" % (e.code, e.details))
-    print("Exiting....")
-    tilter = None
+            conn.put_nowait(data)
+            await asyncio.sleep(0.1)  # Adjust the frequency as needed
+
+    # Serve the RTCBot javascript library at /rtcbot.js
+    @routes.get("/rtcbot.js")
+    async def rtcbotjs(request):
+        return web.Response(content_type="application/javascript", text=getRTCBotJS())
+
+
+    # This sets up the connection
+    @routes.post("/connect")
+    async def connect(request):
+        clientOffer = await request.json()
+        serverResponse = await conn.getLocalDescription(clientOffer)
+        return web.json_response(serverResponse)
+
+
+    @routes.get("/")
+    async def index(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'index.html')
+        return web.FileResponse(file_path)
+    @routes.get("/SLP.css")
+    async def slpcss(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLP.css')
+        return web.FileResponse(file_path)
+    @routes.get("/SLP.js")
+    async def slpjs(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLP.js')
+        return web.FileResponse(file_path)
+    @routes.get("/SLPConfig.js")
+    async def slpconfig(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLPConfig.js')
+        return web.FileResponse(file_path)
+    @routes.get("/mask.png")
+    async def maskpng(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'mask.png')
+        return web.FileResponse(file_path)
+    @routes.get("/svg.js")
+    async def svgjs(request):
+        file_path = os.path.join(os.path.dirname(__file__), 'static', 'svg.js')
+        return web.FileResponse(file_path)
+    
 
+    async def cleanup(app=None):
+        await conn.close()
 
-conn = RTCConnection()  # For this example, we use just one global connection
 
-@conn.subscribe
-def onMessage(msg):  # Called when messages received from browser
-    print("Got message:", msg["data"])
-    conn.put_nowait({"data": "pong"})
+    async def start(app=None):
+        # Start the accelerometer data sending loop
+        if tilter:
+            asyncio.ensure_future(send_accelerometer_data())
 
-# Function to read accelerometer data and send it via WebRTC
-async def send_accelerometer_data():
-    while True:
-        acceleration = tilter.getAcceleration()
-        data = action = { 'gesture': 'pan',
-                  'vector': { 'x': acceleration[0], 'y': acceleration[1]}
-                        }
-        
-        conn.put_nowait(data)
-        await asyncio.sleep(0.1)  # Adjust the frequency as needed
-
-# Serve the RTCBot javascript library at /rtcbot.js
-@routes.get("/rtcbot.js")
-async def rtcbotjs(request):
-    return web.Response(content_type="application/javascript", text=getRTCBotJS())
-
-
-# This sets up the connection
-@routes.post("/connect")
-async def connect(request):
-    clientOffer = await request.json()
-    serverResponse = await conn.getLocalDescription(clientOffer)
-    return web.json_response(serverResponse)
-
-
-@routes.get("/")
-async def index(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'index.html')
-    return web.FileResponse(file_path)
-@routes.get("/SLP.css")
-async def slpcss(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLP.css')
-    return web.FileResponse(file_path)
-@routes.get("/SLP.js")
-async def slpjs(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLP.js')
-    return web.FileResponse(file_path)
-@routes.get("/SLPConfig.js")
-async def slpconfig(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'SLPConfig.js')
-    return web.FileResponse(file_path)
-@routes.get("/mask.png")
-async def maskpng(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'mask.png')
-    return web.FileResponse(file_path)
-@routes.get("/svg.js")
-async def svgjs(request):
-    file_path = os.path.join(os.path.dirname(__file__), 'static', 'svg.js')
-    return web.FileResponse(file_path)
-    
+    app = web.Application()
+    app.add_routes(routes)
+    if legacy:
+        tilter.openPhidget()
+        tilter.waitForAttach(5000)
+        tiltdata.serialNumber = tilter.getSerialNum()
+    elif tilter:
+        tilter.openWaitForAttachment(5000)
+        tiltdata.serialNumber = tilter.getDeviceSerialNumber()
+    if spinner:
+        spinner.openWaitForAttachment(5000)
+    app.on_startup.append(start)
+    app.on_shutdown.append(cleanup)
+    return app
 
-async def cleanup(app=None):
-    await conn.close()
 
-app = web.Application()
-app.add_routes(routes)
-# Start the accelerometer data sending loop
-tilter.openWaitForAttachment(5000)
-tiltdata.serialNumber = tilter.getDeviceSerialNumber()
+def main():
+    from aiohttp import web
+    # Run the app
+    web.run_app(create_app(config), port=8080)
 
-spinner.openWaitForAttachment(5000)
-# Create and set the event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-loop.create_task(send_accelerometer_data())
-app.on_shutdown.append(cleanup)
 
-# Run the app
-loop.run_until_complete(web._run_app(app, port=8080))
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -24,8 +24,9 @@ A value of true for a key indicates it is a hotspot with visual content.
     and the map will be panned to the corresponding 'hotspot' These divs are defined in 
     the html file and are of the form
     <div class="instructions" id="site1">
-      <img src="cedulas/Tilty 1.png" id="site1_img">
+      <img data-src="cedulas/Tilty 1.png" id="site1_img">
     </div>
+    The image itself is only fetched when its zoom layer is entered (see loadCedula)
  
 A value of false for a key indicates it is a region of interest that can be shown via a 
   shapefile in GeoJson format which will be turned on at that particular zoom level.
@@ -461,6 +462,7 @@ var LosMochisZoomLayers = {
   
 };
 
+/* keep in step with web/hotspots.json, which the server uses to detect hotspots */
 var hotspots = {
   "site1" : [19.4326077,-99.1332080],
   "site2" : [19.4326077,-99.1332080],
@@ -565,13 +567,18 @@ var zoomWindowMessageCount = 0;
 var sumZoomWindowTimes = 0;
 var lastZoomMessageTime = Date.now();
 var pannable = true;
+var pendingPanX = 0;
+var pendingPanY = 0;
 var zoomable = true;
 
 // General globals
 var ws;
 //var rtcConnection;
+// transport is set from ?transport= by the page, websocket frames are JSON or ?format=binary
+var websocketFormat = new URLSearchParams(window.location.search).get("format") || "json";
 try {
-  connectPi(); 
+  if (typeof transport !== 'undefined' && transport == "ws") connectWebSocket(websocketFormat);
+  else connectPi(); 
   //ws = new WebSocket("ws://127.0.0.1:5678/");
 } 
 catch(e)
@@ -654,9 +661,104 @@ function setInstructions(texta, textb)
 
   }
 
+  /* cedula images are fetched on demand. cedulas/manifest.json is written by 
+     src/buildCedulas.py and lists resized avif/webp variants for each site; without it
+     we fall back to the original png in the img's data-src */
+  var cedulaManifest = {};
+  var hotspotLayers = {};
+  var loadedCedulas = {};
+  var openCedulas = {};
+
+  function loadCedulaManifest()
+  {
+    fetch("cedulas/manifest.json", { cache: "no-cache" })
+      .then(function(response) { return response.ok ? response.json() : {}; })
+      .then(function(manifest) { cedulaManifest = manifest; })
+      .catch(function(e) { console.log("no cedula manifest, using original images: " + e); });
+  }
+
+  /* the sites on each integer zoom layer, from the hotspots.json the server detects hotspots with */
+  function loadHotspotLayers()
+  {
+    fetch("hotspots.json", { cache: "no-cache" })
+      .then(function(response) { return response.ok ? response.json() : { layers: {} }; })
+      .then(function(config) {
+        hotspotLayers = config.layers || {};
+        // the first doZoom may have come in before the layers did
+        if (lastZoom >= 0) loadCedulasForLayer(lastZoom, -1);
+      })
+      .catch(function(e) { console.log("no hotspot layers, cedulas load when opened: " + e); });
+  }
+
+  function cedulasForLayer(level)
+  {
+    var siteIds = hotspotLayers[Math.floor(level)] || [];
+    return siteIds.filter(function(siteId) { return document.getElementById(siteId + "_img"); });
+  }
+
+  function loadCedula(featureKey)
+  {
+    if (loadedCedulas[featureKey]) return;
+    var img = document.getElementById(featureKey + "_img");
+    if (!img) return;
+    var entry = cedulaManifest[featureKey];
+    if (entry)
+    {
+      // a <picture> lets the browser pick the first format it can decode
+      var picture = document.createElement('picture');
+      img.parentNode.insertBefore(picture, img);
+      for (var i = 0; i < entry.variants.length - 1; i++)
+      {
+        var source = document.createElement('source');
+        source.type = entry.variants[i].type;
+        source.srcset = entry.variants[i].src;
+        picture.appendChild(source);
+      }
+      picture.appendChild(img);
+      img.src = entry.variants[entry.variants.length - 1].src;
+    }
+    else
+    {
+      img.src = img.dataset.src;
+    }
+    loadedCedulas[featureKey] = true;
+  }
+
+  function evictCedula(featureKey)
+  {
+    if (!loadedCedulas[featureKey] || openCedulas[featureKey]) return;
+    var img = document.getElementById(featureKey + "_img");
+    var picture = img.parentNode;
+    if (picture.tagName == 'PICTURE')
+    {
+      picture.parentNode.insertBefore(img, picture);
+      picture.parentNode.removeChild(picture);
+    }
+    // dropping the src lets the browser release the decoded bitmap
+    img.removeAttribute('src');
+    delete loadedCedulas[featureKey];
+  }
+
+  function loadCedulasForLayer(newLevel, oldLevel)
+  {
+    var wanted = cedulasForLayer(newLevel);
+    if (oldLevel >= 0)
+    {
+      var previous = cedulasForLayer(oldLevel);
+      for (var i = 0; i < previous.length; i++)
+      {
+        if (wanted.indexOf(previous[i]) < 0) evictCedula(previous[i]);
+      }
+    }
+    for (var i = 0; i < wanted.length; i++) loadCedula(wanted[i]);
+  }
+
   function openCedula(featureKey)
   {
+    if (openCedulas[featureKey]) return;
     console.log("opening cedula " + featureKey);
+    loadCedula(featureKey);
+    openCedulas[featureKey] = true;
     document.getElementById(featureKey).style.display = "block";
 
     document.getElementById(featureKey + "_img").classList.add('open');
@@ -664,10 +766,13 @@ function setInstructions(texta, textb)
 
   function closeCedula(featureKey)
   {
+   if (!openCedulas[featureKey]) return;
    console.log("closing cedula " + featureKey);
+   delete openCedulas[featureKey];
    document.getElementById(featureKey).style.display = "none";
 
    document.getElementById(featureKey + "_img").classList.remove('open');
+   if (cedulasForLayer(currentZoom).indexOf(featureKey) < 0) evictCedula(featureKey);
  }
 
  function doZoom(newLevel)
@@ -684,6 +789,11 @@ function setInstructions(texta, textb)
     //map.setZoom(Math.min(maxZoom,Math.max(minZoom,newLayer)));
     if (zoomable) {
       zoomable = false;
+      if (Math.floor(newLevel) != Math.floor(lastZoom)) 
+      {
+        loadCedulasForLayer(newLevel, lastZoom);
+        loadFeatureDetail(newLevel);
+      }
       map.setZoom(newLevel);
         //lastZoom = map.getZoom();
       lastZoom = newLevel;
@@ -699,7 +809,9 @@ function startIdleTimer()
 {
   idleTimer = setTimeout(function(){
     //window.location.reload(1);
-    if (map && museum) {
+    // the server resets an idle map (--idleReset) and sends it as state; this is only for a
+    // display that has never heard from it, whose map would otherwise be snapped back
+    if (map && museum && stateVersion < 0) {
       map.panTo(museum)
       map.setZoom(8);
     }
@@ -732,6 +844,32 @@ function shapeloaded(newfeatures)
   }          
 }
 
+/* the server simplifies each GeoJSON source for the zoom it is asked for (see 
+   src/GeoJsonCache.py), so only the detail that can be seen is downloaded and parsed */
+function geojsonUrl(path, level)
+{
+  return "geojson/" + Math.floor(level) + "/" + path;
+}
+
+function loadFeatureDetail(level)
+{
+  for ( feature in features)
+  {
+    if (!features[feature]['geojson'] || features[feature]['detailZoom'] == Math.floor(level)) continue;
+    data1 = new google.maps.Data();
+
+    //console.log("loading " + feature);
+    data1.loadGeoJson(geojsonUrl(features[feature]['geojson'], level), null, shapeloaded);
+    if (features[feature]['mapdata'])
+    {
+      data1.setMap(features[feature]['mapdata'].getMap());
+      features[feature]['mapdata'].setMap(null);
+    }
+    features[feature]['mapdata'] = data1;
+    features[feature]['detailZoom'] = Math.floor(level);
+  }
+}
+
 function initializemap() {
   if (map == null) {
     var mapOptions = {
@@ -791,14 +929,7 @@ function initializemap() {
     //map.data.loadGeoJson('encuesta_intercensal_2015/shps/sin/sin_entidad.geojson');
     
 
-    for ( feature in features)
-    {
-      data1 = new google.maps.Data();
-
-      //console.log("loading " + feature);
-      data1.loadGeoJson(features[feature]['geojson'], null, shapeloaded);
-      features[feature]['mapdata'] = data1;
-    }
+    loadFeatureDetail(minZoom);
     
     map.data.addListener('mouseover', function(event) {
       map.data.revertStyle();
@@ -916,8 +1047,50 @@ function connectPi()
   
 }
 
+function connectWebSocket(format)
+{
+  let scheme = (window.location.protocol == "https:") ? "wss://" : "ws://";
+  ws = new WebSocket(scheme + window.location.host + "/ws?format=" + format);
+  ws.binaryType = "arraybuffer";
+  ws.onopen = function () {
+    console.log("Sensor server connected over websocket (" + format + ")");
+    // a restarted server counts versions from zero again, its key frame resyncs us
+    stateVersion = -1;
+    ws.send("Display connected!");
+  };
+  ws.onmessage = function (event) {
+    if (typeof event.data === "string") handleWebSocketMessage(event);
+    else {
+      let start = performance.now();
+      let jsonData = decodeBinaryFrame(event.data);
+      telemetry.decodeTime += performance.now() - start;
+      handleMessage(jsonData);
+    }
+  };
+  ws.onclose = function () {
+    // the kiosk has nobody to press reload
+    setTimeout(function () { connectWebSocket(format); }, 1000);
+  };
+}
+
+// binary frames from Transports.encodeFrames: a type byte, then little-endian float32s,
+// except state frames: key flag, uint32 version, then float64 position, lat and lng
+function decodeBinaryFrame(buffer)
+{
+  let view = new DataView(buffer);
+  switch (view.getUint8(0)) {
+    case 1: return { gesture: 'pan', vector: { x: view.getFloat32(1, true), y: view.getFloat32(5, true) } };
+    case 2: return { gesture: 'zoom', vector: { delta: view.getFloat32(1, true) } };
+    case 3: return { gesture: 'combo', vector: { x: view.getFloat32(1, true), y: view.getFloat32(5, true), delta: view.getFloat32(9, true) } };
+    case 4: return { gesture: 'state', key: view.getUint8(1) == 1, version: view.getUint32(2, true),
+                     vector: { position: view.getFloat64(6, true), lat: view.getFloat64(14, true), lng: view.getFloat64(22, true) } };
+  }
+  return {};
+}
+
 function disconnectWS()
 {
+  ws.onclose = null;
   ws.close();
 }
 
@@ -943,153 +1116,454 @@ var handleWebRTCMessage = function (message) {
   handleWebSocketMessage(payload);
 }
 
+function handlePan(vector)
+{
+  //var dampingZoom = map.getZoom()*minZoom/maxZoom;
+  if (vector.x == 0.0 && vector.y == 0.0) return;  
+  //console.log("sensor message: " + jsonData.type + "-" + vector.x + "," +vector.y);
+  showStat('accelerometer', vector.x.toPrecision(4) + "," + vector.y.toPrecision(4));
+  let now = Date.now();
+  let elapsedTime = now - lastTiltMessageTime;
+  lastTiltMessageTime = now;
+  sumTiltTimes += elapsedTime;
+  tiltMessageCount += 1;
+  if ( tiltWindowMessageCount > 100) {
+    tiltWindowMessageCount = 1;
+    sumTiltWindowTimes = 0;
+  }
+  sumTiltWindowTimes += elapsedTime;
+  tiltWindowMessageCount += 1;
+  showStat('tiltdatarate', "Tilt total " + round(sumTiltTimes/tiltMessageCount,2) +
+                " window " + round(sumTiltWindowTimes/tiltWindowMessageCount,2));
+  restartIdleTimer();
+                // if (zoomLayers[currentZoom]['pannable']) map.panBy(pixelsPerGravitron*vector.x, pixelsPerGravitron*vector.y);
+  // pans that arrive while the map is still moving are held rather than dropped so the
+  // view stays in step with the server's copy of it, and all of a frame's go in one panBy
+  pendingPanX += pixelsPerGravitron*vector.x;
+  pendingPanY += pixelsPerGravitron*vector.y;
+  requestFrame();
+                //paintTarget();
+}
+
+function handleZoom(vector)
+{
+  currentSpinPosition += vector.delta;
+  //console.log("current spin position", currentSpinPosition, minZoom + currentSpinPosition/clicksPerZoomLevel, Date.now());
+  //console.log("sensor message: " + jsonData.gesture + " " + vector.delta + "; currentSpinPosition=" +currentSpinPosition);
+  if (currentSpinPosition < 0) currentSpinPosition = 0;
+  var proposedZoom =  minZoom + currentSpinPosition/clicksPerZoomLevel; //Math.floor(currentSpinPosition/clicksPerZoomLevel);
+  showStat('rotation', "spin position " + currentSpinPosition + " new Zoom " + proposedZoom);
+  restartIdleTimer();
+  let now = Date.now();
+  let elapsedTime = now - lastZoomMessageTime ;
+  lastZoomMessageTime = now;
+  sumZoomTimes += elapsedTime;
+  zoomMessageCount += 1;
+  if ( zoomWindowMessageCount > 100) {
+    zoomWindowMessageCount = 1;
+    sumZoomWindowTimes = 0;
+  }
+  sumZoomWindowTimes += elapsedTime;
+  zoomWindowMessageCount += 1;
+  showStat('zoomdatarate', "Zoom: total " + (sumZoomTimes/zoomMessageCount).toPrecision(4) + " window " + (sumZoomWindowTimes/zoomWindowMessageCount).toPrecision(4));
+  
+  // only where the spin ended up by the next frame is zoomed to
+  if (proposedZoom != currentZoom) 
+  {
+    //doZoom(Math.min(Object.keys(zoomLayers).length - 1, Math.max(0,proposedZoom))); 
+    pendingZoom = proposedZoom;
+    requestFrame();
+  }
+  // hotspots under the target are found by the server, see the 'hotspot' gesture below
+}
+
+// the server sends where the map is rather than how far to move it: every state frame is
+// "set to", the newest version wins, and one that was lost or repeated changes nothing
+var stateVersion = -1;
+function handleState(jsonData)
+{
+  if (jsonData.version < stateVersion || (jsonData.version == stateVersion && ! jsonData.key)) return;
+  // a repeated key frame is not someone using the table
+  if (jsonData.version > stateVersion) restartIdleTimer();
+  stateVersion = jsonData.version;
+  let state = jsonData.vector;
+  if (state.position != currentSpinPosition) {
+    currentSpinPosition = state.position;
+    showStat('rotation', "spin position " + currentSpinPosition + " new Zoom " + (minZoom + currentSpinPosition/clicksPerZoomLevel));
+  }
+  // a zoom or pan the map was too busy for is retried by the next state, nothing is queued,
+  // and of the states that arrive within one frame only the newest is applied
+  pendingState = state;
+  requestFrame();
+}
+
+function panToward(lat, lng)
+{
+  let target = new google.maps.LatLng(lat, lng);
+  let projection = map.getProjection();
+  if (! projection) {
+    map.setCenter(target);
+    return;
+  }
+  let scale = Math.pow(2, map.getZoom());
+  let here = projection.fromLatLngToPoint(map.getCenter());
+  let there = projection.fromLatLngToPoint(target);
+  let dx = (there.x - here.x) * scale;
+  let dy = (there.y - here.y) * scale;
+  if (Math.abs(dx) < 0.5 && Math.abs(dy) < 0.5) return;
+  pendingPanX = 0;
+  pendingPanY = 0;
+  if (Math.abs(dx) > window.innerWidth || Math.abs(dy) > window.innerHeight) {
+    // too far to animate, e.g. the key frame a new display starts from
+    map.setCenter(target);
+  }
+  else if (pannable) {
+    pannable = false;
+    map.panBy(dx, dy);
+  }
+}
+
+// messages only say what should happen, the map is moved once per animation frame with
+// whatever piled up since the last one, however fast the messages come
+var pendingZoom = null;
+var pendingState = null;
+var pendingCenter = null;
+var frameRequested = false;
+function requestFrame()
+{
+  if (frameRequested) return;
+  frameRequested = true;
+  window.requestAnimationFrame(applyFrame);
+}
+
+function applyFrame(timestamp)
+{
+  let start = performance.now();
+  frameRequested = false;
+  if (pendingCenter) {
+    map.setCenter(pendingCenter);
+    pendingCenter = null;
+  }
+  if (pendingState) {
+    let state = pendingState;
+    pendingState = null;
+    doZoom(minZoom + state.position/clicksPerZoomLevel);
+    panToward(state.lat, state.lng);
+  }
+  if (pendingZoom !== null) {
+    doZoom(pendingZoom);
+    pendingZoom = null;
+  }
+  if (pendingPanX != 0 || pendingPanY != 0) {
+    if (pannable) {
+      pannable = false;
+      map.panBy(pendingPanX, pendingPanY);
+      pendingPanX = 0;
+      pendingPanY = 0;
+    }
+    // still moving from the last one, try again next frame
+    else requestFrame();
+  }
+  frameStats.applyTime += performance.now() - start;
+  frameStats.applied += 1;
+  if (! frameRequested) noteRendered();
+}
+
+// dashboard text is written a few times a second, not per message, so sensor frames
+// never force a layout; only the entries that changed are touched
+var dashboardHz = 4;
+var dashboardText = {};
+var dashboardShown = {};
+function showStat(id, text)
+{
+  dashboardText[id] = text;
+}
+
+setInterval(function () {
+  for (let id in dashboardText) {
+    if (dashboardShown[id] === dashboardText[id]) continue;
+    let element = document.getElementById(id);
+    if (element) element.textContent = dashboardText[id];
+    dashboardShown[id] = dashboardText[id];
+  }
+}, 1000 / dashboardHz);
+
+// frame time overlay, ?frames=1 or the f key: frame interval, time spent handling
+// messages and applying them per frame, and long tasks that block the main thread
+var frameStats = { messages: 0, messageTime: 0, applied: 0, applyTime: 0, longTasks: 0 };
+var frameOverlay = null;
+var frameIntervals = [];
+var lastFrameTime = null;
+function frameTick(timestamp)
+{
+  if (lastFrameTime !== null) {
+    let interval = timestamp - lastFrameTime;
+    if (frameOverlay) frameIntervals.push(interval);
+    noteFrame(interval);
+  }
+  lastFrameTime = timestamp;
+  window.requestAnimationFrame(frameTick);
+}
+window.requestAnimationFrame(frameTick);
+
+function showFrameOverlay(show)
+{
+  if (show && ! frameOverlay) {
+    frameOverlay = document.createElement('div');
+    frameOverlay.id = 'frametime';
+    document.body.appendChild(frameOverlay);
+    frameIntervals = [];
+  }
+  else if (! show && frameOverlay) {
+    frameOverlay.remove();
+    frameOverlay = null;
+  }
+}
+
+setInterval(function () {
+  if (frameOverlay && frameIntervals.length > 0) {
+    let sorted = frameIntervals.slice().sort(function (a, b) { return a - b; });
+    let frames = frameIntervals.length;
+    let mean = sorted.reduce(function (a, b) { return a + b; }, 0) / frames;
+    frameOverlay.textContent = "frame " + mean.toFixed(1) + "ms p95 " + sorted[Math.floor(frames * 0.95)].toFixed(1) +
+      "ms max " + sorted[frames - 1].toFixed(1) + "ms | " + (frameStats.messages / frames).toFixed(1) + " msgs/frame " +
+      (frameStats.messageTime / frames).toFixed(2) + "ms | apply " + (frameStats.applyTime / Math.max(frameStats.applied, 1)).toFixed(2) +
+      "ms | long tasks so far " + frameStats.longTasks;
+  }
+  frameIntervals = [];
+  frameStats.messages = frameStats.messageTime = frameStats.applied = frameStats.applyTime = 0;
+}, 1000);
+
+if (window.PerformanceObserver && PerformanceObserver.supportedEntryTypes &&
+    PerformanceObserver.supportedEntryTypes.indexOf('longtask') >= 0) {
+  new PerformanceObserver(function (list) { frameStats.longTasks += list.getEntries().length; }).observe({ entryTypes: ['longtask'] });
+}
+
+document.addEventListener('keydown', function (event) {
+  if (event.key == 'f') showFrameOverlay(! frameOverlay);
+});
+
+// the display's side of Telemetry.py: an NTP style clock exchange, so server timestamps
+// can be read on our clock, and every few seconds a report of what this screen showed
+var telemetryInterval = 5000;
+var syncInterval = 2000;
+var lateFrameMs = 1.5 * 1000 / 60;
+var clockOffset = null;
+var clockRtt = null;
+var syncSamples = [];
+var pendingReceived = [];
+var pendingTs = [];
+var telemetry = newTelemetry();
+var mapGestures = ['pan', 'zoom', 'combo', 'state'];
+
+function newTelemetry()
+{
+  return { frameTimes: [], lateFrames: 0, receiveToRender: [], serverToPixel: [],
+           messages: 0, dropped: 0, decodeTime: 0 };
+}
+
+function clientNow()
+{
+  return (performance.timeOrigin + performance.now()) / 1000;
+}
+
+function sendToServer(message)
+{
+  try {
+    if (typeof transport !== 'undefined' && transport == "ws") {
+      if (ws && ws.readyState == WebSocket.OPEN) ws.send(JSON.stringify(message));
+    }
+    else if (typeof rtcConnection !== 'undefined' && rtcConnection) rtcConnection.put_nowait(message);
+  }
+  catch (e) {
+    // not connected yet, the next round will do
+  }
+}
+
+function handleSync(sync)
+{
+  let t3 = clientNow();
+  let rtt = (t3 - sync.t0) - (sync.t2 - sync.t1);
+  syncSamples.push({ rtt: rtt, offset: ((sync.t1 - sync.t0) + (sync.t2 - t3)) / 2 });
+  if (syncSamples.length > 8) syncSamples.shift();
+  // the exchange with the shortest round trip had the least room for asymmetry
+  let best = syncSamples.reduce(function (a, b) { return b.rtt < a.rtt ? b : a; });
+  clockOffset = best.offset;
+  clockRtt = best.rtt;
+}
+
+function noteFrame(interval)
+{
+  telemetry.frameTimes.push(interval);
+  if (interval > lateFrameMs) telemetry.lateFrames += 1;
+}
+
+function noteRendered()
+{
+  let now = performance.now();
+  for (let received of pendingReceived) telemetry.receiveToRender.push(now - received);
+  if (clockOffset !== null) {
+    let serverNow = clientNow() + clockOffset;
+    for (let ts of pendingTs) telemetry.serverToPixel.push((serverNow - ts) * 1000);
+  }
+  pendingReceived = [];
+  pendingTs = [];
+}
+
+function summarize(values)
+{
+  if (values.length == 0) return null;
+  let sorted = values.slice().sort(function (a, b) { return a - b; });
+  return { mean: sorted.reduce(function (a, b) { return a + b; }, 0) / sorted.length,
+           p50: sorted[Math.floor(sorted.length * 0.5)],
+           p95: sorted[Math.floor(sorted.length * 0.95)],
+           max: sorted[sorted.length - 1] };
+}
+
+setInterval(function () {
+  sendToServer({ sync: { t0: clientNow() } });
+}, syncInterval);
+
+setInterval(function () {
+  let report = { offset: clockOffset, rtt: clockRtt,
+                 frames: telemetry.frameTimes.length, lateFrames: telemetry.lateFrames,
+                 frameTime: summarize(telemetry.frameTimes),
+                 receiveToRender: summarize(telemetry.receiveToRender),
+                 serverToPixel: summarize(telemetry.serverToPixel),
+                 messages: telemetry.messages, dropped: telemetry.dropped,
+                 decode: telemetry.messages ? telemetry.decodeTime / telemetry.messages : null };
+  telemetry = newTelemetry();
+  sendToServer({ telemetry: report });
+}, telemetryInterval);
+
+// loss and reordering per data channel lane, counted from the server's sequence numbers
+var laneStats = {};
+var firstFrameTime;
+function checkSequence(jsonData)
+{
+  // returns how many frames went missing just before this one, or -1 for a frame older than one already seen
+  if (firstFrameTime === undefined && jsonData.gesture) firstFrameTime = performance.now();
+  if (jsonData.seq === undefined) return 0;
+  let lane = laneStats[jsonData.lane];
+  if (! lane) lane = laneStats[jsonData.lane] = { received: 0, lost: 0, reordered: 0, next: jsonData.seq };
+  lane.received += 1;
+  if (jsonData.seq < lane.next) {
+    // counted as lost when the gap showed up, it was only late
+    lane.reordered += 1;
+    lane.lost -= 1;
+    return -1;
+  }
+  let gap = jsonData.seq - lane.next;
+  lane.lost += gap;
+  lane.next = jsonData.seq + 1;
+  return gap;
+}
+
+setInterval(function () {
+  if (typeof rtcConnection !== 'undefined' && Object.keys(laneStats).length > 0) rtcConnection.put_nowait({ lanes: laneStats, firstFrame: firstFrameTime });
+}, 5000);
+
 var handleWebSocketMessage = function (event) {
+  let start = performance.now();
+  let jsonData = JSON.parse(event.data);
+  telemetry.decodeTime += performance.now() - start;
+  handleMessage(jsonData, event.data);
+};
+
+function handleMessage(jsonData, text)
+{
+  let start = performance.now();
+  if (jsonData.sync) {
+    handleSync(jsonData.sync);
+    return;
+  }
   if (! map) return;
-  jsonData = JSON.parse(event.data);
+  telemetry.messages += 1;
+  if (mapGestures.indexOf(jsonData.gesture) >= 0) {
+    // timed from here to the frame that puts it on the map
+    pendingReceived.push(start);
+    if (jsonData.ts) pendingTs.push(jsonData.ts);
+  }
+  handleGesture(jsonData, text);
+  frameStats.messages += 1;
+  frameStats.messageTime += performance.now() - start;
+}
+
+function handleGesture(jsonData, text)
+{
+  if (! map) return;
+  let gap = checkSequence(jsonData);
+  if (gap > 0) telemetry.dropped += gap;
   //var currentZoom = map.getZoom();
   currentFeatureSet = zoomLayers[lastZoom];
   if (jsonData.type == 'spin') {
-    document.getElementById('EncoderID').innerHTML = sonData.packet.sensorID;
-    document.getElementById('EncoderIndex').innerHTML = jsonData.packet.encoderIndex;
-    document.getElementById('EncoderDelta').innerHTML = jsonData.packet.encoderDelta;
-    document.getElementById('EncoderElapsedTime').innerHTML = jsonData.packet.encoderElapsedTime;
-    document.getElementById('EncoderPosition').innerHTML = sonData.packet.encoderPosition;
+    showStat('EncoderID', jsonData.packet.sensorID);
+    showStat('EncoderIndex', jsonData.packet.encoderIndex);
+    showStat('EncoderDelta', jsonData.packet.encoderDelta);
+    showStat('EncoderElapsedTime', jsonData.packet.encoderElapsedTime);
+    showStat('EncoderPosition', jsonData.packet.encoderPosition);
   } else if (jsonData.type == 'tilt') {
-    document.getElementById('TiltsensorID').innerHTML = jsonData.packet.sensorID;
-    document.getElementById('TiltX').innerHTML = jsonData.packet.tiltX;
-    document.getElementById('TiltY').innerHTML = jsonData.packet.tiltY;
-    document.getElementById('TiltMagnitude').innerHTML = jsonData.packet.tiltMagnitude;
+    showStat('TiltsensorID', jsonData.packet.sensorID);
+    showStat('TiltX', jsonData.packet.tiltX);
+    showStat('TiltY', jsonData.packet.tiltY);
+    showStat('TiltMagnitude', jsonData.packet.tiltMagnitude);
   } else if (jsonData.gesture == 'pan') {
-    //var dampingZoom = map.getZoom()*minZoom/maxZoom;
-    if (jsonData.vector.x == 0.0 && jsonData.vector.y == 0.0) return;  
-    //console.log("sensor message: " + jsonData.type + "-" + jsonData.vector.x + "," +jsonData.vector.y);
-    document.getElementById('accelerometer').innerHTML = jsonData.vector.x.toPrecision(4) + "," +
-                                                        jsonData.vector.y.toPrecision(4);
-    let now = Date.now();
-    let elapsedTime = now - lastTiltMessageTime;
-    lastTiltMessageTime = now;
-    sumTiltTimes += elapsedTime;
-    tiltMessageCount += 1;
-    if ( tiltWindowMessageCount > 100) {
-      tiltWindowMessageCount = 1;
-      sumTiltWindowTimes = 0;
+    // pans come over an unordered lane where only the latest one matters
+    if (gap < 0) return;
+    if (gap > 0 && jsonData.center) {
+      pendingPanX = 0;
+      pendingPanY = 0;
+      pendingCenter = jsonData.center;
+      requestFrame();
     }
-    sumTiltWindowTimes += elapsedTime;
-    tiltWindowMessageCount += 1;
-    document.getElementById('tiltdatarate').innerHTML = "Tilt total " + round(sumTiltTimes/tiltMessageCount,2) + 
-                  " window " + round(sumTiltWindowTimes/tiltWindowMessageCount,2);
-    restartIdleTimer();
-                  // if (zoomLayers[currentZoom]['pannable']) map.panBy(pixelsPerGravitron*jsonData.vector.x, pixelsPerGravitron*jsonData.vector.y);
-    if (pannable) {
-      pannable = false;
-      map.panBy(pixelsPerGravitron*jsonData.vector.x, pixelsPerGravitron*jsonData.vector.y);
-    }
-                  //paintTarget();
+    else handlePan(jsonData.vector);
   } 
   else if (jsonData.gesture == 'zoom') 
     {
-
-      currentSpinPosition += jsonData.vector.delta;
-      //console.log("current spin position", currentSpinPosition, minZoom + currentSpinPosition/clicksPerZoomLevel, Date.now());
-      //console.log("sensor message: " + jsonData.gesture + " " + jsonData.vector.delta + "; currentSpinPosition=" +currentSpinPosition);
-      if (currentSpinPosition < 0) currentSpinPosition = 0;
-      var proposedZoom =  minZoom + currentSpinPosition/clicksPerZoomLevel; //Math.floor(currentSpinPosition/clicksPerZoomLevel);
-      document.getElementById('rotation').innerHTML ="spin position " + currentSpinPosition + " new Zoom " + proposedZoom;
-      restartIdleTimer();
-      let now = Date.now();
-      let elapsedTime = now - lastZoomMessageTime ;
-      lastZoomMessageTime = now;
-      sumZoomTimes += elapsedTime;
-      zoomMessageCount += 1;
-      if ( zoomWindowMessageCount > 100) {
-        zoomWindowMessageCount = 1;
-        sumZoomWindowTimes = 0;
-      }
-      sumZoomWindowTimes += elapsedTime;
-      zoomWindowMessageCount += 1;
-      document.getElementById('zoomdatarate').innerHTML ="Zoom: total " + (sumZoomTimes/zoomMessageCount).toPrecision(4) + " window " + (sumZoomWindowTimes/zoomWindowMessageCount).toPrecision(4);
-  
-      if (proposedZoom != currentZoom) 
+      handleZoom(jsonData.vector);
+    } 
+  else if (jsonData.gesture == 'hotspot') 
+    {
+      // the server tracks the view and sends discrete enter/exit events from its hotspot index
+      if (jsonData.event == 'enter') 
       {
-        //doZoom(Math.min(Object.keys(zoomLayers).length - 1, Math.max(0,proposedZoom))); 
-        doZoom(proposedZoom); 
+        console.log("zoomed in on " + jsonData.site);
+        openCedula(jsonData.site);
       }
-      else 
+      else if (jsonData.event == 'exit') 
       {
-        currView = map.getBounds();
-        if (currView != undefined) 
-        {
-          currLeft = currView.getNorthEast().lng();
-          currRight = currView.getSouthWest().lng();
-          currTop = currView.getNorthEast().lat();
-          currBottom = currView.getSouthWest().lat();
-          currWidth = currLeft - currRight;
-          currHeight = currTop - currBottom;
-          currCenter = map.getCenter();
-          hotBounds = new google.maps.LatLngBounds(
-            {lat: currCenter.lat()-targetWidth*currHeight, lng: currCenter.lng()-targetWidth*currWidth},
-            {lat: currCenter.lat()+targetWidth*currHeight, lng: currCenter.lng()+targetWidth*currWidth});
-          var hotspotFound = false;
-          for (featureKey  in currentFeatureSet)
-          {
-            if ( typeof(currentFeatureSet[featureKey]) == "string" )
-            {
-              if (hotspot[currentFeatureSet[featureKey]])
-              {
-                if (hotBounds.contains(hotspot[currentFeatureSet[featureKey]].position))
-                {
-                  if ( ! hotspotFound )
-                  {
-                    console.log("zoomed in on " + currentFeatureSet[featureKey] + " in " + hotBounds );
-                    openCedula(currentFeatureSet[featureKey]);
-                    hotspotFound = true;
-                  }
-                  else
-                    console.log("would like to have zoomed in on " + currentFeatureSet[featureKey] + " in " + hotBounds );
-
-                }
-                else
-                {
-                  //console.log("zoomed in on something else. Closing " + currentFeatureSet[featureKey] + " in " + hotBounds );
-                  closeCedula(currentFeatureSet[featureKey]);
-                }
-              }
-            }
-          } 
-        }
+        closeCedula(jsonData.site);
       }
-
-
-    } 
+    }
+  else if (jsonData.gesture == 'state') 
+    {
+      handleState(jsonData);
+    }
+  else if (jsonData.gesture == 'knock' || jsonData.gesture == 'double-knock' || jsonData.gesture == 'shake') 
+    {
+      // knocking on or shaking the table; a shake (by default) also resets the map, which
+      // arrives as a state frame, anything else is for listeners, e.g. to change language:
+      // window.addEventListener('tablegesture', function (e) { ... e.detail.gesture ... })
+      console.log("table gesture " + jsonData.gesture);
+      window.dispatchEvent(new CustomEvent('tablegesture', { detail: jsonData }));
+    }
   else if (jsonData.gesture == 'combo') 
     {
-      var dampingZoom = map.getZoom()*minZoom/maxZoom;
-
-      if (jsonData.vector.x != 0.0 && jsonData.vector.y != 0.0) 
-      {                
-        map.panBy(100*jsonData.vector.x, 100*jsonData.vector.y);
-        restartIdleTimer();
-      }
-      currentSpinPosition += jsonData.vector.delta;
-      if (currentSpinPosition < 0) currentSpinPosition = 0;
-      //var proposedZoom = Math.floor(currentSpinPosition/clicksPerZoomLevel);
-      var proposedZoom = minZoom + currentSpinPosition/clicksPerZoomLevel;
-      if (proposedZoom != currentZoom) 
-      {
-        doZoom(proposedZoom);
-        restartIdleTimer();
-      }
-
-
+      // tilt and spin sampled together, fused into one frame by the server
+      if (jsonData.vector.x != 0.0 || jsonData.vector.y != 0.0) handlePan(jsonData.vector);
+      if (jsonData.vector.delta) handleZoom(jsonData.vector);
     }
   else { 
     messages = document.getElementsByTagName('ul')[0];
     var message = document.createElement('li');
-    var content = document.createTextNode(event.data);
+    var content = document.createTextNode(text || JSON.stringify(jsonData));
     message.appendChild(content);
     messages.appendChild(message);
   }
-};
+}
 
+loadCedulaManifest();
+loadHotspotLayers();
 startIdleTimer();
+if (new URLSearchParams(window.location.search).get("frames")) showFrameOverlay(true);
 